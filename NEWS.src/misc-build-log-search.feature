@@ -0,0 +1 @@
+Build logs can be searched on the server with "rmake query --grep", which only sends back the matching lines and optional context ("--grep-context") instead of the whole log, and "--max-matches" limits the number of matches shown.
@@ -0,0 +1 @@
+Build logs are now pushed over the message bus to "rmake watch" and other commands that tail them. A client catches up once, then asks the server to follow the log from its byte offset. New log data is sent as it is received, so clients no longer poll getTroveBuildLog every second. If part of the stream is lost, the client fetches the missing range directly. When the server cannot stream logs, the client falls back to polling.
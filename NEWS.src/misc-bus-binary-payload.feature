@@ -0,0 +1 @@
+Message bus clients and the message bus now negotiate a compact binary payload encoding when a session connects, which is much cheaper to encode and decode than XML-RPC. Clients and buses that don't support it keep using XML.
@@ -0,0 +1 @@
+Message bus connections now send queued messages in batches with a single socket write, instead of writing the lead, headers and payload of each message separately.
@@ -0,0 +1 @@
+The message bus now uses epoll on Linux, so its cost per event no longer grows with the number of connected nodes. rmake-messagebus has a new --poller option to select the backend. rmake_test/busload.py is a load test that measures bus throughput and fan-out latency for a given number of sessions.
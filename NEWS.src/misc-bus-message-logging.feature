@@ -0,0 +1 @@
+The message bus transcript now has one line per message at the default level. Full messages and per-session deliveries are logged only at debug level, which rmake-messagebus --log-messages-level=debug enables. Message types can be sampled with --sample-rate TYPE=RATE, and log lines are only formatted when they are written. The bus keeps a trace of the most recent messages, which "rmake-server status trace" displays.
@@ -0,0 +1 @@
+The message bus can now bound the messages waiting to be sent to each session, by count and by size, with a policy per session class: drop the oldest messages, coalesce node status updates, or disconnect the session. Command line clients watching jobs are limited by default; other classes can be configured with the message bus's --queue-limit option. Per-session queue depth, queued bytes and dropped message counts, along with the bus's total queued bytes and memory use, are available over the admin RPC and shown by "rmake-server status messagebus".
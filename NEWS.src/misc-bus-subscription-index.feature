@@ -0,0 +1 @@
+The message bus now indexes subscriptions by channel and filter attribute, so routing a message costs the same however many sessions are subscribed to other values on that channel. Removing a disconnected session's subscriptions no longer rebuilds every channel's subscriber list.
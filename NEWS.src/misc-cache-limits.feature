@@ -0,0 +1 @@
+The changeset cache can now be limited in size with the cacheSizeLimit and cacheEntryLimit options. The least recently used entries are removed first. Nodes report cache hit, miss and size counts with their status.
@@ -0,0 +1 @@
+Worker nodes tell the dispatcher which troves are in their cached chroots and reusable old chroots. They send this as compact Bloom filters with each heartbeat. The dispatcher sends each build to the capable node that has the fewest build requirements left to install. "rmake-server status dispatcher" shows how many build requirements were already on the chosen nodes, compared with choosing by load alone.
@@ -0,0 +1 @@
+Looking up a partially matching cached chroot now uses an index of the cached manifests (manifests.db in the chroot cache directory) instead of reading every manifest in the cache. The index is built the first time it is used and is kept up to date as chroots are stored and removed.
@@ -0,0 +1 @@
+Built changesets are now committed to the repository by a separate queue on each node, so a finished build frees its chroot and slot without waiting for the upload. Troves are marked built once their commit is done. The commitSlots option limits how many commits run at once, and commits that fail to connect to the repository are retried up to commitRetries times.
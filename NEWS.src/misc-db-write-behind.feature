@@ -0,0 +1 @@
+Job and trove status updates from running builds are now written to the database in batches, up to half a second after they happen, instead of one transaction per event. Repeated state changes of the same trove within that time are written only once. All job and trove log messages are still kept, and everything is written as soon as a job finishes.
@@ -0,0 +1,5 @@
+Added a 'dedup' type of chrootcache that stores each distinct file only
+once, no matter how many cached chroots contain it, and restores chroots by
+hardlinking. Like the 'hardlink' type, the cache should be on the same
+filesystem as the chroots. Files no longer used by any cached chroot are
+deleted by "rmake-node clean-cache".
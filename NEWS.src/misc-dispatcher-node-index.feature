@@ -0,0 +1 @@
+The dispatcher keeps its open nodes ranked as they are assigned commands and send heartbeats, and remembers which nodes can build each set of flavors, so assigning queued commands no longer compares every command's flavors against every node.
@@ -0,0 +1 @@
+Finished build logs are now compressed in independent 256 KB blocks, and an index of the blocks is stored next to the log. Reading the end of a large log, or following it from a saved position, only decompresses the blocks needed. The compressed logs are still ordinary gzip files, and logs compressed by earlier versions can still be read.
@@ -0,0 +1 @@
+Build logs are now received by the rMake server's main event loop instead of by a separate process per log. Data is appended to the plaintext log as it arrives, and compression is done once the log is closed, by at most logCompressors (default 2) processes at a time.
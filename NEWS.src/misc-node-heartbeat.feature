@@ -0,0 +1 @@
+Worker node heartbeats no longer run df or read /proc/cpuinfo every status period, and no longer carry a full description of the node. CPUs and mounts are sent once when the node registers. After that, each heartbeat sends only the load, memory, uptime, free space in the chroot directory, and running commands. The dispatcher no longer inspects its own host when it receives node information.
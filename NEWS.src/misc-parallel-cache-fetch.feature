@@ -0,0 +1 @@
+The changeset cache now downloads missing changesets in parallel. The number of concurrent downloads is set by the new cacheFetchThreads option.
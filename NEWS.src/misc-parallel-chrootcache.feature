@@ -0,0 +1,6 @@
+Added 'pigz' and 'zstd' types of chrootcache. The 'zstd' type writes
+archives with pzstd, which splits them into independent frames so that
+they are compressed and restored using all CPUs. The 'pigz' type compresses
+using all CPUs and produces the same .tar.gz archives as the 'local' type,
+so it can be switched to on an existing cache, but restoring a gzip archive
+still decompresses on one CPU.
@@ -0,0 +1 @@
+Nodes now start every queued command that fits in their free slots at once instead of one per loop iteration. Queued commands are started in priority order, with dependency resolution and job loading ahead of builds and older jobs ahead of newer ones. The new lightSlots option gives resolve and load commands their own slots, which the dispatcher also uses, so they no longer wait behind chroot builds.
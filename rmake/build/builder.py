@@ -68,6 +68,13 @@ class Builder(object):
         build.
         @type buildCfg: rmake.build.buildcfg.BuildConfiguration instance.
     """
+
+    # How long the main loop blocks waiting on the worker when there is
+    # nothing else to do.  Every change to the build state arrives as an
+    # event from the worker, which wakes the loop immediately, so this
+    # only bounds how long dead children can go uncollected.
+    idleTimeout = 1.0
+
     def __init__(self, serverCfg, job, jobContext=None, db=None):
         self.serverCfg = serverCfg
         self.buildCfg = job.getMainConfig()
@@ -87,6 +94,7 @@ class Builder(object):
         else:
             self.jobContext = []
         self.initialized = False
+        self.dispatchLatencies = []
 
 
     def _installSignalHandlers(self):
@@ -178,7 +186,7 @@ class Builder(object):
                 self.serverCfg.reposName)
 
             while self.job.isLoading() and self.worker.hasActiveTroves():
-                self.worker.handleRequestIfReady()
+                self.worker.handleRequestIfReady(self._flushDb())
                 self.worker._checkForResults()
 
             if self.job.isFailed():
@@ -241,17 +249,26 @@ class Builder(object):
         self.job.jobBuilding('Building troves')
         if self.dh.moreToDo():
             while self.dh.moreToDo():
-                self.worker.handleRequestIfReady()
+                # don't block here - there may be troves ready to go.
+                self.worker.handleRequestIfReady(0)
                 if self.worker._checkForResults():
                     self.resolveIfReady()
                 elif self.dh.hasBuildableTroves():
                     trv, (buildReqs, crossReqs, bootstrapReqs
                             ) = self.dh.popBuildableTrove()
                     self.buildTrove(trv, buildReqs, crossReqs, bootstrapReqs)
+                    self._recordDispatchLatency(trv)
                 elif self.dh.hasSpecialTroves():
                     self.actOnTrove(self.dh.popSpecialTrove())
-                elif not self.resolveIfReady():
-                    time.sleep(0.1)
+                elif self.resolveIfReady():
+                    pass
+                elif not self.dh.hasBuildableTroves():
+                    # Nothing can change until the worker tells us
+                    # something, so sleep until it does.  (A cached
+                    # resolution can make a trove buildable without any
+                    # event, hence the check above.)
+                    self.worker.handleRequestIfReady(self._flushDb())
+            self._logDispatchLatency()
             if self.dh.jobPassed():
                 self.job.jobPassed("build job finished successfully")
                 return True
@@ -268,6 +285,44 @@ class Builder(object):
             self.job.jobFailed(''.join(msg))
         return False
 
+    def _flushDb(self):
+        """
+            Write any delayed job updates that are due, and return how long
+            the main loop may block waiting for events.
+        """
+        timeout = self.idleTimeout
+        if self.db is not None:
+            flushTimeout = self.db.flushWriteBehind()
+            if flushTimeout is not None:
+                timeout = min(timeout, flushTimeout)
+        return timeout
+
+    def _recordDispatchLatency(self, trove):
+        buildableTime = self.dh.getBuildableTime(trove)
+        if buildableTime is None:
+            return
+        latency = time.time() - buildableTime
+        self.dispatchLatencies.append(latency)
+        self.logger.debug('%s dispatched %.3fs after becoming buildable'
+                          % (trove.getName(), latency))
+
+    def getDispatchLatency(self):
+        """
+            Returns (count, average, maximum) of the time in seconds
+            between troves becoming buildable and being sent to a worker.
+        """
+        latencies = self.dispatchLatencies
+        if not latencies:
+            return 0, 0.0, 0.0
+        return (len(latencies), sum(latencies) / len(latencies),
+                max(latencies))
+
+    def _logDispatchLatency(self):
+        count, average, maximum = self.getDispatchLatency()
+        if count:
+            self.logger.info('Dispatched %s troves: average latency %.3fs,'
+                             ' max %.3fs' % (count, average, maximum))
+
     def actOnTrove(self, trove):
         logData = self.startTroveLogger(trove)
         trove.disown()
@@ -23,6 +23,7 @@ import errno
 import itertools
 import os
 import sys
+import time
 import traceback
 import xmlrpclib
 
@@ -107,10 +108,208 @@ class ResolveJob(object):
 register(ResolveJob)
 
 class DependencyGraph(graph.DirectedGraph):
+    """
+        Directed graph that keeps its strongly connected components and the
+        set of leaf components up to date as nodes and edges are added and
+        removed.  Asking for the leaf cycles after a trove is built or
+        failed only costs work proportional to the nodes that changed,
+        instead of a full traversal of the graph.
+    """
+
+    def __init__(self):
+        graph.DirectedGraph.__init__(self)
+        self._components = {}
+        self._leafComponents = set()
+        # the graph is built all at once when a job is loaded, so only
+        # compute the components the first time they are asked for.
+        self._componentsDirty = True
+        # incremented every time the set of leaf components changes.
+        self.leafVersion = 0
+
     # FIXME: remove with next release of conary
     def __contains__(self, trove):
         return trove in self.data.hashedData
 
+    def addNode(self, item):
+        isNew = item not in self
+        rv = graph.DirectedGraph.addNode(self, item)
+        if isNew and not self._componentsDirty:
+            component = frozenset([item])
+            self._components[item] = component
+            self._leafComponents.add(component)
+            self.leafVersion += 1
+        return rv
+
+    def addEdge(self, fromItem, toItem, value=1):
+        self.addNode(fromItem)
+        self.addNode(toItem)
+        graph.DirectedGraph.addEdge(self, fromItem, toItem, value)
+        if self._componentsDirty:
+            return
+        fromComponent = self._components[fromItem]
+        toComponent = self._components[toItem]
+        if fromComponent is toComponent:
+            return
+        reachable = self._getReachable(toItem)
+        if not reachable.isdisjoint(fromComponent):
+            # this edge closes a cycle and merges several components.
+            self._mergeComponents(fromComponent, reachable)
+        elif fromComponent in self._leafComponents:
+            self._leafComponents.remove(fromComponent)
+            self.leafVersion += 1
+
+    def delete(self, item):
+        if self._componentsDirty or item not in self:
+            return graph.DirectedGraph.delete(self, item)
+        parents = [ x for x in self.getParents(item) if x != item ]
+        component = self._components.pop(item)
+        graph.DirectedGraph.delete(self, item)
+        self._leafComponents.discard(component)
+        remaining = component - set([item])
+        if remaining:
+            # removing a node from a cycle may split it apart.
+            self._updateComponents(remaining)
+        self._updateLeafStatus(set(self._components[x] for x in parents
+                                   if x in self._components))
+        self.leafVersion += 1
+
+    def deleteEdges(self, item):
+        if self._componentsDirty or item not in self:
+            return graph.DirectedGraph.deleteEdges(self, item)
+        graph.DirectedGraph.deleteEdges(self, item)
+        component = self._components[item]
+        self._leafComponents.discard(component)
+        if len(component) > 1:
+            self._updateComponents(component)
+        else:
+            self._updateLeafStatus([component])
+        self.leafVersion += 1
+
+    def hasChildren(self, node):
+        for child in self.iterChildren(node):
+            return True
+        return False
+
+    def getLeafComponents(self):
+        """
+            Returns the strongly connected components that have no edges
+            to other components.  Equivalent to
+            getStronglyConnectedGraph().getLeaves(), but maintained
+            incrementally.
+        """
+        if self._componentsDirty:
+            self._componentsDirty = False
+            self._components = {}
+            self._leafComponents = set()
+            self._updateComponents(list(self.data.hashedData))
+            self.leafVersion += 1
+        return list(self._leafComponents)
+
+    def _getReachable(self, start):
+        """
+            Returns the nodes reachable from start.  Nothing leaves a leaf
+            component, so only the members of one that an edge enters are
+            included.
+        """
+        seen = set([start])
+        stack = [start]
+        while stack:
+            node = stack.pop()
+            if self._components[node] in self._leafComponents:
+                continue
+            for child in self.iterChildren(node):
+                if child not in seen:
+                    seen.add(child)
+                    stack.append(child)
+        return seen
+
+    def _mergeComponents(self, component, reachable):
+        """
+            Merges component with every component on a path back to it
+            from the reachable nodes, after an edge leaving component
+            closed a cycle.
+        """
+        members = set(component)
+        stack = list(component)
+        while stack:
+            for parent in self.getParents(stack.pop()):
+                if parent in reachable and parent not in members:
+                    members.add(parent)
+                    stack.append(parent)
+        merged = frozenset(members)
+        for node in merged:
+            self._leafComponents.discard(self._components[node])
+            self._components[node] = merged
+        self._updateLeafStatus([merged])
+        self.leafVersion += 1
+
+    def _updateLeafStatus(self, components):
+        for component in components:
+            isLeaf = True
+            for node in component:
+                for child in self.iterChildren(node):
+                    if child not in component:
+                        isLeaf = False
+                        break
+                if not isLeaf:
+                    break
+            if isLeaf:
+                self._leafComponents.add(component)
+            else:
+                self._leafComponents.discard(component)
+
+    def _updateComponents(self, nodes):
+        """
+            Recomputes the strongly connected components among nodes,
+            only following edges that stay within nodes.  Uses an
+            iterative version of Tarjan's algorithm.
+        """
+        nodes = set(nodes)
+        def _children(node):
+            return [ x for x in self.iterChildren(node) if x in nodes ]
+
+        index = {}
+        lowLink = {}
+        stack = []
+        onStack = set()
+        newComponents = []
+        for root in nodes:
+            if root in index:
+                continue
+            index[root] = lowLink[root] = len(index)
+            stack.append(root)
+            onStack.add(root)
+            work = [(root, iter(_children(root)))]
+            while work:
+                node, children = work[-1]
+                for child in children:
+                    if child not in index:
+                        index[child] = lowLink[child] = len(index)
+                        stack.append(child)
+                        onStack.add(child)
+                        work.append((child, iter(_children(child))))
+                        break
+                    elif child in onStack:
+                        lowLink[node] = min(lowLink[node], index[child])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        lowLink[parent] = min(lowLink[parent], lowLink[node])
+                    if lowLink[node] == index[node]:
+                        members = []
+                        while True:
+                            member = stack.pop()
+                            onStack.remove(member)
+                            members.append(member)
+                            if member == node:
+                                break
+                        newComponents.append(frozenset(members))
+        for component in newComponents:
+            for node in component:
+                self._components[node] = component
+        self._updateLeafStatus(newComponents)
+
     def generateDotFile(self, out, filterFn=None):
         def formatNode(node):
             name, version, flavor, context = node.getNameVersionFlavor(True)
@@ -157,6 +356,7 @@ class DependencyBasedBuildState(AbstractBuildState):
         self.dumbMode = dumbMode
         self.trovesByPackage = {}
         self.buildReqTroves = {}
+        self.buildableTimes = {}
         self.groupsByNameVersion = {}
 
         self.depGraph = DependencyGraph()
@@ -324,7 +524,7 @@ class DependencyBasedBuildState(AbstractBuildState):
 
     def hasHardDependency(self, trove):
         return (trove in self.hardDepGraph
-                and trove not in self.hardDepGraph.getLeaves())
+                and self.hardDepGraph.hasChildren(trove))
 
     def areRelated(self, trove1, trove2):
         if trove1 == trove2:
@@ -355,6 +555,7 @@ class DependencyBasedBuildState(AbstractBuildState):
 
     def troveBuilt(self, trove, binaryTroveList):
         self.buildReqTroves.pop(trove, False)
+        self.buildableTimes.pop(trove, None)
         self.depGraph.delete(trove)
         self.hardDepGraph.delete(trove)
 
@@ -393,9 +594,14 @@ class DependencyBasedBuildState(AbstractBuildState):
     def troveFailed(self, trove):
         self.depGraph.delete(trove)
         self.buildReqTroves.pop(trove, False)
+        self.buildableTimes.pop(trove, None)
 
     def troveBuildable(self, trove, buildReqs, crossReqs, bootstrapReqs):
         self.buildReqTroves[trove] = (buildReqs, crossReqs, bootstrapReqs)
+        self.buildableTimes[trove] = time.time()
+
+    def getBuildableTime(self, trove):
+        return self.buildableTimes.get(trove)
 
     def hasCrossRequirements(self, trove):
         for childTrove, reason in self.depGraph.getChildren(trove,
@@ -456,6 +662,7 @@ class DependencyHandler(object):
         self.graphCount = 0
         self._resolving = {}
         self.priorities = []
+        self._prioritizedLeaves = (None, None)
         self._delayed = {}
         self._cycleChecked = {}
         self._seenCycles = []
@@ -544,6 +751,13 @@ class DependencyHandler(object):
     def popBuildableTrove(self):
         return self.depState.popBuildableTrove()
 
+    def getBuildableTime(self, trove):
+        """
+            Returns the time at which trove became buildable, or None
+            if it never did.
+        """
+        return self.depState.getBuildableTime(trove)
+
     def jobPassed(self):
         return self.depState.jobPassed()
 
@@ -729,6 +943,7 @@ class DependencyHandler(object):
 
     def prioritize(self, trv):
         self.priorities.append(trv)
+        self._prioritizedLeaves = (None, None)
 
     def getPriority(self, trv):
         if trv in self.priorities:
@@ -778,18 +993,14 @@ class DependencyHandler(object):
         if len(self._resolving) >= 10:
             return None
 
-        compGraph = self.depState.depGraph.getStronglyConnectedGraph()
-        leafCycles = compGraph.getLeaves()
         if self._allowFastResolution:
+            leafCycles = depGraph.getLeafComponents()
             result = self._attemptFastResolve(breakCycles=breakCycles,
                                               nodeLists=leafCycles)
             if result or self._allowFastResolution:
                 return result
 
-        leafCycles = [ (min(self.getPriority(x) for x in leafCycle), 
-                       sorted(leafCycle, key=self.getPriority))
-                        for leafCycle in leafCycles ]
-        leafCycles = [ x[1] for x in sorted(leafCycles) ]
+        leafCycles = self._getPrioritizedLeafCycles()
         newCycles = [ x for x in leafCycles if (len(x) > 1
                                              and x not in self._seenCycles
                                              and self._filterTroves(x) == x) ]
@@ -832,6 +1043,24 @@ class DependencyHandler(object):
             trv.troveMissingDependencies(missingDeps)
         self._delayed = {}
 
+    def _getPrioritizedLeafCycles(self):
+        """
+            Returns the leaf cycles of the dependency graph, each sorted
+            by priority, in priority order.  The result is cached until
+            either the leaves of the graph or the priorities change.
+        """
+        depGraph = self.depState.depGraph
+        leafCycles = depGraph.getLeafComponents()
+        version, prioritized = self._prioritizedLeaves
+        if version == depGraph.leafVersion:
+            return prioritized
+        prioritized = [ (min(self.getPriority(x) for x in leafCycle),
+                         sorted(leafCycle, key=self.getPriority))
+                         for leafCycle in leafCycles ]
+        prioritized = [ x[1] for x in sorted(prioritized) ]
+        self._prioritizedLeaves = (depGraph.leafVersion, prioritized)
+        return prioritized
+
     def _getResolveJobFromCycle(self, depGraph, cycleTroves):
         def _cycleNodeOrder(node):
             """ 
@@ -935,6 +1164,7 @@ class DependencyHandler(object):
 
         if trv in self.priorities:
             self.priorities.remove(trv)
+            self._prioritizedLeaves = (None, None)
         if results.success:
             if self._resolverCache:
                 self._resolverCache.put(results)
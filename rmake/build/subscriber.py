@@ -31,6 +31,8 @@
     NOTE: there is one other internal subscriber, the dependency handler.
 """
 
+import time
+
 from rmake.lib import apiutils
 from rmake.lib import subscriber
 from rmake.lib.apiutils import thaw, freeze
@@ -65,49 +67,127 @@ class _JobDbLogger(_InternalSubscriber):
         'TROVE_LOG_UPDATED'      : 'troveLogUpdated',
     }
 
-    def __init__(self, db):
+    def __init__(self, db, flushInterval=0):
         self.db = db
+        self.flushInterval = flushInterval
+        self._pending = []
+        self._pendingSince = None
+        self._flushNow = False
+        self._queuedUpdates = set()
         _InternalSubscriber.__init__(self)
+        if flushInterval:
+            db.addWriteBehind(self)
 
     def _receiveEvents(self, apiVersion, eventList):
-        self.db.commitAfter(
-            _InternalSubscriber._receiveEvents, self,
-            apiVersion, eventList)
+        _InternalSubscriber._receiveEvents(self, apiVersion, eventList)
+        if self._flushNow or not self.flushInterval:
+            self.flush()
+        else:
+            self.flushIfDue()
+
+    # Write-behind: database writes are queued in order and written in one
+    # transaction at most flushInterval seconds later.  Trove and job rows
+    # are written from the object as it is at flush time, so only the first
+    # queued update of each row is kept; log messages are all kept.
+
+    def _queue(self, fn, *args):
+        if self._pendingSince is None:
+            self._pendingSince = time.time()
+        self._pending.append((fn, args))
+
+    def _queueBarrier(self, fn, *args):
+        # Rewrites rows wholesale, so later updates must come after it.
+        self._queuedUpdates.clear()
+        self._queue(fn, *args)
+
+    def _queueTroveUpdate(self, trove):
+        key = (trove.jobId, trove.getNameVersionFlavor(True))
+        if key not in self._queuedUpdates:
+            self._queuedUpdates.add(key)
+            self._queue(self.db.jobStore.updateTrove, trove)
+
+    def _queueJobUpdate(self, job):
+        if job.jobId not in self._queuedUpdates:
+            self._queuedUpdates.add(job.jobId)
+            self._queue(self.db.jobStore.updateJob, job)
+
+    def flush(self):
+        """
+        Write all queued changes to the database.
+        """
+        if not self._pending:
+            return
+        pending = self._pending
+        self._pending = []
+        self._pendingSince = None
+        self._flushNow = False
+        self._queuedUpdates.clear()
+        self.db.commitAfter(self._write, pending)
+
+    @staticmethod
+    def _write(pending):
+        for fn, args in pending:
+            fn(*args)
+
+    def flushIfDue(self):
+        if self.getFlushTimeout() == 0:
+            self.flush()
+
+    def getFlushTimeout(self):
+        """
+        Return the number of seconds until the queued changes are due to be
+        written, or C{None} if there are none.
+        """
+        if self._pendingSince is None:
+            return None
+        return max(0, self._pendingSince + self.flushInterval - time.time())
 
     def trovePreparingChroot(self, trove, host, path):
-        self.db.trovePreparingChroot(trove)
+        self._queueTroveUpdate(trove)
+        self._queue(self.db.nodeStore.setChrootActive, trove, True)
 
     def troveBuilt(self, trove, troveList):
-        self.db.troveBuilt(trove)
+        self._queueTroveUpdate(trove)
+        self._queue(self.db.jobStore.setBinaryTroves, trove,
+                trove.getBinaryTroves())
 
     def troveFailed(self, trove, failureReason):
-        self.db.troveFailed(trove)
+        self._queueTroveUpdate(trove)
 
     def troveBuilding(self, trove, pid, settings=[]):
         for setting in settings:
             trove.settings[setting[0]] = setting[1]
-        self.db.troveBuilding(trove)
+        self._queueTroveUpdate(trove)
+        self._queue(self.db.nodeStore.setChrootActive, trove, True)
 
     def troveResolving(self, trove, hostName, pid):
-        self.db.troveResolving(trove)
+        self._queueTroveUpdate(trove)
 
     def troveStateUpdated(self, trove, state, status):
-        self.db.updateTroveStatus(trove)
+        self._queueTroveUpdate(trove)
+        if trove.isFinished():
+            self._queue(self.db.nodeStore.setChrootActive, trove, False)
 
     def troveLogUpdated(self, trove, state, status):
-        self.db.updateTroveLog(trove, status)
+        self._queue(self.db.jobStore.updateTroveLog, trove, status)
+        self._queueTroveUpdate(trove)
 
     def jobStateUpdated(self, job, state, status):
-        self.db.updateJobStatus(job)
+        self._queue(self.db.jobStore.updateJobLog, job, status)
+        self._queueJobUpdate(job)
+        if job.isFinished():
+            self._flushNow = True
 
     def jobLogUpdated(self, job, state, status):
-        self.db.updateJobLog(job, status)
+        self._queue(self.db.jobStore.updateJobLog, job, status)
+        self._queueJobUpdate(job)
 
     def jobTrovesSet(self, job, troveList):
-        self.db.setBuildTroves(job)
+        self._queueBarrier(self.db.jobStore.setBuildTroves, job)
 
     def jobCommitted(self, job, troveTupleMap):
-        self.db.jobCommitted(job, troveTupleMap)
+        self._queueBarrier(self.db.jobCommitted, job, troveTupleMap)
+        self._flushNow = True
 
 
 class _RmakePublisherProxy(_InternalSubscriber):
@@ -32,3 +32,17 @@ class TroveSettings(cfg.ConfigFile, buildcfg.FreezableConfigMixin):
     def __init__(self):
         cfg.ConfigFile.__init__(self)
         buildcfg.FreezableConfigMixin.__init__(self)
+        self._savedState = None
+
+    def markSaved(self, frozen):
+        """
+        Record C{frozen} as the settings last written to the database.
+        """
+        self._savedState = frozen
+
+    def isSaved(self, frozen):
+        """
+        Return C{True} if C{frozen} matches the settings last written to the
+        database, so they do not need to be written again.
+        """
+        return frozen == self._savedState
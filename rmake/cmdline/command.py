@@ -667,6 +667,12 @@ class QueryCommand(rMakeCommand):
             'all'             : 'Show all jobs (not just last 20)',
             'active'          : 'Show only active jobs',
             'show-config'     : 'Show configuration for this job',
+            'grep'            : ('Show only build log lines matching a '
+                                 'regular expression', 'PATTERN'),
+            'grep-context'    : ('Show this many lines around each build '
+                                 'log match', 'NUM'),
+            'max-matches'     : ('Show at most this many matches in each '
+                                 'build log', 'NUM'),
            }
 
 
@@ -682,6 +688,9 @@ class QueryCommand(rMakeCommand):
         argDef['all']        = NO_PARAM
         argDef['active']        = NO_PARAM
         argDef['show-config'] = NO_PARAM
+        argDef['grep'] = ONE_PARAM
+        argDef['grep-context'] = ONE_PARAM
+        argDef['max-matches'] = ONE_PARAM
         rMakeCommand.addParameters(self, argDef)
 
     def runCommand(self, client, cfg, argSet, args):
@@ -712,18 +721,33 @@ class QueryCommand(rMakeCommand):
             limit = 20
         activeOnly     = argSet.pop('active', False)
         watchJob       = argSet.pop('watch', False)
+        logPattern     = argSet.pop('grep', None)
+        try:
+            logContext = int(argSet.pop('grep-context', 0))
+            maxLogMatches = int(argSet.pop('max-matches', 0))
+        except ValueError:
+            self.usage()
+            log.error("--grep-context and --max-matches take a number")
+            return 1
+        if logPattern:
+            showBuildLogs = True
+        else:
+            showBuildLogs = showLogs
         query.displayJobInfo(client, jobId, troveSpecs,
                                     displayTroves=displayTroves,
                                     displayDetails=displayDetails,
                                     showLogs=showLogs,
-                                    showBuildLogs=showLogs,
+                                    showBuildLogs=showBuildLogs,
                                     showFullVersions=showFullVersions,
                                     showFullFlavors=showFullFlavors,
                                     showLabels=showLabels,
                                     showTracebacks=showTracebacks,
                                     showConfig=showConfig,
                                     jobLimit=limit,
-                                    activeOnly=activeOnly)
+                                    activeOnly=activeOnly,
+                                    logPattern=logPattern,
+                                    logContext=logContext,
+                                    maxLogMatches=maxLogMatches)
         if watchJob:
             client.watch(jobId, showBuildLogs = True, showTroveLogs = True)
 
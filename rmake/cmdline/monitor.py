@@ -150,6 +150,10 @@ class SilentDisplay(_AbstractDisplay):
 
 class JobLogDisplay(_AbstractDisplay):
 
+    # Seconds to wait for the server to start pushing a build log before
+    # deciding that it can't, and polling for it instead.
+    logStreamTimeout = 10
+
     def __init__(self, client, showBuildLogs=True, out=None,
                  exitOnFinish=None):
         _AbstractDisplay.__init__(self, client, out=out,
@@ -157,6 +161,17 @@ class JobLogDisplay(_AbstractDisplay):
             exitOnFinish=exitOnFinish)
         self.buildingTroves = {}
         self.lastLogPoll = 0
+        self.logStream = None
+        # (jobId, troveTuple) -> time the log was requested, True once the
+        # server is pushing it, or False if it never answered.
+        self.streamingTroves = {}
+
+    def setLogStream(self, logStream):
+        """
+        Have build logs pushed by C{logStream} (an EventReceiver) instead
+        of polling for them.
+        """
+        self.logStream = logStream
 
     def _tailBuildLog(self, jobId, troveTuple):
         mark = self.buildingTroves.get((jobId, troveTuple), [0])[0]
@@ -166,6 +181,18 @@ class JobLogDisplay(_AbstractDisplay):
     def _stopTailing(self, jobId, troveTuple):
         mark = self.buildingTroves.get((jobId, troveTuple), [0])[0]
         self.buildingTroves[jobId, troveTuple] = [ mark, False ]
+        if self.streamingTroves.pop((jobId, troveTuple), False):
+            self.logStream.unfollowBuildLog(jobId, troveTuple)
+
+    def _isStreaming(self, jobId, troveTuple):
+        state = self.streamingTroves.get((jobId, troveTuple))
+        if state is None or state is True or state is False:
+            return bool(state)
+        if time.time() - state < self.logStreamTimeout:
+            return True
+        # The server doesn't support pushing logs.
+        self.streamingTroves[jobId, troveTuple] = False
+        return False
 
     def _serveLoopHook(self):
         if not self.buildingTroves:
@@ -175,7 +202,7 @@ class JobLogDisplay(_AbstractDisplay):
             return
         self.lastLogPoll = now
         for (jobId, troveTuple), (mark, tail) in self.buildingTroves.items():
-            if not tail:
+            if not tail or self._isStreaming(jobId, troveTuple):
                 continue
             try:
                 moreData, data, mark = self.client.getTroveBuildLog(jobId,
@@ -189,6 +216,42 @@ class JobLogDisplay(_AbstractDisplay):
                 del self.buildingTroves[jobId, troveTuple]
             else:
                 self.buildingTroves[jobId, troveTuple][0] =  mark
+                if (self.logStream
+                        and (jobId, troveTuple) not in self.streamingTroves):
+                    # Caught up; have the rest pushed from here on.
+                    self.streamingTroves[jobId, troveTuple] = time.time()
+                    self.logStream.followBuildLog(jobId, troveTuple, mark)
+
+    def _buildLogReceived(self, jobId, troveTuple, offset, data, isFinal):
+        key = jobId, troveTuple
+        if key not in self.buildingTroves or key not in self.streamingTroves:
+            return
+        self.streamingTroves[key] = True
+        mark, tail = self.buildingTroves[key]
+        if offset > mark:
+            # Part of the log was lost on the way, fetch it directly.
+            try:
+                moreData, data, mark = self.client.getTroveBuildLog(jobId,
+                                                                    troveTuple,
+                                                                    mark)
+            except:
+                # Poll from the last mark again rather than waiting on a
+                # stream that may already have ended; polling follows the
+                # log again once it has caught up.
+                del self.streamingTroves[key]
+                self.logStream.unfollowBuildLog(jobId, troveTuple)
+                return
+            isFinal = isFinal or not moreData
+        else:
+            data = data[mark - offset:]
+            mark += len(data)
+        if tail:
+            self.out.write(data)
+        if isFinal:
+            del self.buildingTroves[key]
+            del self.streamingTroves[key]
+        else:
+            self.buildingTroves[key][0] = mark
 
     def _jobTrovesSet(self, jobId, troveData):
         self._msg('[%d] - job troves set' % jobId)
@@ -48,7 +48,8 @@ class DisplayConfig(object):
                  displayJobDetail=False, displayTroveDetail=False,
                  showLogs=False, showBuildLogs=False, showFullVersions=False,
                  showFullFlavors=False, showLabels=False,
-                 showTracebacks=False, showConfig=False):
+                 showTracebacks=False, showConfig=False, logPattern=None,
+                 logContext=0, maxLogMatches=0):
         self.client = client
         self.displayTroves = displayTroves
         self.displayJobs = displayJobs
@@ -61,6 +62,10 @@ class DisplayConfig(object):
         self.showLabels = showLabels
         self.showTracebacks = showTracebacks
         self.showConfig = showConfig
+        # only show the parts of build logs matching this regex
+        self.logPattern = logPattern
+        self.logContext = logContext
+        self.maxLogMatches = maxLogMatches
 
         self.needTroves = displayTroves or displayJobDetail or showBuildLogs
 
@@ -116,6 +121,7 @@ def displayJobInfo(client, jobId=None, troveSpecs=[], displayTroves=False,
                    showFullVersions=False, showFullFlavors=False,
                    showLabels=False, showTracebacks=False,
                    showConfig=False, activeOnly=False, jobLimit=None,
+                   logPattern=None, logContext=0, maxLogMatches=0,
                    out=sys.stdout):
     if troveSpecs:
         displayTroves = True
@@ -140,7 +146,10 @@ def displayJobInfo(client, jobId=None, troveSpecs=[], displayTroves=False,
                          showBuildLogs=showBuildLogs,
                          showFullVersions=showFullVersions,
                          showFullFlavors=showFullFlavors,
-                         showLabels=showLabels)
+                         showLabels=showLabels,
+                         logPattern=logPattern,
+                         logContext=logContext,
+                         maxLogMatches=maxLogMatches)
 
     jobList = getJobsToDisplay(dcfg, client, jobId, troveSpecs,
                                jobLimit=jobLimit, activeOnly=activeOnly)
@@ -350,7 +359,10 @@ def printOneTrove(dcfg, job, trove, indent='       ', out=sys.stdout):
                 out.write('[%s] %s\n' % (timeStamp, message))
 
     if dcfg.showBuildLogs:
-        showBuildLog(dcfg, job, trove, out)
+        if dcfg.logPattern:
+            showBuildLogMatches(dcfg, job, trove, out)
+        else:
+            showBuildLog(dcfg, job, trove, out)
 
 def showBuildLog(dcfg, job, trove, out=sys.stdout):
     client = dcfg.getClient()
@@ -365,6 +377,28 @@ def showBuildLog(dcfg, job, trove, out=sys.stdout):
     out.write("")
     out.write(data,)
 
+def showBuildLogMatches(dcfg, job, trove, out=sys.stdout):
+    client = dcfg.getClient()
+    results = client.client.searchTroveBuildLogs(job.jobId, dcfg.logPattern,
+                                    [trove.getNameVersionFlavor(True)],
+                                    context=dcfg.logContext,
+                                    maxMatches=dcfg.maxLogMatches)
+    if not results:
+        out.write('No matches in build log.\n')
+        return
+    (troveTuple, regions), = results
+    for idx, (lineNumber, offset, text, matches) in enumerate(regions):
+        if idx and dcfg.logContext:
+            out.write('--\n')
+        matches = set(matches)
+        for line in text.splitlines(True):
+            if lineNumber in matches:
+                sep = ':'
+            else:
+                sep = '-'
+            out.write('%d%s%s' % (lineNumber, sep, line))
+            lineNumber += 1
+
 def displayTroveDetail(dcfg, job, trove, indent='     ', out=sys.stdout):
     def write(line=''):
         out.write(line + '\n')
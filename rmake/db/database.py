@@ -107,6 +107,7 @@ class Database(DBInterface):
         self.logStore = logstore.LogStore(contentsPath + '/logs')
         self.jobQueue = jobstore.JobQueue(self)
         self.nodeStore = nodestore.NodeStore(self)
+        self._writeBehind = []
 
     def loadSchema(self, migrate=True):
         if migrate:
@@ -125,6 +126,31 @@ class Database(DBInterface):
         """
         _JobDbLogger(self).attach(job)
 
+    def addWriteBehind(self, logger):
+        """
+            Registers a job logger that delays its writes, so that they
+            are written by L{flushWriteBehind}.
+        """
+        self._writeBehind.append(logger)
+
+    def flushWriteBehind(self, force=False):
+        """
+            Writes delayed job updates that are due, or all of them if
+            C{force} is set.  Returns the number of seconds until more are
+            due, or C{None} if none are pending.
+        """
+        timeout = None
+        for logger in self._writeBehind:
+            if force:
+                logger.flush()
+            else:
+                logger.flushIfDue()
+            loggerTimeout = logger.getFlushTimeout()
+            if loggerTimeout is not None:
+                if timeout is None or loggerTimeout < timeout:
+                    timeout = loggerTimeout
+        return timeout
+
     def addJob(self, job):
         self.jobStore.addJob(job)
         self.commit()
@@ -247,6 +273,18 @@ class Database(DBInterface):
                                      (trove.getNameVersionFlavor() + 
                                       (trove.jobId,)))
 
+    def searchTroveBuildLog(self, trove, regex, context=0, maxMatches=0):
+        """
+        Search a trove's build log; see L{logstore.searchLog}.
+        """
+        if not self.hasTroveBuildLog(trove):
+            return []
+        try:
+            return self.logStore.searchTroveLog(trove.logPath, regex,
+                                                context, maxMatches)
+        except KeyError:
+            return []
+
     def updateJobStatus(self, job):
         self.jobStore.updateJobLog(job, job.status)
         self.jobStore.updateJob(job)
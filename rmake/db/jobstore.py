@@ -32,6 +32,9 @@ from rmake.lib.apiutils import freeze, thaw
 
 class JobStore(object):
 
+    # Maximum number of parameters to bind in a single IN clause
+    batchSize = 500
+
     def __init__(self, db):
         self.db = db
 
@@ -251,43 +254,65 @@ class JobStore(object):
         if not troveList:
             return []
         cu = self.db.cursor()
+        # Many of the requested troves usually share a version or flavor, so
+        # only freeze each one once.
+        frozenVersions = {}
+        frozenFlavors = {}
+        wanted = {}
+        troveNames = set()
+        jobIds = set()
+        for tup in troveList:
+            jobId, troveName, version, flavor, context = tup
+            if version not in frozenVersions:
+                frozenVersions[version] = version.freeze()
+            if flavor not in frozenFlavors:
+                frozenFlavors[flavor] = flavor.freeze()
+            wanted[(jobId, troveName, frozenVersions[version],
+                frozenFlavors[flavor], context)] = tup
+            troveNames.add(troveName)
+            jobIds.add(jobId)
+
         trovesById = {}
         trovesByNVF = {}
-        for jobId, troveName, version, flavor, context in troveList:
+        troveNames = sorted(troveNames)
+        jobIds = ','.join('%d' % x for x in jobIds)
+        for n in range(0, len(troveNames), self.batchSize):
+            names = troveNames[n:n + self.batchSize]
             cu.execute("""
-                SELECT BuildTroves.troveId, pid, state, status, failureReason,
-                    failureData, start, finish, logPath, recipeType,
-                    Chroots.nodeName, Chroots.path, troveType
+                SELECT BuildTroves.troveId, jobId, troveName, version, flavor,
+                    context, pid, state, status, failureReason, failureData,
+                    start, finish, logPath, recipeType, Chroots.nodeName,
+                    Chroots.path, troveType
                 FROM BuildTroves
                 LEFT JOIN Chroots USING(chrootId)
-                WHERE jobId = ? AND troveName = ? AND version = ?
-                    AND flavor = ? AND context = ?
-                """, jobId, troveName, version.freeze(), flavor.freeze(),
-                    context)
-            row = cu.fetchone()
-            if not row:
-                continue
-            (troveId, pid, state, status, failureReason, failureData, start,
-                    finish, logPath, recipeType, chrootHost, chrootPath,
-                    troveType) = row
-            if chrootPath is None:
-                chrootPath = chrootHost = ''
-            failureReason = thaw('FailureReason',
-                    (failureReason, cu.frombinary(failureData)))
+                WHERE jobId IN (%s) AND troveName IN (%s)
+                """ % (jobIds, ','.join('?' for x in names)), names)
+            for (troveId, jobId, troveName, version, flavor, context, pid,
+                    state, status, failureReason, failureData, start, finish,
+                    logPath, recipeType, chrootHost, chrootPath, troveType
+                    ) in cu.fetchall():
+                tup = wanted.get((jobId, troveName, version, flavor, context))
+                if tup is None:
+                    # Same name, but a different trove than was asked for
+                    continue
+                jobId, troveName, version, flavor, context = tup
+                if chrootPath is None:
+                    chrootPath = chrootHost = ''
+                failureReason = thaw('FailureReason',
+                        (failureReason, cu.frombinary(failureData)))
 
-            troveClass = buildtrove.getClassForTroveType(troveType)
-            buildTrove = troveClass(jobId, troveName, version,
-                                    flavor, context=context, pid=pid,
-                                    state=state, start=float(start),
-                                    finish=float(finish),
-                                    logPath=logPath, status=status,
-                                    failureReason=failureReason,
-                                    recipeType=recipeType,
-                                    chrootPath=chrootPath,
-                                    chrootHost=chrootHost)
-            trovesById[troveId] = buildTrove
-            trovesByNVF[(jobId, troveName, version, flavor, context)
-                    ] = buildTrove
+                troveClass = buildtrove.getClassForTroveType(troveType)
+                buildTrove = troveClass(jobId, troveName, version,
+                                        flavor, context=context, pid=pid,
+                                        state=state, start=float(start),
+                                        finish=float(finish),
+                                        logPath=logPath, status=status,
+                                        failureReason=failureReason,
+                                        recipeType=recipeType,
+                                        chrootPath=chrootPath,
+                                        chrootHost=chrootHost)
+                trovesById[troveId] = buildTrove
+                trovesByNVF[tup] = buildTrove
         if not trovesByNVF:
             raise KeyError(troveList[0])
         troveIds = ','.join('%d' % x for x in trovesById)
@@ -298,9 +323,15 @@ class JobStore(object):
             WHERE troveId IN (%s)
             """ % (troveIds,))
         builtTroves = {}
+        thawedVersions = {}
+        thawedFlavors = {}
         for troveId, troveName, version, flavor in cu:
-            builtTroves.setdefault(troveId, []).append((
-                    troveName, ThawVersion(version), ThawFlavor(flavor)))
+            if version not in thawedVersions:
+                thawedVersions[version] = ThawVersion(version)
+            if flavor not in thawedFlavors:
+                thawedFlavors[flavor] = ThawFlavor(flavor)
+            builtTroves.setdefault(troveId, []).append((troveName,
+                thawedVersions[version], thawedFlavors[flavor]))
         for troveId, binTroves in builtTroves.iteritems():
             trovesById[troveId].setBuiltTroves(binTroves)
 
@@ -374,26 +405,20 @@ class JobStore(object):
                    "VALUES ( ?, ?, ? )",
                    job.uuid, job.state, job.owner)
         jobId = int(cu.lastrowid)
-        for trove in job.iterTroves():
+        troveList = list(job.iterTroves())
+        rows = []
+        for trove in troveList:
             trove.jobId = jobId
             (troveName, version,
                 flavor, context) = trove.getNameVersionFlavor(True)
-            cu.execute("""INSERT INTO BuildTroves
-                       (jobId, troveName, version, flavor,
-                        state, context, buildType, troveType)
-                       VALUES (?, ?, ?, ?, ?, ?, ?, ?)""", (
-                jobId, troveName, version.freeze(),
+            rows.append((jobId, troveName, version.freeze(),
                 flavor.freeze(), TROVE_STATE_INIT, context,
                 trove.buildType, trove.troveType))
-            troveId = cu.lastrowid
-            className, settings = freeze('TroveSettings', trove.settings)
-            settings['_class'] = [className]
-            for key, values in settings.iteritems():
-                for idx, value in enumerate(values):
-                    cu.execute('''INSERT INTO TroveSettings
-                                  (jobId, troveId, key, ord, value)
-                                  VALUES (?, ?, ?, ?, ?)''', jobId, troveId,
-                                                             key, idx, value)
+        cu.executemany("""INSERT INTO BuildTroves
+                       (jobId, troveName, version, flavor,
+                        state, context, buildType, troveType)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?)""", rows)
+        self._addTroveSettings(cu, troveList)
         for context, jobConfig in job.getConfigDict().items():
             self.addJobConfig(jobId, context, jobConfig)
         self.db.commit()
@@ -501,66 +526,93 @@ class JobStore(object):
                       WHERE jobId=? AND troveName=? AND version=? 
                             AND flavor=? AND context=?
                    """ % fieldList, valueList)
+        settings = self._freezeTroveSettings(trove)
+        if trove.settings.isSaved(settings):
+            # Most updates are state changes that leave the settings alone
+            return
         troveId = self._getTroveId(cu, trove.jobId,
                                    *trove.getNameVersionFlavor(True))
-        className, settings = freeze('TroveSettings', trove.settings)
-        settings['_class'] = [className]
         cu.execute('DELETE FROM TroveSettings WHERE troveId=?', troveId)
-        for key, values in settings.iteritems():
-            for idx, value in enumerate(values):
-                cu.execute('''INSERT INTO TroveSettings
-                              (jobId, troveId, key, ord, value)
-                              VALUES (?, ?, ?, ?, ?)''', trove.jobId, troveId,
-                                                         key, idx, value)
-
+        cu.executemany(self._insertTroveSettings,
+                self._getTroveSettingsRows(trove.jobId, troveId, settings))
+        trove.settings.markSaved(settings)
 
     def setBuildTroves(self, job):
         cu = self.db.cursor()
         cu.execute('DELETE FROM BuildTroves WHERE jobId=?', job.jobId)
         cu.execute('DELETE FROM TroveSettings WHERE jobId=?', job.jobId)
-        for trove in job.iterTroves():
-            self.addTrove(trove)
+        self.addTroves(list(job.iterTroves()))
 
     def addTrove(self, trove):
-        cu = self.db.cursor()
-        if not trove.logPath:
-            trove.logPath = self.db.logStore.hashTrove(trove)
+        self.addTroves([trove])
 
-        failureTup = freeze('FailureReason', trove.getFailureReason())
-        if failureTup[0] == '':
-            failureTup = None, None
-        kw = dict(jobId=trove.jobId,
-                  troveName=trove.getName(),
-                  version=trove.getVersion().freeze(),
-                  flavor=trove.getFlavor().freeze(),
-                  pid=trove.pid,
-                  start=trove.start,
-                  finish=trove.finish,
-                  logPath=trove.logPath,
-                  recipeType=trove.recipeType,
-                  status=trove.status,
-                  state=trove.state,
-                  failureReason=failureTup[0],
-                  failureData=cu.binary(failureTup[1]),
-                  buildType=trove.buildType,
-                  troveType=trove.troveType,
-                  context=trove.getContext())
-        fieldList = ', '.join(kw.keys())
-        valueList = kw.values()
-        qList = ','.join('?' for x in xrange(len(kw.keys())))
+    def addTroves(self, troveList):
+        if not troveList:
+            return
+        cu = self.db.cursor()
+        rows = []
+        for trove in troveList:
+            if not trove.logPath:
+                trove.logPath = self.db.logStore.hashTrove(trove)
+
+            failureTup = freeze('FailureReason', trove.getFailureReason())
+            if failureTup[0] == '':
+                failureTup = None, None
+            rows.append((trove.jobId, trove.getName(),
+                trove.getVersion().freeze(), trove.getFlavor().freeze(),
+                trove.pid, trove.start, trove.finish, trove.logPath,
+                trove.recipeType, trove.status, trove.state, failureTup[0],
+                cu.binary(failureTup[1]), trove.buildType, trove.troveType,
+                trove.getContext()))
+        cu.executemany("""INSERT INTO BuildTroves
+                      (jobId, troveName, version, flavor, pid, start, finish,
+                       logPath, recipeType, status, state, failureReason,
+                       failureData, buildType, troveType, context)
+                      VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                   """, rows)
+        self._addTroveSettings(cu, troveList)
+
+    _insertTroveSettings = """INSERT INTO TroveSettings
+                              (jobId, troveId, key, ord, value)
+                              VALUES (?, ?, ?, ?, ?)"""
 
-        cu.execute("""INSERT INTO BuildTroves
-                      (%s) VALUES (%s)
-                   """ % (fieldList, qList), valueList)
-        troveId = cu.lastrowid
+    @staticmethod
+    def _freezeTroveSettings(trove):
         className, settings = freeze('TroveSettings', trove.settings)
         settings['_class'] = [className]
+        return settings
+
+    @staticmethod
+    def _getTroveSettingsRows(jobId, troveId, settings):
+        rows = []
         for key, values in settings.iteritems():
             for idx, value in enumerate(values):
-                cu.execute('''INSERT INTO TroveSettings
-                              (jobId, troveId, key, ord, value)
-                              VALUES (?, ?, ?, ?, ?)''', trove.jobId, troveId,
-                                                         key, idx, value)
+                rows.append((jobId, troveId, key, idx, value))
+        return rows
+
+    def _addTroveSettings(self, cu, troveList):
+        """
+        Write the settings of newly inserted troves, looking up all of their
+        troveIds at once.
+        """
+        jobIds = ','.join('%d' % x for x in set(x.jobId for x in troveList))
+        cu.execute("""SELECT troveId, jobId, troveName, version, flavor, context
+                      FROM BuildTroves WHERE jobId IN (%s)""" % (jobIds,))
+        troveIds = dict((tuple(x[1:]), x[0]) for x in cu)
+        rows = []
+        savedSettings = []
+        for trove in troveList:
+            (troveName, version,
+                flavor, context) = trove.getNameVersionFlavor(True)
+            troveId = troveIds[(trove.jobId, troveName, version.freeze(),
+                flavor.freeze(), context)]
+            settings = self._freezeTroveSettings(trove)
+            rows.extend(self._getTroveSettingsRows(trove.jobId, troveId,
+                settings))
+            savedSettings.append((trove, settings))
+        cu.executemany(self._insertTroveSettings, rows)
+        for trove, settings in savedSettings:
+            trove.settings.markSaved(settings)
 
     def updateJobLog(self, job, message):
         cu = self.db.cursor()
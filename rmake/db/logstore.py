@@ -14,15 +14,31 @@
 # limitations under the License.
 #
 
+import bisect
+import collections
 import errno
 import gzip
 import hashlib
 import hmac
 import os
+import struct
+import zlib
 from conary.lib import sha1helper
 from conary.lib import util
 
 
+# Compressed logs are a series of gzip members holding this much of the log
+# each, so that reading from the middle of a log only needs to decompress the
+# members that cover it.  Any gzip reader still sees one continuous log.
+BLOCK_SIZE = 256 * 1024
+
+# The index sidecar (.gz.idx) is this magic followed by one entry per block
+# giving its offset in the plaintext and in the compressed log, then an entry
+# with the total size of each.
+INDEX_MAGIC = 'RMLOGIDX1\n'
+INDEX_ENTRY = struct.Struct('>QQ')
+
+
 class LogStore(object):
 
     def __init__(self, path):
@@ -46,9 +62,64 @@ class LogStore(object):
         return hmac.new(self.logKey, logHash, hashlib.sha1).hexdigest()
 
     def openForWriting(self, logHash):
+        """
+        Open a build log for appending.  Only the plaintext log is written;
+        call L{compressLog} once it is closed.
+        """
         path = self._hashToPath(logHash)
         util.mkdirChain(os.path.dirname(path))
-        return CompressedLogWriter(path)
+        return LogWriter(path)
+
+    def getLogSize(self, logHash):
+        """Size of the plaintext log, or None if there isn't one"""
+        try:
+            return os.stat(self._hashToPath(logHash)).st_size
+        except OSError as err:
+            if err.errno != errno.ENOENT:
+                raise
+        return None
+
+    def compressLog(self, logHash, blockSize=BLOCK_SIZE):
+        """
+        Store a compressed, indexed copy of a closed plaintext log.  The
+        plaintext log is kept so that readers always find one or the other;
+        remove it with L{removePlainLog} afterwards.
+        """
+        path = self._hashToPath(logHash)
+        tmpPath = path + '.gz.tmp'
+        index = []
+        plainOffset = gzOffset = 0
+        f_plain = open(path, 'rb')
+        try:
+            f_gz = open(tmpPath, 'wb')
+            while True:
+                data = f_plain.read(blockSize)
+                if not data:
+                    break
+                compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION,
+                        zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+                block = compressor.compress(data) + compressor.flush()
+                f_gz.write(block)
+                index.append((plainOffset, gzOffset))
+                plainOffset += len(data)
+                gzOffset += len(block)
+            f_gz.close()
+        finally:
+            f_plain.close()
+        index.append((plainOffset, gzOffset))
+        f_idx = open(path + '.gz.idx.tmp', 'wb')
+        f_idx.write(INDEX_MAGIC)
+        f_idx.write(''.join(INDEX_ENTRY.pack(*x) for x in index))
+        f_idx.close()
+        # A reader that finds an index not matching the compressed log
+        # ignores it, so the order of these only matters for speed.
+        os.rename(tmpPath, path + '.gz')
+        os.rename(path + '.gz.idx.tmp', path + '.gz.idx')
+
+    def removePlainLog(self, logHash):
+        path = self._hashToPath(logHash)
+        if os.path.exists(path + '.gz'):
+            util.removeIfExists(path)
 
     def hasTroveLog(self, logHash):
         if not logHash:
@@ -66,58 +137,272 @@ class LogStore(object):
             if err.args[0] != errno.ENOENT:
                 raise
         try:
-            return gzip.GzipFile(path + '.gz')
+            f_gz = open(path + '.gz', 'rb')
         except IOError as err:
             if err.args[0] != errno.ENOENT:
                 raise
-        raise KeyError(logHash)
+            raise KeyError(logHash)
+        index = _readIndex(path + '.gz.idx', os.fstat(f_gz.fileno()).st_size)
+        if index is None:
+            # Written before logs were indexed, or while being recompressed.
+            return gzip.GzipFile(fileobj=f_gz)
+        return IndexedLogReader(f_gz, index)
+
+    def searchTroveLog(self, logHash, regex, context=0, maxMatches=0):
+        """
+        Search a log for lines matching C{regex}; see L{searchLog}.
+        """
+        f = self.openTroveLog(logHash)
+        try:
+            return searchLog(f, regex, context, maxMatches)
+        finally:
+            f.close()
 
     def deleteLogs(self, logHashes):
         for logHash in logHashes:
             path = self._hashToPath(logHash)
             util.removeIfExists(path)
             util.removeIfExists(path + '.gz')
+            util.removeIfExists(path + '.gz.tmp')
+            util.removeIfExists(path + '.gz.idx')
+            util.removeIfExists(path + '.gz.idx.tmp')
 
 
-class CompressedLogWriter(object):
+class LogWriter(object):
     """
-    Simultaneously write to a plaintext log file and to a gzipped log file.
-    When the log is closed, both are flushed and then the plaintext file is
-    unlinked.
-
-    This allows clients to tail the plaintext log while efficiently storing a
-    compressed log to reference when the build is complete.
+    Append to a plaintext log file without any buffering, so that clients
+    can tail it while the build is running.
     """
 
     def __init__(self, path):
         self.path = path
-        self.f_plain = open(path, 'a', buffering=0)
-        if os.path.exists(path + '.gz'
-                ) and not os.fstat(self.f_plain.fileno()).st_size:
+        self.fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+        if os.path.exists(path + '.gz') and not self.size:
             # The compressed log exists already, but the plain log was removed.
             # Need to copy the compressed contents to the plain log.
             f_gz = gzip.GzipFile(path + '.gz', 'r')
-            util.copyfileobj(f_gz, self.f_plain)
+            while True:
+                data = f_gz.read(65536)
+                if not data:
+                    break
+                self.write(data)
             f_gz.close()
-        self.f_gz = gzip.GzipFile(path + '.gz', 'a')
+
+    @property
+    def size(self):
+        """Current length of the log, including other writers' data"""
+        return os.fstat(self.fd).st_size
 
     def write(self, data):
-        self.f_plain.write(data)
-        self.f_gz.write(data)
+        """
+        Write a string or buffer (such as a memoryview) in full, and return
+        the offset it was written at.
+        """
+        written = os.write(self.fd, data)
+        if written < len(data):
+            data = memoryview(data)
+            while written < len(data):
+                written += os.write(self.fd, data[written:])
+        # Several writers may append to the same log, so the offset has to
+        # come from the file rather than from what this writer has written.
+        return self.size - written
+
+    def fileno(self):
+        return self.fd
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+
+def _readIndex(path, compressedSize):
+    """
+    Returns the list of (plain offset, compressed offset) entries from an
+    index, or None if there isn't a valid index for a compressed log of
+    C{compressedSize} bytes.
+    """
+    try:
+        f = open(path, 'rb')
+    except IOError as err:
+        if err.args[0] != errno.ENOENT:
+            raise
+        return None
+    try:
+        data = f.read()
+    finally:
+        f.close()
+    if not data.startswith(INDEX_MAGIC):
+        return None
+    data = data[len(INDEX_MAGIC):]
+    size = INDEX_ENTRY.size
+    if not data or len(data) % size:
+        return None
+    index = [INDEX_ENTRY.unpack_from(data, x)
+             for x in range(0, len(data), size)]
+    if index[-1][1] != compressedSize:
+        return None
+    return index
+
+
+class IndexedLogReader(object):
+    """
+    Read-only file object for a block compressed log.  Seeking is free and
+    reading only decompresses the blocks that hold the requested data.
+    """
+
+    def __init__(self, f_gz, index):
+        self.f_gz = f_gz
+        self.index = index
+        self.offsets = [x[0] for x in index]
+        self.size = self.offsets[-1]
+        self.pos = 0
+        # The most recently decompressed block, since consecutive reads of a
+        # growing mark tend to land in the same one.
+        self._blockNum = None
+        self._block = ''
+
+    def _getBlock(self, blockNum):
+        if blockNum != self._blockNum:
+            start, end = self.index[blockNum][1], self.index[blockNum + 1][1]
+            self.f_gz.seek(start)
+            self._block = zlib.decompress(self.f_gz.read(end - start),
+                                          16 + zlib.MAX_WBITS)
+            self._blockNum = blockNum
+        return self._block
+
+    def read(self, size=-1):
+        end = self.size
+        if size >= 0:
+            end = min(self.pos + size, end)
+        chunks = []
+        while self.pos < end:
+            blockNum = bisect.bisect_right(self.offsets, self.pos) - 1
+            blockStart = self.offsets[blockNum]
+            chunk = self._getBlock(blockNum)[self.pos - blockStart:
+                                             end - blockStart]
+            if not chunk:
+                break
+            chunks.append(chunk)
+            self.pos += len(chunk)
+        return ''.join(chunks)
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.pos
+        elif whence == 2:
+            offset += self.size
+        self.pos = max(offset, 0)
+
+    def tell(self):
+        return self.pos
 
     def close(self):
-        """Flush the gzipped log and unlink the plaintext log"""
-        self.f_plain.close()
         self.f_gz.close()
-        util.removeIfExists(self.path)
+        self._block = ''
+
+
+def _iterLines(f, readSize):
+    """
+    Yields (offset, data) for C{f} in pieces made of whole lines.  A final
+    line without a newline is given one.
+    """
+    offset = 0
+    partial = ''
+    while True:
+        data = f.read(readSize)
+        if not data:
+            break
+        if partial:
+            data = partial + data
+        end = data.rfind('\n') + 1
+        partial = data[end:]
+        if end:
+            yield offset, data[:end]
+            offset += end
+    if partial:
+        yield offset, partial + '\n'
 
-    def beforeFork(self):
-        self.f_gz.fileobj.flush()
 
-    def afterFork(self):
-        self.f_plain.close()
-        self.f_gz.fileobj.close()
-        self.f_gz.fileobj = None
+def searchLog(f, regex, context=0, maxMatches=0, readSize=BLOCK_SIZE):
+    """
+    Find the lines of log C{f} that match the compiled C{regex}, like grep.
 
-    def filenos(self):
-        return [self.f_plain.fileno(), self.f_gz.fileno()]
+    Each piece of the log is searched as a whole first and is only split
+    into lines if something in it matches, so that large logs with few
+    matches are cheap to search.  Reading block compressed logs a block at
+    a time decompresses each block once.
+
+    @param context: number of lines to include before and after each match
+    @param maxMatches: stop after this many matching lines, if not 0
+    @return: list of (lineNumber, offset, text, matchingLineNumbers) for
+    each region of the log holding matches and their context.  lineNumber
+    and offset give the start of the region; lines are numbered from 1.
+    """
+    regions = []
+    # (lineNumber, offset, line) for lines that may be needed as context
+    # before the next match
+    before = collections.deque(maxlen=context)
+    current = None
+    after = 0
+    matches = 0
+    lineNumber = 0
+    for offset, chunk in _iterLines(f, readSize):
+        if not after and not regex.search(chunk):
+            count = chunk.count('\n')
+            if context:
+                # Only the last few lines can be context for a later match.
+                parts = chunk.rsplit('\n', context + 1)
+                if len(parts) > context + 1:
+                    parts = parts[1:]
+                lineOffset = offset + len(chunk)
+                tail = []
+                for idx, line in enumerate(reversed(parts[:-1])):
+                    lineOffset -= len(line) + 1
+                    tail.append((lineNumber + count - idx, lineOffset, line))
+                before.extend(reversed(tail))
+            if current:
+                regions.append(current)
+                current = None
+            lineNumber += count
+            continue
+        lineOffset = offset
+        for line in chunk.split('\n')[:-1]:
+            lineNumber += 1
+            if ((not maxMatches or matches < maxMatches)
+                    and regex.search(line)):
+                if current is None:
+                    if before:
+                        first = before[0]
+                    else:
+                        first = (lineNumber, lineOffset)
+                    if regions and regions[-1][0] + len(regions[-1][2]) \
+                            == first[0]:
+                        # adjoins the previous region
+                        current = regions.pop()
+                    else:
+                        current = [first[0], first[1], [], []]
+                    current[2].extend(x[2] for x in before)
+                    before.clear()
+                current[2].append(line)
+                current[3].append(lineNumber)
+                matches += 1
+                after = context
+            elif after:
+                current[2].append(line)
+                after -= 1
+            else:
+                if current:
+                    regions.append(current)
+                    current = None
+                if maxMatches and matches >= maxMatches:
+                    break
+                before.append((lineNumber, lineOffset, line))
+            lineOffset += len(line) + 1
+        if maxMatches and matches >= maxMatches and not after:
+            break
+    if current:
+        regions.append(current)
+    return [(x[0], x[1], ''.join(y + '\n' for y in x[2]), x[3])
+            for x in regions]
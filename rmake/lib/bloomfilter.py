@@ -0,0 +1,111 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+"""
+Bloom filters: compact sets of strings that can answer "maybe present" or
+"definitely absent", used to tell other processes roughly what we have
+without sending the whole list.
+"""
+
+import struct
+
+from conary.lib import digestlib
+
+
+class BloomFilter(object):
+    """
+    A Bloom filter of C{size} bits using C{hashCount} hash functions.
+
+    The hash positions of a key are derived from one SHA-1 digest, and
+    L{getHashes} returns them in a form that can be checked against any
+    number of filters, so testing many keys against many filters only
+    hashes each key once.
+    """
+    # about 1% false positives
+    bitsPerKey = 10
+    defaultHashCount = 4
+    minSize = 64
+
+    def __init__(self, size, hashCount=defaultHashCount, bits=None):
+        self.size = size
+        self.hashCount = hashCount
+        if bits is None:
+            bits = bytearray((size + 7) // 8)
+        self.bits = bits
+
+    @classmethod
+    def fromKeys(cls, keys, bitsPerKey=None):
+        keys = list(keys)
+        if bitsPerKey is None:
+            bitsPerKey = cls.bitsPerKey
+        size = cls.minSize
+        while size < len(keys) * bitsPerKey:
+            size *= 2
+        self = cls(size)
+        for key in keys:
+            self.add(key)
+        return self
+
+    @staticmethod
+    def getHashes(key):
+        """
+        Hash C{key} for use with L{addHashes} and L{containsHashes}.
+        """
+        return struct.unpack('>QQ', digestlib.sha1(key).digest()[:16])
+
+    def _positions(self, hashes):
+        h1, h2 = hashes
+        size = self.size
+        return [ (h1 + idx * h2) % size for idx in range(self.hashCount) ]
+
+    def addHashes(self, hashes):
+        bits = self.bits
+        for pos in self._positions(hashes):
+            bits[pos >> 3] |= 1 << (pos & 7)
+
+    def containsHashes(self, hashes):
+        bits = self.bits
+        for pos in self._positions(hashes):
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def add(self, key):
+        self.addHashes(self.getHashes(key))
+
+    def __contains__(self, key):
+        return self.containsHashes(self.getHashes(key))
+
+    def __eq__(self, other):
+        return (self.size, self.hashCount, self.bits) == (
+                other.size, other.hashCount, other.bits)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __freeze__(self):
+        # base64 keeps the bits safe to send as an XMLRPC string
+        return dict(size=self.size, hashCount=self.hashCount,
+                    bits=str(self.bits).encode('base64'))
+
+    @classmethod
+    def __thaw__(class_, d):
+        bits = bytearray(d['bits'].decode('base64'))
+        if len(bits) != (d['size'] + 7) // 8:
+            raise ValueError('Bloom filter has %d bytes, expected %d'
+                             % (len(bits), (d['size'] + 7) // 8))
+        return class_(d['size'], d['hashCount'], bits)
@@ -19,7 +19,11 @@
 Cache of chroots.
 """
 
+import cPickle
+import errno
 import os
+import shutil
+import stat
 import subprocess
 import tempfile
 import time
@@ -27,8 +31,10 @@ from collections import namedtuple
 from rmake.lib import locking
 from rmake.worker.chroot.rootmanifest import ChrootManifest
 
+from conary import dbstore
 from conary.lib import util
-from conary.lib.sha1helper import sha1ToString, sha1FromString
+from conary.lib.sha1helper import sha1FileBin, sha1String, sha1ToString
+from conary.lib.sha1helper import sha1FromString
 
 
 CachedItem = namedtuple('CachedItem', 'fingerprint atime size')
@@ -39,6 +45,8 @@ class ChrootCacheInterface(object):
     ChrootCacheInterface defines the standard interface for a chroot
     cache.  It should never be instantiated.
     """
+    _manifestIndex = None
+
     def store(self, chrootFingerprint, root):
         """
         Store the chroot currently located at C{root} in the
@@ -111,25 +119,39 @@ class ChrootCacheInterface(object):
 
     def findPartialMatch(self, manifest):
         """
-        Scan through existing cached chroots for one with a subset of the
-        needed troves.
+        Look up existing cached chroots for one with a subset of the needed
+        troves.
 
         Returns the fingerprint of the partial match that is closest to
         C{manifest} without any extra troves.
         """
-        bestScore = -1
-        bestFingerprint = None
-        for name in os.listdir(self.cacheDir):
-            if len(name) != (40 + len(self.suffix)) or not name.endswith(self.suffix):
-                continue
-            cached = ChrootManifest.read(os.path.join(self.cacheDir, name))
-            if not cached:
-                continue
-            score = manifest.score(cached)
-            if score > bestScore:
-                bestScore = score
-                bestFingerprint = sha1FromString(name[:40])
-        return bestFingerprint
+        index = self._getManifestIndex()
+        for score, fingerprint in index.findMatches(manifest):
+            if self.hasChroot(fingerprint):
+                return fingerprint
+            # Deleted behind our back
+            index.remove(fingerprint)
+        return None
+
+    def readManifest(self, chrootFingerprint):
+        """
+        Return the manifest stored with a cached chroot, or None.
+        """
+        return ChrootManifest.read(self._fingerPrintToPath(chrootFingerprint))
+
+    def _getManifestIndex(self):
+        if self._manifestIndex is None:
+            self._manifestIndex = ManifestIndex(self)
+        return self._manifestIndex
+
+    def _indexManifest(self, chrootFingerprint):
+        manifest = ChrootManifest.read(
+                self._fingerPrintToPath(chrootFingerprint))
+        if manifest:
+            self._getManifestIndex().add(chrootFingerprint, manifest)
+
+    def _unindexManifest(self, chrootFingerprint):
+        self._getManifestIndex().remove(chrootFingerprint)
 
     def findOld(self, hours):
         """
@@ -139,6 +161,13 @@ class ChrootCacheInterface(object):
         thresh = time.time() - 3600 * hours
         return [x.fingerprint for x in self.listCached() if x.atime < thresh]
 
+    def collectGarbage(self):
+        """
+        Release any storage no longer used by a cached chroot after one or
+        more calls to L{remove}.
+        """
+        pass
+
     def setLogger(self, logger):
         self.logger = logger
 
@@ -185,6 +214,7 @@ class LocalChrootCache(ChrootCacheInterface):
             util.removeIfExists(fn)
             lock.release()
         ChrootManifest.store(root, path)
+        self._indexManifest(chrootFingerprint)
         self.prune()
 
     def restore(self, chrootFingerprint, root):
@@ -194,6 +224,7 @@ class LocalChrootCache(ChrootCacheInterface):
 
     def remove(self, chrootFingerprint):
         path = self._fingerPrintToPath(chrootFingerprint)
+        self._unindexManifest(chrootFingerprint)
         util.removeIfExists(path + ChrootManifest.AR_SUFFIX)
         util.removeIfExists(path)
 
@@ -238,6 +269,26 @@ class LzopChrootCache(LocalChrootCache):
     decompress = 'lzop -dc'
 
 
+class PigzChrootCache(LocalChrootCache):
+    """
+    Same gzip archives as the 'local' type, but compressed using every CPU.
+    A gzip stream can only be decompressed on one CPU.
+    """
+    compress = 'pigz -1 -c'
+    decompress = 'pigz -dc'
+
+
+class ZstdChrootCache(LocalChrootCache):
+    """
+    zstd archives made of independent frames, so that they are both
+    compressed and decompressed using every CPU.  Archives written by plain
+    zstd can still be restored, on one CPU.
+    """
+    suffix = '.tar.zst'
+    compress = 'pzstd -1 -q -c'
+    decompress = 'pzstd -dcq'
+
+
 class DirBasedChrootCacheInterface(ChrootCacheInterface):
     """
     Base class for chroot caches that look like a directory on disk.
@@ -280,10 +331,12 @@ class DirBasedChrootCacheInterface(ChrootCacheInterface):
             # Busy, just do nothing
             return
         try:
-            if not os.path.exists(path):
-                self._copy(root, path)
+            if os.path.exists(path):
+                return
+            self._copy(root, path)
         finally:
             lock.release()
+        self._indexManifest(chrootFingerprint)
 
     def restore(self, chrootFingerprint, root):
         path = self._fingerPrintToPath(chrootFingerprint)
@@ -296,6 +349,7 @@ class DirBasedChrootCacheInterface(ChrootCacheInterface):
 
     def remove(self, chrootFingerprint):
         path = self._fingerPrintToPath(chrootFingerprint)
+        self._unindexManifest(chrootFingerprint)
         with locking.LockFile(path + '.lock'):
             self._remove(path)
 
@@ -367,11 +421,324 @@ class HardlinkChrootCache(DirBasedChrootCacheInterface):
         self._call(['/bin/rm', '-rf', tmpdest])
 
 
+class ManifestIndex(object):
+    """
+    Persistent index of the manifests of the chroots in a chroot cache.
+
+    Each cached chroot is recorded with a digest of its bootstrap troves and
+    the number of job and cross troves it contains, and an inverted table
+    maps every job and cross trove fingerprint back to the chroots holding
+    it. A chroot is a partial match when its bootstrap digest is the same
+    and all of its troves are among the requested ones, which is found by
+    counting hits in the inverted table instead of reading every manifest.
+    """
+
+    FILENAME = 'manifests.db'
+    # SQLite limits the number of parameters in a single statement
+    chunkSize = 500
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.path = os.path.join(cache.cacheDir, self.FILENAME)
+        self.db = None
+        self.pid = None
+
+    def _open(self):
+        if self.db is not None and self.pid == os.getpid():
+            return self.db
+        # Never share a connection with the parent of a forked process.
+        util.mkdirChain(self.cache.cacheDir)
+        isNew = not os.path.exists(self.path)
+        self.db = dbstore.connect(self.path, driver='sqlite', timeout=120000)
+        self.pid = os.getpid()
+        cu = self.db.cursor()
+        cu.execute("""CREATE TABLE IF NOT EXISTS Chroots (
+                fingerprint     TEXT PRIMARY KEY,
+                bootstrap       TEXT NOT NULL,
+                troveCount      INTEGER NOT NULL
+                )""")
+        cu.execute("""CREATE TABLE IF NOT EXISTS ChrootTroves (
+                troveKey        TEXT NOT NULL,
+                fingerprint     TEXT NOT NULL
+                )""")
+        cu.execute("""CREATE INDEX IF NOT EXISTS ChrootTrovesKeyIdx
+                ON ChrootTroves(troveKey)""")
+        cu.execute("""CREATE INDEX IF NOT EXISTS ChrootTrovesFingerprintIdx
+                ON ChrootTroves(fingerprint)""")
+        if isNew:
+            # First use of the index on this cache, so pick up whatever was
+            # stored before it existed.
+            for item in self.cache.listCached():
+                manifest = ChrootManifest.read(
+                        self.cache._fingerPrintToPath(item.fingerprint))
+                if manifest:
+                    self._add(cu, item.fingerprint, manifest)
+        self.db.commit()
+        return self.db
+
+    @staticmethod
+    def _getBootstrap(manifest):
+        return sha1ToString(sha1String(
+            ''.join(sorted(manifest.bootstrapFingerprints))))
+
+    @staticmethod
+    def _getTroveKeys(manifest):
+        return (set('j' + x.encode('hex') for x in manifest.jobFingerprints)
+                | set('c' + x.encode('hex')
+                    for x in manifest.crossFingerprints))
+
+    def _add(self, cu, chrootFingerprint, manifest):
+        fingerprint = sha1ToString(chrootFingerprint)
+        keys = self._getTroveKeys(manifest)
+        cu.execute("DELETE FROM ChrootTroves WHERE fingerprint = ?",
+                fingerprint)
+        cu.execute("""INSERT OR REPLACE INTO Chroots
+                (fingerprint, bootstrap, troveCount) VALUES (?, ?, ?)""",
+                fingerprint, self._getBootstrap(manifest), len(keys))
+        cu.executemany("""INSERT INTO ChrootTroves (troveKey, fingerprint)
+                VALUES (?, ?)""", [(x, fingerprint) for x in keys])
+
+    def add(self, chrootFingerprint, manifest):
+        db = self._open()
+        self._add(db.cursor(), chrootFingerprint, manifest)
+        db.commit()
+
+    def remove(self, chrootFingerprint):
+        if not os.path.exists(self.path):
+            # Will be built from what is left on first use
+            return
+        db = self._open()
+        cu = db.cursor()
+        fingerprint = sha1ToString(chrootFingerprint)
+        cu.execute("DELETE FROM ChrootTroves WHERE fingerprint = ?",
+                fingerprint)
+        cu.execute("DELETE FROM Chroots WHERE fingerprint = ?", fingerprint)
+        db.commit()
+
+    def findMatches(self, manifest):
+        """
+        Return a list of C{(score, fingerprint)} for every indexed chroot
+        that C{manifest} could be installed on top of, best match first.
+        The score is the same as L{ChrootManifest.score}.
+        """
+        cu = self._open().cursor()
+        keys = sorted(self._getTroveKeys(manifest))
+        hits = {}
+        for n in range(0, len(keys), self.chunkSize):
+            chunk = keys[n:n + self.chunkSize]
+            cu.execute("""SELECT fingerprint, COUNT(*) FROM ChrootTroves
+                    WHERE troveKey IN (%s) GROUP BY fingerprint"""
+                    % ', '.join('?' * len(chunk)), chunk)
+            for fingerprint, count in cu:
+                hits[fingerprint] = hits.get(fingerprint, 0) + count
+        cu.execute("""SELECT fingerprint, troveCount FROM Chroots
+                WHERE bootstrap = ?""", self._getBootstrap(manifest))
+        matches = []
+        for fingerprint, troveCount in cu.fetchall():
+            # Any trove not among ours disqualifies the chroot, since only
+            # installs are permitted.
+            if hits.get(fingerprint, 0) == troveCount:
+                matches.append((troveCount, fingerprint))
+        matches.sort(key=lambda x: (-x[0], x[1]))
+        return [(score, sha1FromString(fingerprint))
+                for score, fingerprint in matches]
+
+
+class DedupChrootCache(ChrootCacheInterface):
+    """
+    Chroot cache that stores every distinct file once, keyed by its contents
+    and attributes, and describes each cached chroot as a list of paths
+    referring to those files.  Chroots are stored and restored by
+    hardlinking, so like the 'hardlink' type the cache should be on the
+    same filesystem as the chroots.
+    """
+    suffix = '.dedup'
+
+    _DIR, _FILE, _LINK, _NODE = range(4)
+
+    def __init__(self, cacheDir, sizeLimit=None, chrootHelperPath=None):
+        if sizeLimit:
+            raise RuntimeError("This chrootcache type does not support size limits")
+        self.cacheDir = cacheDir
+        self.objectDir = os.path.join(cacheDir, 'objects')
+
+    def _fingerPrintToPath(self, chrootFingerprint):
+        basename = sha1ToString(chrootFingerprint) + self.suffix
+        return os.path.join(self.cacheDir, basename)
+
+    def _objectPath(self, key):
+        return os.path.join(self.objectDir, key[:2], key[2:])
+
+    def _objectLock(self, share):
+        # Held exclusively while unused objects are deleted, and shared by
+        # anything that links to existing objects.
+        return locking.LockFile(self.objectDir + '.lock', share=share)
+
+    def store(self, chrootFingerprint, root):
+        path = self._fingerPrintToPath(chrootFingerprint)
+        util.mkdirChain(self.objectDir)
+        lock = locking.LockFile(path + '.lock')
+        if not lock.acquire(wait=False):
+            # Busy, just do nothing
+            return
+        try:
+            with self._objectLock(share=True):
+                entries = self._storeTree(os.path.normpath(root))
+                with util.AtomicFile(path) as fobj:
+                    cPickle.dump(entries, fobj, 2)
+        finally:
+            lock.release()
+        ChrootManifest.store(root, path)
+        self._indexManifest(chrootFingerprint)
+
+    def _storeTree(self, root):
+        entries = []
+        for dirPath, dirNames, fileNames in os.walk(root):
+            for name in dirNames + fileNames:
+                fullPath = os.path.join(dirPath, name)
+                relPath = fullPath[len(root):]
+                st = os.lstat(fullPath)
+                mode = st.st_mode
+                if stat.S_ISDIR(mode):
+                    entries.append((self._DIR, relPath, stat.S_IMODE(mode),
+                        st.st_uid, st.st_gid, st.st_mtime))
+                elif stat.S_ISREG(mode):
+                    entries.append((self._FILE, relPath,
+                        self._storeFile(fullPath, st)))
+                elif stat.S_ISLNK(mode):
+                    entries.append((self._LINK, relPath,
+                        os.readlink(fullPath), st.st_uid, st.st_gid))
+                elif (stat.S_ISCHR(mode) or stat.S_ISBLK(mode)
+                        or stat.S_ISFIFO(mode)):
+                    entries.append((self._NODE, relPath, mode,
+                        st.st_uid, st.st_gid, st.st_rdev))
+                # sockets are not worth keeping
+        return entries
+
+    def _storeFile(self, path, st):
+        # Hardlinks share their attributes, so they are part of the key.
+        key = sha1ToString(sha1String('%s %o %d %d %d' % (sha1FileBin(path),
+            stat.S_IMODE(st.st_mode), st.st_uid, st.st_gid,
+            int(st.st_mtime))))
+        objPath = self._objectPath(key)
+        if not os.path.exists(objPath):
+            util.mkdirChain(os.path.dirname(objPath))
+            tmpPath = '%s.tmp%d' % (objPath, os.getpid())
+            self._link(path, tmpPath)
+            os.rename(tmpPath, objPath)
+            # rename() does nothing if another process linked the same file
+            util.removeIfExists(tmpPath)
+        return key
+
+    @staticmethod
+    def _link(source, dest):
+        try:
+            os.link(source, dest)
+        except OSError, err:
+            if err.errno != errno.EXDEV:
+                raise
+            shutil.copy2(source, dest)
+
+    @staticmethod
+    def _chown(path, uid, gid):
+        try:
+            os.lchown(path, uid, gid)
+        except OSError, err:
+            if err.errno != errno.EPERM:
+                raise
+
+    def restore(self, chrootFingerprint, root):
+        path = self._fingerPrintToPath(chrootFingerprint)
+        with self._objectLock(share=True):
+            with open(path) as fobj:
+                entries = cPickle.load(fobj)
+            # Mark as recently used
+            os.utime(path, None)
+            util.mkdirChain(root)
+            dirs = []
+            for entry in entries:
+                kind, relPath = entry[:2]
+                dest = root + relPath
+                if kind == self._DIR:
+                    util.mkdirChain(dest)
+                    dirs.append(entry)
+                    continue
+                util.removeIfExists(dest)
+                if kind == self._FILE:
+                    self._link(self._objectPath(entry[2]), dest)
+                elif kind == self._LINK:
+                    target, uid, gid = entry[2:]
+                    os.symlink(target, dest)
+                    self._chown(dest, uid, gid)
+                elif kind == self._NODE:
+                    mode, uid, gid, rdev = entry[2:]
+                    try:
+                        os.mknod(dest, mode, rdev)
+                    except OSError, err:
+                        if err.errno != errno.EPERM:
+                            raise
+                        continue
+                    self._chown(dest, uid, gid)
+        # Children first, in case a directory is not writable
+        for kind, relPath, mode, uid, gid, mtime in reversed(dirs):
+            dest = root + relPath
+            self._chown(dest, uid, gid)
+            os.chmod(dest, mode)
+            os.utime(dest, (mtime, mtime))
+
+    def remove(self, chrootFingerprint):
+        path = self._fingerPrintToPath(chrootFingerprint)
+        self._unindexManifest(chrootFingerprint)
+        with locking.LockFile(path + '.lock'):
+            util.removeIfExists(path + ChrootManifest.AR_SUFFIX)
+            util.removeIfExists(path)
+
+    def hasChroot(self, chrootFingerprint):
+        path = self._fingerPrintToPath(chrootFingerprint)
+        return os.path.isfile(path)
+
+    def listCached(self):
+        items = []
+        for name in os.listdir(self.cacheDir):
+            if len(name) != (40 + len(self.suffix)
+                    ) or not name.endswith(self.suffix):
+                continue
+            fingerprint = sha1FromString(name[:40])
+            st = util.lstat(os.path.join(self.cacheDir, name))
+            if st:
+                items.append(CachedItem(fingerprint, st.st_atime, st.st_size))
+        return items
+
+    def collectGarbage(self):
+        if not os.path.isdir(self.objectDir):
+            return
+        with self._objectLock(share=False):
+            used = set()
+            for item in self.listCached():
+                path = self._fingerPrintToPath(item.fingerprint)
+                try:
+                    with open(path) as fobj:
+                        entries = cPickle.load(fobj)
+                except IOError, err:
+                    if err.errno != errno.ENOENT:
+                        raise
+                    continue
+                used.update(x[2] for x in entries if x[0] == self._FILE)
+            for prefix in os.listdir(self.objectDir):
+                subdir = os.path.join(self.objectDir, prefix)
+                for name in os.listdir(subdir):
+                    if prefix + name not in used:
+                        os.unlink(os.path.join(subdir, name))
+
+
 CACHE_TYPES = {
         'btrfs': BtrfsChrootCache,
+        'dedup': DedupChrootCache,
         'hardlink': HardlinkChrootCache,
         'local': LocalChrootCache,
         'lzop': LzopChrootCache,
+        'pigz': PigzChrootCache,
+        'zstd': ZstdChrootCache,
         }
 
 
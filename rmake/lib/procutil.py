@@ -113,6 +113,30 @@ def getMountInfo():
         mounts[mount] = Partition(device, type, blocks, used, avail)
     return mounts
 
+def getDiskFree(path):
+    """
+    Return the space available to unprivileged users on the filesystem
+    holding C{path}, in kilobytes, as df would report it.
+    """
+    st = os.statvfs(path)
+    return st.f_bavail * st.f_frsize // 1024
+
+def findMount(mounts, path):
+    """
+    Return the mount point in C{mounts} that C{path} lives on, or None.
+    """
+    path = os.path.realpath(path)
+    best = None
+    for mount in mounts:
+        if mount == '/':
+            prefix = mount
+        else:
+            prefix = mount + '/'
+        if path == mount or path.startswith(prefix):
+            if best is None or len(mount) > len(best):
+                best = mount
+    return best
+
 def getMemInfo():
     if os.path.exists('/proc/meminfo'):
         f = open("/proc/meminfo")
@@ -201,17 +225,66 @@ class Partition(object):
     def __eq__(self, other):
         return self.__dict__ == other.__dict__
 
+def _toTuple(value):
+    # Undo the conversion of tuples to lists by XMLRPC.
+    if isinstance(value, (list, tuple)):
+        return tuple(_toTuple(x) for x in value)
+    return value
+
 class MachineInformation(object):
-    def __init__(self):
+    """
+    Describes a machine.  The CPUs and mounts are only collected when the
+    object is created; update() refreshes the fields that change while the
+    machine runs, which are cheap to read.
+
+    @param chrootPath: directory that chroots are built in.  The free space
+    on its filesystem is kept up to date along with the load and memory.
+    """
+    # mount point holding the chroots, if known
+    chrootMount = None
+
+    def __init__(self, chrootPath=None):
         self.hostname = os.uname()[1]
         self.cpus = getCpuInfo()
+        self.mounts = getMountInfo()
+        if chrootPath:
+            self.chrootPath = chrootPath
+            self.chrootMount = findMount(self.mounts, chrootPath)
         self.update()
 
     def update(self):
-        self.mounts = getMountInfo()
         self.meminfo = getMemInfo()
         self.loadavg = getLoadAverage()
         self.uptime = getUptime()
+        if self.chrootMount:
+            try:
+                avail = getDiskFree(self.chrootPath)
+            except OSError:
+                pass
+            else:
+                self.mounts[self.chrootMount].avail = str(avail)
+
+    def getStatus(self):
+        """
+        Return the fields that update() changes, for sending to a machine
+        that already has the rest of this object.
+        """
+        d = dict(meminfo=self.meminfo, loadavg=self.loadavg,
+                 uptime=self.uptime)
+        if self.chrootMount:
+            d['chrootAvail'] = self.mounts[self.chrootMount].avail
+        return d
+
+    def setStatus(self, d):
+        """
+        Apply a status returned by getStatus() on the described machine.
+        """
+        self.meminfo = _toTuple(d['meminfo'])
+        self.loadavg = _toTuple(d['loadavg'])
+        self.uptime = d['uptime']
+        chrootAvail = d.get('chrootAvail')
+        if chrootAvail is not None and self.chrootMount in self.mounts:
+            self.mounts[self.chrootMount].avail = chrootAvail
 
     def getLoadAverage(self, minutes):
         if minutes not in (1,5,15):
@@ -250,11 +323,14 @@ class MachineInformation(object):
 
     @classmethod
     def __thaw__(class_, d):
-        self = class_()
+        # This describes some other machine, so don't look at this one.
+        self = class_.__new__(class_)
         self.__dict__.update(d)
         self.cpus = [ CPUInfo.__thaw__(x) for x in self.cpus ]
         self.mounts = dict((x[0], Partition.__thaw__(x[1]))
                             for x in self.mounts)
+        self.meminfo = _toTuple(self.meminfo)
+        self.loadavg = _toTuple(self.loadavg)
         return self
 
     def __freeze__(self):
@@ -19,9 +19,15 @@
 Cache of changesets.
 """
 from StringIO import StringIO
+import errno
 import os
 import itertools
+import Queue
+import sys
 import tempfile
+import threading
+import time
+from collections import namedtuple
 
 from conary import trove
 
@@ -33,6 +39,8 @@ from conary.repository import datastore
 from conary.repository import errors
 from conary.repository import filecontents
 
+from rmake.lib import locking
+
 
 class CachingTroveSource:
     def __init__(self, troveSource, cacheDir, readOnly=False, depsOnly=False):
@@ -90,14 +98,52 @@ class DependencyResultList(trove.TroveTupleList):
 class RepositoryCache(object):
     """
         We cache changeset files by component.  When conary is fixed, we'll
-        be able to combine the download of these troves.
+        be able to combine the download of these troves.  Until then,
+        missing changesets are fetched by up to fetchThreads concurrent
+        requests.
     """
-    def __init__(self, cacheDir, readOnly=False, depsOnly=False):
+    def __init__(self, cacheDir, readOnly=False, depsOnly=False,
+                 fetchThreads=1, sizeLimit=0, entryLimit=0, useIndex=False):
         self.root = cacheDir
         self.store = DataStore(cacheDir)
         self.readOnly = readOnly
         self.depsOnly = depsOnly
         self.fileCache = LazyFileCache(100)
+        self.fetchThreads = max(fetchThreads, 1)
+        self.sizeLimit = sizeLimit
+        self.entryLimit = entryLimit
+        self.index = None
+        if not readOnly:
+            index = CacheIndex(cacheDir)
+            # once someone has created an index, everyone writing to this
+            # cache needs to keep it up to date.
+            if useIndex or sizeLimit or entryLimit or index.exists():
+                index.create(self.store)
+                self.index = index
+
+    def _cacheHit(self, hash):
+        if self.index:
+            self.index.used(hash)
+
+    def _cacheMiss(self, hash):
+        if self.index:
+            size = os.stat(self.store.hashToPath(hash)).st_size
+            self.index.added(hash, size)
+
+    def _updateIndex(self):
+        if not self.index:
+            return
+        if self.index.flush():
+            self.index.prune(self.store, self.sizeLimit, self.entryLimit)
+
+    def getStats(self):
+        """
+            Returns a CacheStats tuple describing the contents and use of
+            the cache, or None if the cache is not indexed.
+        """
+        if not self.index:
+            return None
+        return self.index.getStats()
 
     def hashGroupDeps(self, groupTroves, depClass, dependency):
         depSet = deps.DependencySet()
@@ -166,6 +212,7 @@ class RepositoryCache(object):
                     outFile = self.store.openFile(depHash)
                     results = DependencyResultList(outFile.read()).get()
                     found.append(results)
+                    self._cacheHit(depHash)
                 else:
                     toFind.addDep(depClass, dependency)
                     found.append(None)
@@ -190,6 +237,8 @@ class RepositoryCache(object):
                     s.write(depResultList.freeze())
                     s.seek(0)
                     self.store.addFile(s, depHash, integrityCheck=False)
+                    self._cacheMiss(depHash)
+        self._updateIndex()
         allResults = {}
         for result, depSet in itertools.izip(allFound, depList):
             allResults[depSet] = result
@@ -235,18 +284,14 @@ class RepositoryCache(object):
                 outFile = self.fileCache.open(self.store.hashToPath(csHash))
                 #outFile = self.store.openRawFile(csHash)
                 changesets[idx] = changeset.ChangeSetFromFile(outFile)
+                self._cacheHit(csHash)
             else:
                 needed.append((job, csHash, idx))
 
 
-        total = len(needed)
-        for idx, (job, csHash, csIndex) in enumerate(needed):
-            if callback:
-                callback.setChangesetHunk(idx + 1, total)
-
-            cs = repos.createChangeSet([job], recurse=False,
-                                       callback=callback, withFiles=withFiles,
-                                       withFileContents=withFileContents)
+        fetched = self._fetchChangeSets(repos, needed, withFiles,
+                                        withFileContents, callback)
+        for job, csHash, csIndex, cs in fetched:
             if self.readOnly:
                 changesets[csIndex] = cs
                 continue
@@ -263,13 +308,92 @@ class RepositoryCache(object):
             # cs.reset() is not necessarily reliable,
             # so instead we re-read from disk
             self.store.addFileFromTemp(csHash, tmpName)
+            self._cacheMiss(csHash)
 
             outFile = self.fileCache.open(self.store.hashToPath(csHash))
             #outFile = self.store.openRawFile(csHash)
             changesets[csIndex] = changeset.ChangeSetFromFile(outFile)
 
+        self._updateIndex()
         return changesets
 
+    def _fetchChangeSets(self, repos, needed, withFiles, withFileContents,
+                         callback):
+        """
+            Yields (job, csHash, csIndex, changeset) for each entry in
+            needed as it is retrieved from the repository.  With more
+            than one fetch thread, changesets are yielded in the order they
+            finish downloading, so the caller can store each one as soon
+            as it arrives.
+        """
+        total = len(needed)
+        if self.fetchThreads == 1 or total <= 1:
+            for idx, (job, csHash, csIndex) in enumerate(needed):
+                if callback:
+                    callback.setChangesetHunk(idx + 1, total)
+                cs = repos.createChangeSet([job], recurse=False,
+                                           callback=callback,
+                                           withFiles=withFiles,
+                                           withFileContents=withFileContents)
+                yield job, csHash, csIndex, cs
+            return
+
+        jobQueue = Queue.Queue()
+        resultQueue = Queue.Queue()
+        for item in needed:
+            jobQueue.put(item)
+
+        def _fetch():
+            while True:
+                try:
+                    item = jobQueue.get_nowait()
+                except Queue.Empty:
+                    return
+                # the update callback is not thread safe, so only the
+                # main thread reports progress.
+                try:
+                    cs = repos.createChangeSet([item[0]], recurse=False,
+                                            withFiles=withFiles,
+                                            withFileContents=withFileContents)
+                except:
+                    resultQueue.put((item, None, sys.exc_info()))
+                else:
+                    resultQueue.put((item, cs, None))
+
+        threads = []
+        for idx in range(min(self.fetchThreads, total)):
+            thread = threading.Thread(target=_fetch,
+                                      name='changeset fetcher %d' % idx)
+            thread.setDaemon(True)
+            thread.start()
+            threads.append(thread)
+        try:
+            for idx in range(total):
+                while True:
+                    # use a timeout so that signals still get delivered
+                    # to the main thread while waiting.
+                    try:
+                        item, cs, excInfo = resultQueue.get(timeout=1)
+                        break
+                    except Queue.Empty:
+                        continue
+                if excInfo:
+                    raise excInfo[0], excInfo[1], excInfo[2]
+                if callback:
+                    callback.setChangesetHunk(idx + 1, total)
+                job, csHash, csIndex = item
+                yield job, csHash, csIndex, cs
+        finally:
+            # drop any fetches that have not started yet and wait for the
+            # ones in progress.
+            while True:
+                try:
+                    jobQueue.get_nowait()
+                except Queue.Empty:
+                    break
+            for thread in threads:
+                thread.join()
+
     def getFileContents(self, repos, fileList, callback=None):
         contents = []
         needed = []
@@ -281,6 +405,7 @@ class RepositoryCache(object):
                 f = self.store.openFile(fileHash)
                 content = filecontents.FromFile(f)
                 contents.append(content)
+                self._cacheHit(fileHash)
             else:
                 contents.append(None)
                 needed.append((idx, (fileId, fileVersion), fileHash))
@@ -293,8 +418,10 @@ class RepositoryCache(object):
             if not self.readOnly:
                 self.store.addFile(content.get(), fileHash,
                                    integrityCheck=False)
+                self._cacheMiss(fileHash)
             contents[idx] = content
 
+        self._updateIndex()
         return contents
 
     def getFileContentsPaths(self, repos, fileList, callback=None):
@@ -321,6 +448,201 @@ class DataStore(datastore.DataStore):
 class CacheError(Exception):
     pass
 
+
+CacheStats = namedtuple('CacheStats', 'entries bytes hits misses evictions')
+
+
+class CacheIndex(object):
+    """
+        Append-only journal of the entries in a RepositoryCache, recording
+        the size and last access time of each entry plus hit and miss
+        counts.  This lets the cache be pruned to its limits in least
+        recently used order without walking the hashed directory tree.
+
+        Every process using the cache appends to the journal; pruning
+        takes an exclusive lock and rewrites it in compacted form.
+        Records are one per line:
+
+            A <hash> <size> <time>          entry added (a cache miss)
+            T <hash> <time>                 entry used (a cache hit)
+            E <hash> <size> <atime>         entry carried over by compaction
+            S <hits> <misses> <evictions>   counters carried over by
+                                            compaction
+    """
+
+    indexName = '.index'
+    # Entries used more recently than this are never evicted, since
+    # another process may still be reading them.
+    gracePeriod = 600
+    # Prune down to this fraction of the limits so that we don't end up
+    # pruning on every addition.
+    lowWater = 0.9
+    # Rewrite the journal once it has this many more records than entries.
+    compactSlack = 10000
+
+    def __init__(self, root):
+        self.root = root
+        self.path = os.path.join(root, self.indexName)
+        self.lockPath = self.path + '.lock'
+        self._pending = []
+        self._added = False
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def create(self, store):
+        """
+            Creates the index if it doesn't exist yet, indexing anything
+            that is already in the cache.
+        """
+        if self.exists():
+            return
+        with locking.LockFile(self.lockPath):
+            if self.exists():
+                return
+            lines = []
+            for dirPath, dirNames, fileNames in os.walk(self.root):
+                prefix = os.path.basename(dirPath)
+                if len(prefix) != 2:
+                    continue
+                for fileName in fileNames:
+                    if len(prefix + fileName) != 40:
+                        # temporary file from an in-progress addition
+                        continue
+                    try:
+                        st = os.stat(os.path.join(dirPath, fileName))
+                    except OSError, err:
+                        if err.errno != errno.ENOENT:
+                            raise
+                        continue
+                    lines.append('E %s%s %d %d\n' % (prefix, fileName,
+                                                    st.st_size, st.st_atime))
+            self._write(lines)
+
+    def added(self, hash, size):
+        self._pending.append('A %s %d %d\n' % (hash, size, time.time()))
+        self._added = True
+
+    def used(self, hash):
+        self._pending.append('T %s %d\n' % (hash, time.time()))
+
+    def flush(self):
+        """
+            Writes out pending records.  Returns True if any entries were
+            added to the cache since the last flush.
+        """
+        added = self._added
+        self._added = False
+        if not self._pending:
+            return added
+        data = ''.join(self._pending)
+        self._pending = []
+        with locking.LockFile(self.lockPath, share=True):
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                         0644)
+            try:
+                os.write(fd, data)
+            finally:
+                os.close(fd)
+        return added
+
+    def _read(self):
+        """
+            Returns a dict of hash -> [size, atime], the counters
+            (hits, misses, evictions) and the number of records read.
+        """
+        entries = {}
+        hits = misses = evictions = records = 0
+        try:
+            f = open(self.path)
+        except IOError, err:
+            if err.errno != errno.ENOENT:
+                raise
+            return entries, (hits, misses, evictions), records
+        for line in f:
+            records += 1
+            fields = line.split()
+            if not line.endswith('\n') or not fields:
+                # torn write
+                continue
+            try:
+                kind = fields[0]
+                if kind == 'T':
+                    hits += 1
+                    entry = entries.get(fields[1])
+                    if entry:
+                        entry[1] = max(entry[1], int(fields[2]))
+                elif kind in ('A', 'E'):
+                    if kind == 'A':
+                        misses += 1
+                    entries[fields[1]] = [int(fields[2]), int(fields[3])]
+                elif kind == 'S':
+                    hits += int(fields[1])
+                    misses += int(fields[2])
+                    evictions += int(fields[3])
+            except (IndexError, ValueError):
+                continue
+        f.close()
+        return entries, (hits, misses, evictions), records
+
+    def _write(self, lines):
+        fd, tmpPath = tempfile.mkstemp(prefix=self.indexName, dir=self.root)
+        try:
+            os.write(fd, ''.join(lines))
+            os.close(fd)
+            os.rename(tmpPath, self.path)
+        except:
+            util.removeIfExists(tmpPath)
+            raise
+
+    def getStats(self):
+        entries, (hits, misses, evictions), records = self._read()
+        return CacheStats(len(entries), sum(x[0] for x in entries.values()),
+                          hits, misses, evictions)
+
+    def prune(self, store, sizeLimit=0, entryLimit=0):
+        """
+            Removes the least recently used entries until the cache is
+            within the given limits, compacting the journal.  Returns the
+            number of entries removed.
+        """
+        entries, (hits, misses, evictions), records = self._read()
+        totalSize = sum(x[0] for x in entries.values())
+        if not ((sizeLimit and totalSize > sizeLimit)
+                or (entryLimit and len(entries) > entryLimit)
+                or records > len(entries) + self.compactSlack):
+            return 0
+        lock = locking.LockFile(self.lockPath)
+        if not lock.acquire(wait=False):
+            # someone else is already pruning.
+            return 0
+        try:
+            # reread now that nobody else can write to it.
+            entries, (hits, misses, evictions), records = self._read()
+            totalSize = sum(x[0] for x in entries.values())
+            sizeTarget = int(sizeLimit * self.lowWater)
+            entryTarget = int(entryLimit * self.lowWater)
+            cutoff = time.time() - self.gracePeriod
+            removed = 0
+            for hash, (size, atime) in sorted(entries.items(),
+                                              key=lambda x: x[1][1]):
+                if ((not sizeLimit or totalSize <= sizeTarget)
+                    and (not entryLimit or len(entries) <= entryTarget)):
+                    break
+                if atime > cutoff:
+                    break
+                util.removeIfExists(store.hashToPath(hash))
+                del entries[hash]
+                totalSize -= size
+                removed += 1
+            lines = ['S %d %d %d\n' % (hits, misses, evictions + removed)]
+            lines.extend('E %s %d %d\n' % (hash, size, atime)
+                         for hash, (size, atime) in entries.iteritems())
+            self._write(lines)
+        finally:
+            lock.release()
+        return removed
+
 class LazyFileCache(util.LazyFileCache):
     # derive from util LazyFileCache which tries to read /proc/self/fd 
     # to get the total number of open files.  Unfortunately, when you 
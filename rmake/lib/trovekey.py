@@ -0,0 +1,30 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+"""
+Host independent names for installed troves, used to compare what a node's
+chroots hold with what a build requires.
+"""
+
+
+def getTroveKey(job):
+    """
+    Name a trove installed by C{job} the same way on every host, for
+    comparing the contents of chroots with a build's requirements.
+    """
+    name, version, flavor = job[0], job[2][0], job[2][1]
+    return '%s=%s[%s]' % (name, version, flavor)
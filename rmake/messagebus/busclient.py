@@ -29,6 +29,7 @@ import socket
 import sys
 import time
 
+from rmake.messagebus import codec
 from rmake.messagebus import logger
 from rmake.messagebus import messages
 from rmake.messagebus import messageprocessor
@@ -281,9 +282,11 @@ class _SessionClient(asyncore.dispatcher):
         self.connected = True
         self.logger.info('Socket connected, sending connect request.')
         self.socket.setblocking(0)
+        # Until the bus answers, assume it only knows the default format.
+        self.messageProcessor.setPayloadFormat(codec.DEFAULT)
         m = messages.ConnectionRequest()
         m.set(self.user, self.password, self.sessionClass, self.sessionId,
-              self.subscriptions)
+              self.subscriptions, payloadFormats=codec.PREFERENCE)
         self.sendMessage(m)
 
     def handle_write(self):
@@ -313,6 +316,7 @@ class _SessionClient(asyncore.dispatcher):
         if isinstance(m, messages.ConnectedResponse):
             self.logger.setSessionId(m.getSessionId())
             self.sessionId = m.headers.sessionId
+            self.messageProcessor.setPayloadFormat(m.getPayloadFormat())
             # send any queued messages that were waiting for 
             # connection to be confirmed
             for outM in self.outMessages:
@@ -376,6 +380,9 @@ class _SessionClient(asyncore.dispatcher):
             if not self._movedData:
                 break
             count += 1
+            # only the first pass waits; after that, just drain whatever
+            # is already available.
+            timeout = 0
         if count:
             return True
         return False
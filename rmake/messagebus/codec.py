@@ -0,0 +1,183 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+"""
+Payload encodings for message bus messages.
+
+Every peer understands the original XML-RPC encoding.  Peers that announce
+support for a compact encoding in their ConnectionRequest get it for the
+lifetime of their session; encoded payloads are self-identifying, but a
+receiver only decodes the compact encoding from peers it negotiated it
+with.
+"""
+
+import marshal
+
+from rmake.lib import xmlrpc_null
+
+
+class XmlCodec(object):
+    name = 'xml'
+
+    @staticmethod
+    def dumps(data):
+        return xmlrpc_null.dumps((data,), allow_none=True)
+
+    @staticmethod
+    def loads(frz):
+        return xmlrpc_null.loads(frz)[0][0]
+
+
+class BinaryCodec(object):
+    """
+    Marshal-based encoding with a versioned magic prefix.
+
+    Only the types the XML-RPC encoding can represent are accepted, and they
+    are normalized the same way (tuples become lists, dictionary keys must be
+    strings), so a payload decodes identically whichever codec carried it.
+    Decoded payloads are checked against the same rules, so a peer can't
+    hand us code objects or any other type marshal knows about.
+    """
+    name = 'bin1'
+    magic = '\x00RMB1'
+    marshalVersion = 2
+
+    @classmethod
+    def dumps(cls, data):
+        return cls.magic + marshal.dumps(_normalize(data), cls.marshalVersion)
+
+    @classmethod
+    def loads(cls, frz):
+        if not frz.startswith(cls.magic):
+            raise ValueError('Not a %s payload' % cls.name)
+        try:
+            data = marshal.loads(frz[len(cls.magic):])
+        except (EOFError, TypeError, ValueError), err:
+            raise ValueError('Malformed %s payload: %s' % (cls.name, err))
+        _validate(data)
+        return data
+
+
+# The XML-RPC encoding only has 32-bit integers.
+MAXINT = 2 ** 31 - 1
+MININT = -2 ** 31
+
+
+def _normalize(data, intern=intern):
+    t = type(data)
+    if t is str or t is float or t is bool or data is None:
+        return data
+    if t is int or t is long:
+        if data > MAXINT or data < MININT:
+            raise TypeError('int exceeds XML-RPC limits')
+        return data
+    if t is dict:
+        d = {}
+        for key, value in data.iteritems():
+            if type(key) is not str:
+                if type(key) is unicode:
+                    key = _normalizeUnicode(key)
+                if type(key) is not str:
+                    raise TypeError('dictionary key must be string')
+            d[intern(key)] = _normalize(value)
+        return d
+    if t is list or t is tuple:
+        return [_normalize(x) for x in data]
+    if t is unicode:
+        return _normalizeUnicode(data)
+    raise TypeError('cannot marshal %s objects' % t.__name__)
+
+
+def _validate(data):
+    """
+    Raise ValueError unless data is something _normalize could have
+    produced.
+    """
+    t = type(data)
+    if (t is str or t is float or t is bool or data is None
+            or t is unicode):
+        return
+    if t is int or t is long:
+        if data > MAXINT or data < MININT:
+            raise ValueError('int exceeds XML-RPC limits')
+        return
+    if t is dict:
+        for key, value in data.iteritems():
+            if type(key) is not str:
+                raise ValueError('dictionary key must be string')
+            _validate(value)
+        return
+    if t is list:
+        for value in data:
+            _validate(value)
+        return
+    raise ValueError('unexpected %s in payload' % t.__name__)
+
+
+def _normalizeUnicode(data):
+    # The XML-RPC decoder hands back plain strings for ASCII text.
+    try:
+        return data.encode('ascii')
+    except UnicodeError:
+        return data
+
+
+DEFAULT = XmlCodec.name
+# Preferred formats first.
+PREFERENCE = [BinaryCodec.name, XmlCodec.name]
+_codecs = dict((x.name, x) for x in (XmlCodec, BinaryCodec))
+
+
+def getCodec(name):
+    return _codecs[name]
+
+
+def negotiate(offered):
+    """
+    Pick the format to use for a session given the space-separated list
+    of formats the peer offered.  Peers that offer nothing get XML.
+    """
+    if not offered:
+        return DEFAULT
+    offered = set(offered.split())
+    for name in PREFERENCE:
+        if name in offered:
+            return name
+    return DEFAULT
+
+
+def detect(frz):
+    if frz.startswith(BinaryCodec.magic):
+        return BinaryCodec.name
+    return XmlCodec.name
+
+
+def dumps(data, payloadFormat=DEFAULT):
+    return _codecs[payloadFormat].dumps(data)
+
+
+def loads(frz, payloadFormat=DEFAULT):
+    """
+    Decode a payload received from a peer that negotiated payloadFormat.
+    XML is always accepted; other encodings only from peers that
+    negotiated them.
+    """
+    frzFormat = detect(frz)
+    if frzFormat != DEFAULT and frzFormat != payloadFormat:
+        raise ValueError('%s payload received on a %s session'
+                         % (frzFormat, payloadFormat))
+    return _codecs[frzFormat].loads(frz)
@@ -218,73 +218,41 @@ class PHeader(object):
 class EnvelopeWriter(object):
     def __init__(self, envelope):
         self._envelope = envelope
-        self._leadWritten = False
-        self._headerWritten = False
-        self._lead = None
-        self._header = None
-        self._buf = None
+        self._data = None
         self._bytesWritten = 0
 
-    def __call__(self, streamWriter):
-        envelope = self._envelope
-        if self._header is None:
+    def getData(self):
+        """
+        Return the whole frozen envelope (lead, header and payload) as
+        one string.
+        """
+        if self._data is None:
+            envelope = self._envelope
             # Freeze header first to set message size
-            self._header = envelope._header.freeze()
-            envelope._lead.msgHeaderSize.set(len(self._header))
-            self._lead = envelope._lead.freeze()
-
-        if not self._leadWritten:
-            rc = streamWriter(self._lead)
-            if rc is None:
-                rc = len(self._lead)
-
-            self._lead = self._lead[rc:]
-            if not self._lead:
-                self._leadWritten = True
-            else:
-                return False
-        if not self._headerWritten:
-            rc = streamWriter(self._header)
-            if rc is None:
-                rc = len(self._header)
-            self._header = self._header[rc:]
-            if not self._header:
-                self._headerWritten = True
-            else:
-                return False
+            header = envelope._header.freeze()
+            envelope._lead.msgHeaderSize.set(len(header))
+            parts = [envelope._lead.freeze(), header]
+            if envelope._payloadStream is not None:
+                payloadSize = envelope._lead.msgPayloadSize()
+                envelope._payloadStream.seek(0)
+                payload = envelope._payloadStream.read(payloadSize)
+                if len(payload) != payloadSize:
+                    raise ValueError('Payload stream is %d bytes short'
+                                     % (payloadSize - len(payload)))
+                parts.append(payload)
+            self._data = ''.join(parts)
+        return self._data
 
-        # Write payload
-        if envelope._payloadStream is None:
-            # No payload
-            return True
-
-        # Rewind payload stream
-        envelope._payloadStream.seek(0)
-
-        payloadSize = envelope._lead.msgPayloadSize()
-        if payloadSize > 0 and envelope._payloadStream is None:
-            raise ValueError
-
-        if self._buf is None:
-            self._bytesRead = 0
-            self._bytesWritten = 0
-            self._buf = ''
-        if self._bytesWritten < payloadSize:
-            if not self._buf:
-                envelope._payloadStream.seek(self._bytesRead)
-                toRead = payloadSize - self._bytesRead
-                self._buf = envelope._payloadStream.read(toRead)
-                self._bytesRead += len(self._buf)
-                if not self._buf:
-                    return False
-            rc = streamWriter(self._buf)
-            if rc is None:
-                rc = len(self._buf)
-            self._bytesWritten += rc
-            self._buf = self._buf[rc:]
-        if self._bytesWritten == payloadSize:
-            self._buf = None
-            return True
+    def __call__(self, streamWriter):
+        data = self.getData()
+        if self._bytesWritten:
+            # Hand out the remainder without copying it.
+            data = memoryview(data)[self._bytesWritten:]
+        rc = streamWriter(data)
+        if rc is None:
+            rc = len(data)
+        self._bytesWritten += rc
+        return self._bytesWritten == len(self._data)
 
 class Envelope(object):
     def __init__(self):
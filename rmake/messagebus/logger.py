@@ -15,17 +15,65 @@
 #
 
 
+import collections
 import logging
 from logging import handlers
 import os
+import pprint
+import time
 import traceback
 
 from conary.lib import util
 
 from rmake.lib import logger
+from rmake.messagebus import codec
+
+
+class _MessageSummary(object):
+    """
+    One line describing a message, formatted only if a handler emits it.
+    """
+    def __init__(self, m):
+        self.m = m
+
+    def __str__(self):
+        headers = self.m.headers
+        return 'Received %s %s from %s to %s (%d bytes)' % (
+                headers.messageType, headers.messageId, headers.sessionId,
+                getattr(headers, 'destination', '-') or '-',
+                self.m.getPayloadStreamSize())
+
+
+class _MessageDump(_MessageSummary):
+    """
+    Full headers and payload of a message, formatted only if a handler
+    emits it.
+    """
+    def __str__(self):
+        m = self.m
+        txt = ' '*4 + '\n    '.join(str(m).split('\n'))
+        stream = m.getPayloadStream()
+        stream.seek(0)
+        payload = stream.read(m.getPayloadStreamSize())
+        if codec.detect(payload) != codec.XmlCodec.name:
+            try:
+                payload = pprint.pformat(codec.loads(payload,
+                                    m.payload.getAcceptedFormat()))
+            except ValueError, err:
+                payload = '<undecodable payload: %s>' % err
+        txt += '\n' + ' '*4 + '\n    '.join(payload.split('\n'))
+        return 'Received Message:\n' + txt
 
 
 class MessageBusLogger(logger.ServerLogger):
+    """
+    Besides the server log, keeps a transcript of the messages seen.  At
+    INFO the transcript has one line per message, at DEBUG the full
+    headers and payload of each message and every delivery made.  Message
+    types can be sampled so that only a fraction of them are logged, and an
+    in-memory trace of the most recent messages can be kept regardless of
+    the log level.
+    """
     name = 'messagebus'
     messageFormat = '%(asctime)s - %(message)s'
 
@@ -42,11 +90,15 @@ class MessageBusLogger(logger.ServerLogger):
                                                       self.consoleDateFormat))
         self.messageConsole.setLevel(logging.INFO)
         self.messageHandler = None
+        # messageType -> fraction of messages of that type to log
+        self.sampleRates = {}
+        self._sampleCredit = {}
+        self._trace = None
 
     def _getTraceback(self):
         return traceback.format_exc()
 
-    def logMessagesToFile(self, logPath):
+    def logMessagesToFile(self, logPath, level=logging.INFO):
         if self.messageHandler:
             self.messageLogger.removeHandler(self.messageHandler)
         util.mkdirChain(os.path.dirname(logPath))
@@ -55,10 +107,10 @@ class MessageBusLogger(logger.ServerLogger):
                                                      self.dateFormat))
         self.messageHandler = fileHandler
         self.messageLogger.addHandler(self.messageHandler)
-        self.messageLogger.setLevel(logging.INFO)
+        self.messageLogger.setLevel(level)
 
-    def enableMessageConsole(self):
-        self.messageLogger.setLevel(logging.INFO)
+    def enableMessageConsole(self, level=logging.INFO):
+        self.messageLogger.setLevel(level)
         self.messageLogger.addHandler(self.messageConsole)
 
     def disableMessageConsole(self):
@@ -78,10 +130,72 @@ class MessageBusLogger(logger.ServerLogger):
         self.error("Writing to sessionId %s failed: %s" %
                    (session.sessionId, self._getTraceback()))
 
+    def setSampleRate(self, messageType, rate):
+        """
+        Log only C{rate} (between 0 and 1) of the messages of type
+        C{messageType}.
+        """
+        rate = max(0.0, min(1.0, float(rate)))
+        if rate == 1.0:
+            self.sampleRates.pop(messageType, None)
+        else:
+            self.sampleRates[messageType] = rate
+        self._sampleCredit.pop(messageType, None)
+
+    def _sample(self, messageType):
+        rate = self.sampleRates.get(messageType)
+        if rate is None:
+            return True
+        # Deterministic: every 1/rate-th message of the type is logged.
+        credit = self._sampleCredit.get(messageType, 0.0) + rate
+        if credit >= 1.0:
+            self._sampleCredit[messageType] = credit - 1.0
+            return True
+        self._sampleCredit[messageType] = credit
+        return False
+
+    def setTraceSize(self, size):
+        """
+        Keep a record of the last C{size} messages in memory; 0 disables
+        the trace.
+        """
+        if not size:
+            self._trace = None
+            return
+        trace = collections.deque(maxlen=size)
+        if self._trace:
+            trace.extend(self._trace)
+        self._trace = trace
+
+    def getTrace(self):
+        """
+        Return the traced messages, oldest first, as
+        (timeStamp, messageType, messageId, sessionId, destination,
+        payloadSize) tuples.
+        """
+        if self._trace is None:
+            return []
+        return list(self._trace)
+
     def logMessage(self, m, fromSession=None):
+        headers = m.headers
         if fromSession:
-            m.headers.sessionId = fromSession.sessionId
-        txt = ' '*4 + '\n    '.join(str(m).split('\n'))
-        txt += ' '*4 + '\n    '.join(m.getPayloadStream().read().split('\n'))
-        txt = 'Received Message:\n' + txt
-        self.messageLogger.info(txt)
+            headers.sessionId = fromSession.sessionId
+        if self._trace is not None:
+            self._trace.append((time.time(), headers.messageType,
+                                headers.messageId, headers.sessionId,
+                                getattr(headers, 'destination', ''),
+                                m.getPayloadStreamSize()))
+        messageLogger = self.messageLogger
+        if not messageLogger.isEnabledFor(logging.INFO):
+            return
+        if not self._sample(headers.messageType):
+            return
+        if messageLogger.isEnabledFor(logging.DEBUG):
+            messageLogger.debug('%s', _MessageDump(m))
+        else:
+            messageLogger.info('%s', _MessageSummary(m))
+
+    def logDelivery(self, m, session):
+        if self.messageLogger.isEnabledFor(logging.DEBUG):
+            self.messageLogger.debug('Sent %r to %s', m, session)
@@ -14,15 +14,38 @@
 # limitations under the License.
 #
 
+import collections
+
+from rmake.messagebus import codec
 from rmake.messagebus import envelope
 from rmake.messagebus import messages
 
 
 class MessageProcessor(object):
+
+    # Stop gathering queued envelopes into a single write once this many
+    # bytes are pending.
+    maxWriteSize = 256 * 1024
+
     def __init__(self):
-        self.messageQueue = []
+        # (envelope, size, message headers) for each message not yet
+        # gathered for writing
+        self.messageQueue = collections.deque()
+        self.queuedBytes = 0
         self.partialReadEnvelope = None
-        self.partialWriteEnvelope = None
+        # Data gathered from one or more envelopes that has not been
+        # completely written yet, and how much of it has been.
+        self.writeBuffer = None
+        self.writeOffset = 0
+        # Payload encoding negotiated for this connection.  Messages
+        # received in another encoding are re-encoded before going out.
+        self.payloadFormat = codec.DEFAULT
+
+    def setPayloadFormat(self, payloadFormat):
+        self.payloadFormat = payloadFormat or codec.DEFAULT
+
+    def getPayloadFormat(self):
+        return self.payloadFormat
 
     def processData(self, streamReader, maxRead):
         if self.partialReadEnvelope:
@@ -41,34 +64,111 @@ class MessageProcessor(object):
     def extractMessage(self, envelope):
         m = messages.thawMessage(envelope.getHeaders(),
                                  envelope.getPayloadStream(),
-                                 envelope.getPayloadSize())
+                                 envelope.getPayloadSize(),
+                                 self.payloadFormat)
         return m
 
     def sendMessage(self, message):
-        headers, payloadStream, payloadSize = message.freeze()
+        headers, payloadStream, payloadSize = message.freeze(self.payloadFormat)
         e = envelope.Envelope()
         e.setHeaders(headers)
         e.setPayloadStream(payloadStream)
         e.setPayloadSize(payloadSize)
-        self.messageQueue.append(e)
+        size = envelope.PLead.frozenSize + payloadSize
+        for key, value in headers.iteritems():
+            size += len(key) + len(str(value)) + 3
+        self.messageQueue.append((e, size, message.headers))
+        self.queuedBytes += size
 
     def getQueuedMessages(self):
         return self.messageQueue
 
+    def getQueuedBytes(self):
+        return self.queuedBytes
+
+    def isQueueOver(self, maxMessages, maxBytes):
+        """
+        Returns True if more than C{maxMessages} messages or C{maxBytes}
+        bytes are queued.  A limit of 0 is no limit.
+        """
+        return bool((maxMessages and len(self.messageQueue) > maxMessages)
+                    or (maxBytes and self.queuedBytes > maxBytes))
+
+    def dropOldest(self, maxMessages, maxBytes, canDrop):
+        """
+        Discard the oldest queued messages for which C{canDrop(headers)} is
+        true until the queue is within the given limits.  Returns the number
+        of messages discarded.
+        """
+        queue = self.messageQueue
+        kept = []
+        dropped = 0
+        while queue and ((maxMessages
+                          and len(queue) + len(kept) > maxMessages)
+                         or (maxBytes and self.queuedBytes > maxBytes)):
+            entry = queue.popleft()
+            if canDrop(entry[2]):
+                self.queuedBytes -= entry[1]
+                dropped += 1
+            else:
+                kept.append(entry)
+        queue.extendleft(reversed(kept))
+        return dropped
+
+    def coalesce(self, getKey):
+        """
+        Discard queued messages that a later queued message supersedes.
+        C{getKey(headers)} returns the same key for messages that supersede
+        each other, or None for messages that must always be sent.  Returns
+        the number of messages discarded.
+        """
+        seen = set()
+        kept = []
+        for entry in reversed(self.messageQueue):
+            key = getKey(entry[2])
+            if key is not None:
+                if key in seen:
+                    self.queuedBytes -= entry[1]
+                    continue
+                seen.add(key)
+            kept.append(entry)
+        dropped = len(self.messageQueue) - len(kept)
+        kept.reverse()
+        self.messageQueue = collections.deque(kept)
+        return dropped
+
     def hasData(self):
-        return bool(self.messageQueue or self.partialWriteEnvelope)
+        return bool(self.messageQueue or self.writeBuffer)
+
+    def _gatherData(self):
+        queue = self.messageQueue
+        chunks = []
+        size = 0
+        while queue and size < self.maxWriteSize:
+            e, queuedSize, _ = queue.popleft()
+            self.queuedBytes -= queuedSize
+            data = e.getWriter().getData()
+            chunks.append(data)
+            size += len(data)
+        if len(chunks) == 1:
+            return chunks[0]
+        return ''.join(chunks)
 
     def sendData(self, socket):
-        if self.partialWriteEnvelope:
-            e, writer = self.partialWriteEnvelope
-        elif self.messageQueue:
-            e = self.messageQueue.pop(0)
-            writer = e.getWriter()
-        else:
-            return
+        if not self.writeBuffer:
+            if not self.messageQueue:
+                return
+            self.writeBuffer = self._gatherData()
+            self.writeOffset = 0
 
-        finished = writer(socket.send)
-        if not finished:
-            self.partialWriteEnvelope = (e, writer)
+        if self.writeOffset:
+            data = memoryview(self.writeBuffer)[self.writeOffset:]
         else:
-            self.partialWriteEnvelope = None
+            data = self.writeBuffer
+        rc = socket.send(data)
+        if rc is None:
+            rc = len(data)
+        self.writeOffset += rc
+        if self.writeOffset == len(self.writeBuffer):
+            self.writeBuffer = None
+            self.writeOffset = 0
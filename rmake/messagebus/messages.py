@@ -16,7 +16,8 @@
 
 
 import StringIO
-from rmake.lib import xmlrpc_null
+
+from rmake.messagebus import codec
 
 
 class MessageHeaders(object):
@@ -42,24 +43,48 @@ class MessagePayload(object):
         self._thawing = False
         self._stream = None
         self._streamSize = 0
+        self._format = None
+        # Encoding negotiated with the peer the stream came from; only it
+        # and XML are decoded.
+        self._accepted = codec.DEFAULT
+        # payloadFormat -> (stream, size) for sessions that negotiated a
+        # different encoding than the one self._stream is in.
+        self._alternates = {}
 
     def getStream(self):
         return self._stream
 
-    def setStream(self, stream, size):
+    def setStream(self, stream, size, payloadFormat=None,
+                  accepted=codec.DEFAULT):
         self._stream = stream
         self._streamSize = size
+        self._format = payloadFormat
+        # Streams we encoded ourselves can always be decoded again.
+        self._accepted = payloadFormat or accepted
+        self._alternates = {}
         self._thawed = False
 
     def getStreamSize(self):
         return self._streamSize
 
+    def getFormat(self):
+        if self._format is None and self._stream:
+            self._stream.seek(0)
+            self._format = codec.detect(
+                    self._stream.read(len(codec.BinaryCodec.magic)))
+        return self._format
+
+    def getAcceptedFormat(self):
+        return self._accepted
+
     def __setattr__(self, key, value):
         if not key.startswith('_'):
             if self._stream and self._thawed:
                 self._stream.close()
                 self._stream = None
                 self._streamSize = 0
+                self._format = None
+                self._alternates = {}
         return object.__setattr__(self, key, value)
 
 class PayloadWrapper(object):
@@ -150,29 +175,54 @@ class _Message:
         self._payload.__dict__.update(d)
 
     def loadPayloadFromString(self, frz):
-        d = xmlrpc_null.loads(frz)[0][0]
+        d = codec.loads(frz, self._payload.getAcceptedFormat())
         self.loadPayloadFromDict(d)
-        self.payload._thawed = True
-
-    def payloadToString(self):
-        return xmlrpc_null.dumps((self.payloadToDict(),), allow_none=True)
+        self._payload._thawed = True
+
+    def payloadToString(self, payloadFormat=codec.DEFAULT):
+        d = self.payloadToDict()
+        try:
+            return codec.dumps(d, payloadFormat)
+        except TypeError:
+            if payloadFormat == codec.DEFAULT:
+                raise
+            # Payloads are self-identifying, so anything the compact
+            # encoding can't carry can still go out as XML.
+            return codec.dumps(d)
 
     def payloadToDict(self):
         return dict((x[0], x[1]) for x in 
                      self.payload.__dict__.iteritems() if not x[0][0] == '_')
 
-    def getPayloadStream(self):
-        if not self.payload.getStream():
-            frz = self.payloadToString()
+    def _getFrozenPayload(self, payloadFormat=None):
+        payload = self._payload
+        if not payload.getStream():
+            frz = self.payloadToString(payloadFormat or codec.DEFAULT)
             s = StringIO.StringIO()
             s.write(frz)
             s.seek(0, 0)
-            self.payload.setStream(s, len(frz))
-        return self.payload.getStream()
-
-    def getPayloadStreamSize(self):
-        self.getPayloadStream()
-        return self.payload.getStreamSize()
+            payload.setStream(s, len(frz), codec.detect(frz))
+        elif payloadFormat and payloadFormat != payload.getFormat():
+            return self._getAlternatePayload(payloadFormat)
+        return payload.getStream(), payload.getStreamSize()
+
+    def _getAlternatePayload(self, payloadFormat):
+        alternate = self._payload._alternates.get(payloadFormat)
+        if alternate is None:
+            # Re-encode a payload received in another session's format.
+            # The result is kept so that broadcasting to many sessions only
+            # pays for each encoding once.
+            self.thawPayloadStream()
+            frz = self.payloadToString(payloadFormat)
+            alternate = (StringIO.StringIO(frz), len(frz))
+            self._payload._alternates[payloadFormat] = alternate
+        return alternate
+
+    def getPayloadStream(self, payloadFormat=None):
+        return self._getFrozenPayload(payloadFormat)[0]
+
+    def getPayloadStreamSize(self, payloadFormat=None):
+        return self._getFrozenPayload(payloadFormat)[1]
 
     def updateHeaders(self, dict):
         for key, value in dict.iteritems():
@@ -183,12 +233,16 @@ class _Message:
         self.headers = MessageHeaders()
         self.updateHeaders(dict)
 
-    def setPayloadStream(self, stream, size):
-        self.payload.setStream(stream, size)
+    def setPayloadStream(self, stream, size, payloadFormat=codec.DEFAULT):
+        """
+        Set the frozen payload as received from a peer that negotiated
+        payloadFormat.
+        """
+        self.payload.setStream(stream, size, accepted=payloadFormat)
 
-    def freeze(self):
-        return ( self.headers.__dict__, self.getPayloadStream(),
-                 self.getPayloadStreamSize() )
+    def freeze(self, payloadFormat=None):
+        stream, size = self._getFrozenPayload(payloadFormat)
+        return ( self.headers.__dict__, stream, size )
 
     def thaw(self, headers, payload):
         self.headers = headers
@@ -206,11 +260,13 @@ class ConnectionRequest(_Message):
     messageType = 'CONNECT'
 
     def set(self, user, password, sessionClass='', sessionId='',
-            subscriptions=None):
+            subscriptions=None, payloadFormats=None):
         self.headers.user = user
         self.headers.password = password
         self.headers.requestedSessionId = sessionId
         self.headers.sessionClass = sessionClass
+        if payloadFormats:
+            self.headers.payloadFormats = ' '.join(payloadFormats)
         if subscriptions is None:
             subscriptions = []
         self.payload.subscriptions = subscriptions
@@ -218,14 +274,23 @@ class ConnectionRequest(_Message):
     def getSessionClass(self):
         return self.headers.sessionClass
 
+    def getPayloadFormats(self):
+        return getattr(self.headers, 'payloadFormats', '')
+
     def getSubscriptions(self):
         return self.payload.subscriptions
 
 class ConnectedResponse(_Message):
     messageType = 'CONNECTED'
 
-    def set(self, sessionId):
+    def set(self, sessionId, payloadFormat=None):
         self.headers.sessionId = sessionId
+        if payloadFormat:
+            self.headers.payloadFormat = payloadFormat
+
+    def getPayloadFormat(self):
+        # Buses that predate format negotiation only speak XML.
+        return getattr(self.headers, 'payloadFormat', None) or codec.DEFAULT
 
 class SubscribeRequest(_Message):
     messageType = 'SUBSCRIBE'
@@ -308,7 +373,8 @@ class NodeStatus(Message):
         return self.headers.status == 'DISCONNECTED'
 
 
-def thawMessage(headers, payloadStream, payloadSize):
+def thawMessage(headers, payloadStream, payloadSize,
+                payloadFormat=codec.DEFAULT):
     messageType = headers['messageType']
     if messageType in _messageTypes:
         class_ = _messageTypes[messageType]
@@ -316,6 +382,6 @@ def thawMessage(headers, payloadStream, payloadSize):
         class_ = DummyMessage
     m = class_()
     m.setHeaders(headers)
-    m.setPayloadStream(payloadStream, payloadSize)
+    m.setPayloadStream(payloadStream, payloadSize, payloadFormat)
     #m.thawPayloadStream()
     return m
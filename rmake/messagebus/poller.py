@@ -0,0 +1,167 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+"""
+Pollers drive a map of asyncore dispatchers, calling their handle_* methods
+exactly as asyncore.poll2 would.
+"""
+
+import asyncore
+import errno
+import os
+import select
+
+
+class PollPoller(object):
+    """
+    Plain asyncore.poll2: every call builds a new poll set from the map, so
+    the cost of each call grows with the number of connections.
+    """
+    name = 'poll'
+
+    def __init__(self, socketMap):
+        self.socketMap = socketMap
+
+    def poll(self, timeout=None):
+        asyncore.poll2(timeout=timeout, map=self.socketMap)
+
+    def close(self):
+        pass
+
+
+class EpollPoller(object):
+    """
+    Keeps every dispatcher registered with a single epoll object and only
+    tells the kernel about changes in what each one is waiting for.
+    """
+    name = 'epoll'
+
+    def __init__(self, socketMap):
+        self.socketMap = socketMap
+        self._epoll = None
+        self._pid = None
+        # fd -> (dispatcher, eventmask) as last registered
+        self._registered = {}
+
+    def _getEpoll(self):
+        # The epoll object is created on first use, and again after a fork,
+        # so that a parent and child never share registrations.
+        if self._epoll is None or self._pid != os.getpid():
+            self.close()
+            self._epoll = select.epoll()
+            self._pid = os.getpid()
+            self._registered = {}
+        return self._epoll
+
+    def _unregister(self, epoll, fd):
+        try:
+            epoll.unregister(fd)
+        except (IOError, OSError), err:
+            # Closing a descriptor removes it from the epoll set for us.
+            if err.errno not in (errno.EBADF, errno.ENOENT):
+                raise
+
+    def _register(self, epoll, fd, flags):
+        try:
+            epoll.register(fd, flags)
+        except (IOError, OSError), err:
+            if err.errno != errno.EEXIST:
+                raise
+            epoll.modify(fd, flags)
+
+    def _update(self, epoll):
+        registered = self._registered
+        for fd in registered.keys():
+            if fd not in self.socketMap:
+                del registered[fd]
+                self._unregister(epoll, fd)
+        for fd, obj in self.socketMap.items():
+            flags = _getEventMask(obj)
+            current = registered.get(fd)
+            if current is not None:
+                if current == (obj, flags):
+                    continue
+                if current[0] is obj and flags:
+                    epoll.modify(fd, flags)
+                    registered[fd] = (obj, flags)
+                    continue
+                # Either nothing to wait for, or the descriptor has been
+                # reused by a new dispatcher.
+                del registered[fd]
+                self._unregister(epoll, fd)
+            if flags:
+                self._register(epoll, fd, flags)
+                registered[fd] = (obj, flags)
+
+    def poll(self, timeout=None):
+        epoll = self._getEpoll()
+        self._update(epoll)
+        if timeout is None:
+            timeout = -1
+        try:
+            events = epoll.poll(timeout)
+        except (IOError, select.error), err:
+            if err.args[0] != errno.EINTR:
+                raise
+            return
+        for fd, flags in events:
+            obj = self.socketMap.get(fd)
+            if obj is None:
+                continue
+            asyncore.readwrite(obj, flags)
+
+    def close(self):
+        if self._epoll is not None:
+            self._epoll.close()
+            self._epoll = None
+        self._registered = {}
+
+
+def _getEventMask(obj):
+    # Same decisions as asyncore.poll2.  The epoll and poll event bits
+    # share their values, so asyncore.readwrite understands either.
+    flags = 0
+    if obj.readable():
+        flags |= select.EPOLLIN | select.EPOLLPRI
+    # accepting sockets should not be writable
+    if obj.writable() and not obj.accepting:
+        flags |= select.EPOLLOUT
+    if flags:
+        flags |= select.EPOLLERR | select.EPOLLHUP
+    return flags
+
+
+POLLERS = dict((x.name, x) for x in (PollPoller, EpollPoller))
+
+
+def getPollerNames():
+    names = [PollPoller.name]
+    if hasattr(select, 'epoll'):
+        names.insert(0, EpollPoller.name)
+    return names
+
+
+def getPoller(socketMap, name=None):
+    """
+    Return a poller for C{socketMap}.  With no C{name}, the most scalable
+    poller available on this platform is used.
+    """
+    if not name:
+        name = getPollerNames()[0]
+    if name not in getPollerNames():
+        raise ValueError('Unknown or unsupported poller %r' % (name,))
+    return POLLERS[name](socketMap)
@@ -42,6 +42,15 @@ class MessageBusAdminClient(object):
             connected clients """
         return self.messagebus.listQueueLengths()
 
+    def getMessageBusQueueStats(self):
+        """ Returns per-session queue statistics and the totals for the
+            whole message bus """
+        return self.messagebus.getQueueStats()
+
+    def getMessageBusTrace(self):
+        """ Returns the message bus's trace of recent messages """
+        return self.messagebus.getMessageTrace()
+
     def sendMessage(self, direction, m):
         self._client.sendMessage(direction, m)
 
@@ -85,6 +94,13 @@ class MessageBusAdminClient(object):
         """
         return self.getDispatcher().listAssignedCommands()
 
+    def getDispatcherLocalityStats(self):
+        """
+            Asks the dispatcher how many of the assigned commands' build
+            requirements were already in chroots on the nodes chosen.
+        """
+        return self.getDispatcher().getLocalityStats()
+
     def getNode(self, nodeId):
         nodeClient =  self.nodes.get(nodeId, None)
         if not nodeClient:
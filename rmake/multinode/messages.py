@@ -15,7 +15,13 @@
 #
 
 
+import xmlrpclib
+
+from rmake.lib import bloomfilter
+from rmake.lib import repocache
+from rmake.lib.trovekey import getTroveKey
 from rmake.lib.apiutils import thaw, freeze
+from rmake.messagebus import codec
 from rmake.messagebus.messages import *
 from rmake.multinode import nodetypes
 
@@ -70,29 +76,68 @@ class EventList(Message):
 
 class NodeInfo(Message):
     """
-        Node status message
+        Node status message.  The node's CPUs and mounts were sent when it
+        registered, so this only carries what has changed since: the status
+        from MachineInformation.getStatus() and the running commands.
+        Older nodes send a whole MachineInformation instead.
+
+        The chroot summary is a dict of Bloom filters of the troves in the
+        node's cached and old chroots, from ChrootManager.getChrootSummary.
     """
     messageType = 'NODE_INFO'
 
-    def set(self, nodeInfo, commands):
-        self.payload.nodeInfo = nodeInfo
+    def set(self, status, commands, cacheStats=None, chrootSummary=None):
+        self.payload.status = status
         self.payload.commands = commands
+        self.payload.cacheStats = cacheStats
+        self.payload.chrootSummary = chrootSummary
+
+    def getStatus(self):
+        return self.payload.status
 
     def getNodeInfo(self):
+        """
+            Returns the complete MachineInformation sent by an older node,
+            or None.
+        """
         return self.payload.nodeInfo
 
     def getCommands(self):
         return self.payload.commands
 
+    def getCacheStats(self):
+        return self.payload.cacheStats
+
+    def getChrootSummary(self):
+        return self.payload.chrootSummary
+
     def payloadToDict(self):
-        d = dict(nodeInfo=freeze('MachineInformation', self.payload.nodeInfo),
-                 commands=self.payload.commands)
+        d = dict(status=self.payload.status, commands=self.payload.commands)
+        if self.payload.cacheStats:
+            # byte counts can overflow an XMLRPC int
+            d['cacheStats'] = [ str(x) for x in self.payload.cacheStats ]
+        if self.payload.chrootSummary is not None:
+            d['chrootSummary'] = dict((x[0], x[1].__freeze__())
+                                for x in self.payload.chrootSummary.items())
         return d
 
     def loadPayloadFromDict(self, d):
         self._payload.__dict__.update(d)
-        self.payload.nodeInfo = thaw('MachineInformation',
-                                     self.payload.nodeInfo)
+        nodeInfo = d.get('nodeInfo')
+        if nodeInfo:
+            nodeInfo = thaw('MachineInformation', nodeInfo)
+        self._payload.nodeInfo = nodeInfo
+        self._payload.status = d.get('status')
+        cacheStats = d.get('cacheStats')
+        if cacheStats:
+            cacheStats = repocache.CacheStats(*[ int(x) for x in cacheStats ])
+        self.payload.cacheStats = cacheStats
+        chrootSummary = d.get('chrootSummary')
+        if chrootSummary is not None:
+            chrootSummary = dict(
+                    (x[0], bloomfilter.BloomFilter.__thaw__(x[1]))
+                    for x in chrootSummary.items())
+        self._payload.chrootSummary = chrootSummary
 
 
 class StopJobRequest(Message):
@@ -106,6 +151,87 @@ class StopJobRequest(Message):
         return self.payload.jobId
 
 
+class BuildLogRequest(Message):
+    """
+        Client asks the server to push a trove's build log to it, starting at
+        byte C{mark} (or that many bytes from the end if negative), or to
+        stop doing so.
+    """
+    messageType = 'BUILD_LOG_REQUEST'
+
+    def set(self, jobId, troveTuple, mark=0, follow=True):
+        self.headers.jobId = str(jobId)
+        self.headers.mark = str(mark)
+        self.headers.follow = follow and '1' or ''
+        self.payload.troveTuple = troveTuple
+
+    def getJobId(self):
+        return int(self.headers.jobId)
+
+    def getTroveTuple(self):
+        return self.payload.troveTuple
+
+    def getMark(self):
+        return int(self.headers.mark)
+
+    def isFollow(self):
+        return bool(self.headers.follow)
+
+    def payloadToDict(self):
+        return dict(troveTuple=freeze('troveContextTuple',
+                                      self.payload.troveTuple))
+
+    def loadPayloadFromDict(self, d):
+        self._payload.troveTuple = thaw('troveContextTuple', d['troveTuple'])
+
+
+class BuildLogData(Message):
+    """
+        Part of a build log pushed to a client following it, starting at
+        byte C{offset} of the log.  No more will be sent after a final one.
+    """
+    messageType = 'BUILD_LOG'
+
+    def set(self, jobId, troveTuple, offset, data, isFinal=False):
+        self.headers.jobId = str(jobId)
+        self.headers.offset = str(offset)
+        self.headers.isFinal = isFinal and '1' or ''
+        self.payload.troveTuple = troveTuple
+        self.payload.data = data
+
+    def getJobId(self):
+        return int(self.headers.jobId)
+
+    def getTroveTuple(self):
+        return self.payload.troveTuple
+
+    def getOffset(self):
+        return int(self.headers.offset)
+
+    def isFinal(self):
+        return bool(self.headers.isFinal)
+
+    def getData(self):
+        data = self.payload.data
+        if isinstance(data, xmlrpclib.Binary):
+            data = data.data
+        return data
+
+    def payloadToString(self, payloadFormat=codec.DEFAULT):
+        data = self.getData()
+        if payloadFormat == codec.DEFAULT:
+            # XML-RPC strings can't hold arbitrary bytes.
+            data = xmlrpclib.Binary(data)
+        return codec.dumps(dict(data=data,
+                troveTuple=freeze('troveContextTuple',
+                                  self.payload.troveTuple)),
+                payloadFormat)
+
+    def loadPayloadFromDict(self, d):
+        self._payload.data = d['data']
+        self._payload.troveTuple = thaw('troveContextTuple', d['troveTuple'])
+
+
 class _Command(Message):
     """
         Superclass for command requests.
@@ -121,6 +247,23 @@ class _Command(Message):
     def requiresChroot(self):
         return False
 
+    def getRequiredTroves(self):
+        """
+            Returns the keys from trovekey.getTroveKey of the troves
+            to be installed in the chroot for this command.
+        """
+        return []
+
+    def reusesChroots(self):
+        return False
+
+    def isLightweight(self):
+        """
+            Returns True for cheap commands that may use a node's
+            lightSlots instead of waiting for a regular slot.
+        """
+        return False
+
     def getTargetNode(self):
         return self.headers.targetNode
 
@@ -145,6 +288,9 @@ class ResolveCommand(_Command):
         self.payload.resolveJob = resolveJob
         self.payload.logData = logData
 
+    def isLightweight(self):
+        return True
+
     def getTrove(self):
         return self.payload.resolveJob.getTrove()
 
@@ -173,6 +319,9 @@ class LoadCommand(_Command):
         self.payload.loadTroves = loadTroves
         self.payload.reposName = reposName
 
+    def isLightweight(self):
+        return True
+
     def getJob(self):
         return self.payload.job
 
@@ -226,6 +375,14 @@ class BuildCommand(_Command):
            return [ x[2][1] for x in self.payload.buildReqs ]
         return []
 
+    def getRequiredTroves(self):
+        return [ getTroveKey(x) for x in (self.payload.buildReqs
+                                          + self.payload.crossReqs
+                                          + self.payload.bootstrapReqs) ]
+
+    def reusesChroots(self):
+        return bool(self.payload.buildCfg.reuseRoots)
+
     def getBuildConfig(self):
         return self.payload.buildCfg
 
@@ -14,6 +14,7 @@
 # limitations under the License.
 #
 
+from rmake.lib import repocache
 from rmake.lib.apiutils import thaw, freeze
 
 
@@ -50,21 +51,28 @@ class Dispatcher(NodeType):
 class WorkerNode(NodeType):
     nodeType = 'WORKER'
     def __init__(self, name, host, slots, jobTypes, buildFlavors, loadThreshold,
-                 nodeInfo, chroots, chrootLimit):
+                 nodeInfo, chroots, chrootLimit, cacheStats=None,
+                 lightSlots=0):
         self.name = name
         self.host = host
         self.slots = slots
+        self.lightSlots = lightSlots
         self.jobTypes = jobTypes
         self.buildFlavors = buildFlavors
         self.loadThreshold = loadThreshold
         self.nodeInfo = nodeInfo
         self.chroots = chroots
         self.chrootLimit = chrootLimit
+        self.cacheStats = cacheStats
 
     def freeze(self):
         d = self.__dict__.copy()
         d['buildFlavors'] = [freeze('flavor', x) for x in self.buildFlavors]
         d['nodeInfo'] = freeze('MachineInformation', self.nodeInfo)
+        if self.cacheStats:
+            d['cacheStats'] = [ str(x) for x in self.cacheStats ]
+        else:
+            del d['cacheStats']
         return self.nodeType, d
 
     @classmethod
@@ -72,6 +80,9 @@ class WorkerNode(NodeType):
         self = class_(**d)
         self.buildFlavors = [ thaw('flavor', x) for x in self.buildFlavors ]
         self.nodeInfo = thaw('MachineInformation', self.nodeInfo)
+        if self.cacheStats:
+            self.cacheStats = repocache.CacheStats(
+                                    *[ int(x) for x in self.cacheStats ])
         return self
 
 class BuildManager(NodeType):
@@ -87,8 +87,12 @@ class WorkerClient(server.Server):
             return True
         return False
 
-    def handleRequestIfReady(self):
-        self.client.poll()
+    def handleRequestIfReady(self, sleep=0.1):
+        """
+            Waits up to sleep seconds for messages from the bus, returning
+            as soon as any arrive.
+        """
+        self.client.poll(timeout=sleep)
         self.client._collectChildren()
 
 
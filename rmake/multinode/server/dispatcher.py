@@ -25,9 +25,11 @@
     to the dispatcher for querying the dispatcher status out-of-band.
 """
 
+import bisect
 import signal
 from conary.deps import deps
 from rmake import errors
+from rmake.lib import bloomfilter
 from rmake.lib import flavorutil
 from rmake.lib import logger
 from rmake.lib import server
@@ -68,6 +70,9 @@ class DispatcherServer(server.Server):
     def listAssignedCommands(self):
         return self._nodes.getCommandAssignments()
 
+    def getLocalityStats(self):
+        return self._nodes.getLocalityStats()
+
     def getNodeByName(self, nodeName):
         try:
             return self._nodes.getNodeByName(nodeName)
@@ -134,13 +139,18 @@ class DispatcherServer(server.Server):
         self._nodes.add(sessionId, node)
         self._assignQueuedCommands()
 
-    def nodeUpdated(self, sessionId, nodeInfo, commandIds):
+    def nodeUpdated(self, sessionId, nodeInfo, commandIds, cacheStats=None,
+                    status=None, chrootSummary=None):
         """
             Entry point from messagebus client to alert dispatcher that
-            a node connected.
+            a node sent a heartbeat.  Current nodes send only a status to
+            apply to the nodeInfo they registered with; older ones send a
+            whole new nodeInfo.
         """
         if sessionId in self._nodes:
-            self._nodes.updateStatus(sessionId, nodeInfo, commandIds)
+            self._nodes.updateStatus(sessionId, nodeInfo, commandIds,
+                                     cacheStats, status=status,
+                                     chrootSummary=chrootSummary)
             self._assignQueuedCommands()
         else:
             self.log('Discarding heartbeat from unknown %s' % sessionId)
@@ -239,6 +249,11 @@ class DispatcherNodeClient(nodeclient.NodeClient):
     def listAssignedCommands(self, callData):
         return self.server.listAssignedCommands()
 
+    @api(version=1)
+    @api_return(1, None)
+    def getLocalityStats(self, callData):
+        return self.server.getLocalityStats()
+
     @api(version=1)
     @api_parameters(1, None)
     @api_return(1, None)
@@ -271,7 +286,9 @@ class DispatcherNodeClient(nodeclient.NodeClient):
             self.server.nodeRegistered(m.getSessionId(), m.getNode())
         elif isinstance(m, messages.NodeInfo):
             self.server.nodeUpdated(m.getSessionId(), m.getNodeInfo(),
-                                    m.getCommands())
+                                    m.getCommands(), m.getCacheStats(),
+                                    status=m.getStatus(),
+                                    chrootSummary=m.getChrootSummary())
         elif isinstance(m, messages._Command):
             if m.getTargetNode():
                 # we've already assigned this command
@@ -313,6 +330,9 @@ class DispatcherRPCClient(object):
     def listAssignedCommands(self):
         return self.proxy.listAssignedCommands()
 
+    def getLocalityStats(self):
+        return self.proxy.getLocalityStats()
+
     def getNodeByName(self, nodeName):
         return self.proxy.getNodeByName(nodeName)
 
@@ -330,8 +350,29 @@ class NodeList(object):
         self._commands = {}
         self._usedSlots = {}
         self._usedChroots = {}
+        # lightweight commands that were given one of their node's
+        # lightSlots rather than a regular slot
+        self._usedLightSlots = {}
+        self._lightCommands = set()
         self._commandsByJob = {}
         self._suspended = set()
+        # Nodes that can take a command right now, as sorted
+        # (score, load, sessionId) keys with the best node first.  Kept up
+        # to date as slots are used and freed and heartbeats arrive, so
+        # finding a node does not mean ranking all of them.
+        self._ranked = []
+        self._rankKeys = {}
+        # frozenset of flavors -> set of sessionIds of nodes able to build
+        # all of them.  Build flavors only change when a node registers.
+        self._flavorIndex = {}
+        # sessionId -> Bloom filters of the troves in the node's cached
+        # ('cache') and old ('chroots') chroots
+        self._chrootSummaries = {}
+        # Build requirements of the assigned commands, how many of them
+        # were probably already on the chosen nodes, and how many would
+        # have been on the nodes picked by load alone.
+        self._localityStats = dict(commands=0, troves=0, warmTroves=0,
+                                   baselineWarmTroves=0)
         self.nodeDb = nodeDb
         self.logger = logger
 
@@ -341,6 +382,13 @@ class NodeList(object):
         self._assignedCommands.setdefault(sessionId, [])
         self._usedSlots.setdefault(sessionId, 0)
         self._usedChroots.setdefault(sessionId, 0)
+        self._usedLightSlots.setdefault(sessionId, 0)
+        for flavors, sessionIds in self._flavorIndex.iteritems():
+            if self._canBuild(node, flavors):
+                sessionIds.add(sessionId)
+            else:
+                sessionIds.discard(sessionId)
+        self._rerank(sessionId)
         self.nodeDb.addNode(node.name, node.host, node.slots, node.buildFlavors,
                             node.chroots)
 
@@ -349,21 +397,29 @@ class NodeList(object):
         self.nodeDb.removeNode(node.name)
         for command in self._assignedCommands.pop(sessionId, []):
             self._commands.pop(command.getCommandId())
+            self._lightCommands.discard(command.getCommandId())
         self._usedSlots.pop(sessionId, None)
         self._usedChroots.pop(sessionId, None)
+        self._usedLightSlots.pop(sessionId, None)
         self._suspended.discard(sessionId)
+        self._chrootSummaries.pop(sessionId, None)
+        for sessionIds in self._flavorIndex.itervalues():
+            sessionIds.discard(sessionId)
+        self._rerank(sessionId)
 
     def suspend(self, sessionId):
         if sessionId not in self._nodes:
             raise KeyError("Unknown node %r" % (sessionId,))
         self.logger.info("Suspending jobs to node %s", sessionId)
         self._suspended.add(sessionId)
+        self._rerank(sessionId)
 
     def resume(self, sessionId):
         if sessionId not in self._nodes:
             raise KeyError("Unknown node %r" % (sessionId,))
         self.logger.info("Resuming jobs to node %s", sessionId)
         self._suspended.discard(sessionId)
+        self._rerank(sessionId)
 
     def getNodeForCommand(self, commandId):
         if commandId in self._commands:
@@ -388,59 +444,180 @@ class NodeList(object):
         else:
             return usedSlots / float(node.slots)
 
+    def _getRankKey(self, node):
+        return (self._getScore(node), int(node.nodeInfo.loadavg[0]),
+                node.sessionId)
+
     def rankNodes(self, nodeList):
-        return sorted(nodeList, key = lambda x: (self._getScore(x),
-                                                 int(x.nodeInfo.loadavg[0]),
-                                               ))
+        return sorted(nodeList, key=self._getRankKey)
+
+    def _isOpen(self, node):
+        sessionId = node.sessionId
+        if sessionId in self._suspended:
+            return False
+        if self._usedSlots[sessionId] >= node.slots:
+            return False
+        if node.nodeInfo.getLoadAverage(1) > node.loadThreshold:
+            return False
+        return True
+
+    def _rerank(self, sessionId):
+        """
+            Move a node to its place in the ranking, or out of it, after
+            something that changes its score or whether it is open.
+        """
+        key = self._rankKeys.pop(sessionId, None)
+        if key is not None:
+            del self._ranked[bisect.bisect_left(self._ranked, key)]
+        node = self._nodes.get(sessionId)
+        if node is None or not self._isOpen(node):
+            return
+        key = self._getRankKey(node)
+        bisect.insort(self._ranked, key)
+        self._rankKeys[sessionId] = key
 
     def getNodes(self):
         return self._nodes.values()
 
-    def getOpenNodes(self, requiresChroot=False):
-        candidates = []
-        for sessionId, node in self._nodes.items():
-            if sessionId in self._suspended:
-                continue
-            if self._usedSlots[sessionId] >= node.slots:
-                continue
+    def _iterOpenNodes(self, requiresChroot=False):
+        # best node first
+        for key in self._ranked:
+            sessionId = key[-1]
+            node = self._nodes[sessionId]
             if requiresChroot and self._usedChroots[sessionId] >= node.chrootLimit:
                 continue
-            if node.nodeInfo.getLoadAverage(1) > node.loadThreshold:
-                continue
-            candidates.append(node)
-        return candidates
+            yield node
+
+    def getOpenNodes(self, requiresChroot=False):
+        return list(self._iterOpenNodes(requiresChroot))
 
     def getCommandAssignments(self):
         # returns commandId, sessionId pairs
         return [ (x[0], x[1][0]) for x in self._commands.items() ]
 
-    def getNodeForFlavors(self, flavors, requiresChroot=False):
-        nodes = []
-        for node in self.getOpenNodes(requiresChroot=requiresChroot):
-            if not flavors:
-                nodes.append(node)
+    def _canBuild(self, node, flavors):
+        for flavor in flavors:
+            archFlavor = flavorutil.getArchFlags(flavor, getTarget=False,
+                                                 withFlags=False)
+            for buildFlavor in node.buildFlavors:
+                filteredFlavor = deps.filterFlavor(flavor, [buildFlavor,
+                                                            archFlavor])
+                if buildFlavor.stronglySatisfies(filteredFlavor):
+                    break
+            else:
+                return False
+        return True
+
+    def _getCapableNodes(self, flavors):
+        """
+            Returns the set of sessionIds of nodes that can build all of
+            C{flavors}, which must be a frozenset.
+        """
+        sessionIds = self._flavorIndex.get(flavors)
+        if sessionIds is None:
+            sessionIds = set(x.sessionId for x in self._nodes.itervalues()
+                             if self._canBuild(x, flavors))
+            self._flavorIndex[flavors] = sessionIds
+        return sessionIds
+
+    def _countMissing(self, sessionId, hashes, reuseChroots, limit=None):
+        """
+            Returns how many of the troves with Bloom filter C{hashes} a
+            node probably has to install, counting no higher than
+            C{limit} + 1.
+        """
+        summary = self._chrootSummaries.get(sessionId) or {}
+        filters = []
+        if 'cache' in summary:
+            filters.append(summary['cache'])
+        if reuseChroots and 'chroots' in summary:
+            filters.append(summary['chroots'])
+        if not filters:
+            return len(hashes)
+        missing = 0
+        for troveHashes in hashes:
+            for bloom in filters:
+                if bloom.containsHashes(troveHashes):
+                    break
+            else:
+                missing += 1
+                if limit is not None and missing > limit:
+                    break
+        return missing
+
+    def _findNode(self, flavors, requiresChroot=False, troves=(),
+                  reuseChroots=False):
+        """
+            Returns the open node able to build C{flavors} that has to
+            install the fewest of C{troves}, preferring the best ranked
+            node among equals.  Also returns how many troves it has to
+            install, and how many the best ranked node would have.
+        """
+        if flavors:
+            capable = self._getCapableNodes(frozenset(flavors))
+        else:
+            capable = None
+        troves = set(troves)
+        hashes = None
+        if troves and self._chrootSummaries:
+            getHashes = bloomfilter.BloomFilter.getHashes
+            hashes = [ getHashes(x) for x in troves ]
+        best = bestMissing = baselineMissing = None
+        for node in self._iterOpenNodes(requiresChroot=requiresChroot):
+            if capable is not None and node.sessionId not in capable:
                 continue
-            for flavor in flavors:
-                found = False
-                archFlavor = flavorutil.getArchFlags(flavor, getTarget=False,
-                                                     withFlags=False)
-                for buildFlavor in node.buildFlavors:
-                    filteredFlavor = deps.filterFlavor(flavor, [buildFlavor,
-                                                                archFlavor])
-                    if buildFlavor.stronglySatisfies(filteredFlavor):
-                        found = True
-                        break
-                if not found:
+            if hashes is None:
+                return node, len(troves), len(troves)
+            missing = self._countMissing(node.sessionId, hashes,
+                                         reuseChroots, bestMissing)
+            if best is None:
+                baselineMissing = missing
+            if best is None or missing < bestMissing:
+                best, bestMissing = node, missing
+                if not missing:
                     break
-            if found:
-                nodes.append(node)
-        if not nodes:
-            return None
-        return self.rankNodes(nodes)[0]
+        return best, bestMissing, baselineMissing
 
-    def updateStatus(self, sessionId, nodeInfo, commandIds):
+    def _findLightNode(self, flavors):
+        """
+            Returns the node able to build C{flavors} with the most free
+            lightSlots, or None if there is none.
+        """
+        if flavors:
+            capable = self._getCapableNodes(frozenset(flavors))
+        else:
+            capable = None
+        best = bestFree = None
+        for sessionId, node in self._nodes.iteritems():
+            if sessionId in self._suspended:
+                continue
+            if capable is not None and sessionId not in capable:
+                continue
+            free = node.lightSlots - self._usedLightSlots[sessionId]
+            if free > 0 and (best is None or free > bestFree):
+                best, bestFree = node, free
+        return best
+
+    def getNodeForFlavors(self, flavors, requiresChroot=False, troves=(),
+                          reuseChroots=False):
+        return self._findNode(flavors, requiresChroot, troves,
+                              reuseChroots)[0]
+
+    def getLocalityStats(self):
+        return dict(self._localityStats)
+
+    def updateStatus(self, sessionId, nodeInfo, commandIds, cacheStats=None,
+                     status=None, chrootSummary=None):
         #self.db.updateNode(sessionId, nodeInfo)
-        self._nodes[sessionId].nodeInfo = nodeInfo
+        if nodeInfo:
+            self._nodes[sessionId].nodeInfo = nodeInfo
+        if status:
+            self._nodes[sessionId].nodeInfo.setStatus(status)
+        if cacheStats:
+            self._nodes[sessionId].cacheStats = cacheStats
+        if chrootSummary is not None:
+            self._chrootSummaries[sessionId] = chrootSummary
+        self._rerank(sessionId)
         assignedCommandIds = [ x.getCommandId() for x in 
                              self._assignedCommands[sessionId] ]
         for commandId in commandIds:
@@ -461,10 +638,15 @@ class NodeList(object):
 
         self.logger.info('removing command: %s' % commandId)
 
-        if sessionId in self._usedSlots:
+        if commandId in self._lightCommands:
+            self._lightCommands.remove(commandId)
+            if sessionId in self._usedLightSlots:
+                self._usedLightSlots[sessionId] -= 1
+        elif sessionId in self._usedSlots:
             self._usedSlots[sessionId] = max(0, self._usedSlots[sessionId] - 1)
         if sessionId in self._usedChroots and command.requiresChroot():
             self._usedChroots[sessionId]  = max(0, self._usedChroots[sessionId] - 1)
+        self._rerank(sessionId)
         commandsByJob = self._commandsByJob.get(command.getJobId(), [])
         if command in commandsByJob:
             commandsByJob.remove(command)
@@ -478,24 +660,57 @@ class NodeList(object):
         self._commandsByJob.setdefault(command.getJobId(), []).append(
                                                                   command)
         self._assignedCommands[sessionId].append(command)
-        for sessionId, node2 in sorted(self._nodes.items()):
-            self.logger.info("  node %s using %d/%d slots, %d/%d chroots",
-                    sessionId,
-                    self._usedSlots[sessionId], node2.slots,
-                    self._usedChroots[sessionId], node2.chrootLimit)
-        self._usedSlots[node.sessionId] += 1
+        if (command.isLightweight()
+                and self._usedLightSlots[sessionId] < node.lightSlots):
+            self._usedLightSlots[sessionId] += 1
+            self._lightCommands.add(command.getCommandId())
+        else:
+            self._usedSlots[sessionId] += 1
         if command.requiresChroot():
             self._usedChroots[node.sessionId] += 1
-        self.logger.info('assigned %s to %s' % (command.getCommandId(), node.host))
+        self._rerank(sessionId)
+        self.logger.info('assigned %s to %s (node %s using %d/%d slots, '
+                         '%d/%d light slots, %d/%d chroots)',
+                         command.getCommandId(), node.host, sessionId,
+                         self._usedSlots[sessionId], node.slots,
+                         self._usedLightSlots[sessionId], node.lightSlots,
+                         self._usedChroots[sessionId], node.chrootLimit)
 
     def assignCommands(self, commands):
         l = []
+        # (flavors, requiresChroot) that no node can take during this pass;
+        # assigning more commands only uses up nodes.
+        unassignable = set()
+        # whether lightweight commands might still find a free light slot
+        lightOpen = True
         for command in commands:
-            flavors = command.getRequiredFlavors()
-            node = self.getNodeForFlavors(flavors,
-                                     requiresChroot=command.requiresChroot())
+            flavors = frozenset(command.getRequiredFlavors())
+            if lightOpen and command.isLightweight():
+                node = self._findLightNode(flavors)
+                if node is not None:
+                    self.assignCommand(command, node)
+                    l.append((command, node))
+                    continue
+                lightOpen = False
+            if not self._ranked:
+                if lightOpen:
+                    continue
+                break
+            requiresChroot = command.requiresChroot()
+            if (flavors, requiresChroot) in unassignable:
+                continue
+            troves = set(command.getRequiredTroves())
+            node, missing, baselineMissing = self._findNode(flavors,
+                    requiresChroot, troves, command.reusesChroots())
             if node is None:
+                unassignable.add((flavors, requiresChroot))
                 continue
+            if troves:
+                stats = self._localityStats
+                stats['commands'] += 1
+                stats['troves'] += len(troves)
+                stats['warmTroves'] += len(troves) - missing
+                stats['baselineWarmTroves'] += len(troves) - baselineMissing
             self.assignCommand(command, node)
             l.append((command, node))
         return l
@@ -31,6 +31,7 @@ a of the message has value "b".
 """
 import asyncore
 import errno
+import logging
 import optparse
 import os
 import resource
@@ -46,9 +47,11 @@ from rmake.lib import apirpc
 from rmake.lib.apiutils import api, api_parameters, api_return, freeze
 from rmake.lib.daemon import daemonize, setDebugHook
 
+from rmake.messagebus import codec
 from rmake.messagebus import logger
 from rmake.messagebus import messageprocessor
 from rmake.messagebus import messages
+from rmake.messagebus import poller as poller_
 from rmake.messagebus import rpclib
 from rmake.messagebus.busclient import ConnectionClosed
 
@@ -63,11 +66,25 @@ class MessageBus(apirpc.ApiServer):
             host - host to listen for connections at, generally ''
             port - port to listen to connections at.  If 0, will be an open
                    port assigned by operating system.
+            poller - name of the poller backend to use (see
+                     rmake.messagebus.poller).  Defaults to the best one
+                     available.
+            traceSize - number of recent messages to keep a trace of,
+                     see MessageBusLogger.setTraceSize.
+            queueLimits - dict of session class -> QueueLimit for sessions
+                     whose outgoing queue must be bounded.  Defaults to
+                     DEFAULT_QUEUE_LIMITS.
     """
-    def __init__(self, host, port, logPath, messagePath=None):
+    def __init__(self, host, port, logPath, messagePath=None, poller=None,
+                 traceSize=0, queueLimits=None):
         l = logger.MessageBusLogger('messagebus', logPath)
+        l.setTraceSize(traceSize)
         apirpc.ApiServer.__init__(self, l)
         self._map = {}
+        self._poller = poller_.getPoller(self._map, poller)
+        if queueLimits is None:
+            queueLimits = DEFAULT_QUEUE_LIMITS
+        self._queueLimits = queueLimits
         self._sessionCount = {}
         self._messageCount = 0
         self._pendingSessions = []
@@ -89,11 +106,29 @@ class MessageBus(apirpc.ApiServer):
         for session in self._sessions.itervalues():
             if session is not None:
                 session.close()
+        self._poller.close()
         apirpc.ApiServer._close(self)
 
     def listSessions(self):
         return [ x for x in self._sessions.values() if x is not None ]
 
+    def getQueueStats(self):
+        """
+        Returns a dictionary of sessionId -> queue statistics for every
+        connected session, and the totals for the whole bus.
+        """
+        sessions = {}
+        totalMessages = totalBytes = 0
+        for session in self.listSessions():
+            stats = session.getQueueStats()
+            sessions[session.getSessionId()] = stats
+            totalMessages += stats['messages']
+            totalBytes += stats['bytes']
+        maxRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        totals = dict(messages=totalMessages, bytes=totalBytes,
+                      maxRss=maxRss * 1024)
+        return sessions, totals
+
     def _callLocalMethod(self, m, fromSession):
         m.thawPayloadStream()
         methodName = m.getMethodName()
@@ -125,6 +160,8 @@ class MessageBus(apirpc.ApiServer):
             session.setSessionClass(m.getSessionClass())
         else:
             session.setSessionClass('Anonymous')
+        session.setQueueLimit(
+                self._queueLimits.get(session.getSessionClass()))
         if not status:
             status = 'CONNECTED'
             sessionId = '%s-%s:%s' % (session.getSessionClass(),
@@ -138,11 +175,13 @@ class MessageBus(apirpc.ApiServer):
 
         for destination in m.getSubscriptions():
             self._subscribers.addSubscriber(destination, session)
+        payloadFormat = codec.negotiate(m.getPayloadFormats())
         m = messages.NodeStatus()
         m.set(session.sessionId, status)
         self.sendMessage('/internal/nodes', m)
         m = messages.ConnectedResponse()
-        m.set(session.sessionId)
+        m.set(session.sessionId, payloadFormat)
+        session.setPayloadFormat(payloadFormat)
         session.sendMessage(m)
 
     def closeSession(self, session):
@@ -163,10 +202,10 @@ class MessageBus(apirpc.ApiServer):
                       if x and x.writable()])
 
     def handleRequestIfReady(self, sleepTime=None):
-        asyncore.poll2(timeout=sleepTime, map=self._map)
+        self._poller.poll(sleepTime)
 
     def serve_once(self):
-        asyncore.poll2(map=self._map)
+        self._poller.poll(0.0)
 
     def sendMessage(self, destination, m):
         messageId = '%s:%s' % ('messagebus', self._messageCount)
@@ -215,7 +254,7 @@ class MessageBus(apirpc.ApiServer):
                         self.sendError(fromSession, m,
                                        'Unknown session %s' % m.getTargetId())
                     else:
-                        self._logger.info('Sent %r to %s' % (m, session))
+                        self._logger.logDelivery(m, session)
                         session.sendMessage(m)
             elif isinstance(m, messages.Message):
                 # normal messages, sent around to all subscribers
@@ -223,7 +262,7 @@ class MessageBus(apirpc.ApiServer):
                 for session in self._subscribers.iterSubscribers(m):
                     if session.sessionId != m.getSessionId():
                         sent = True
-                        self._logger.info('Sent %r to %s' % (m, session))
+                        self._logger.logDelivery(m, session)
                         session.sendMessage(m)
                 if not sent:
                     self._logger.info('Message %s %s dropped.',
@@ -254,11 +293,25 @@ class SessionManager(asyncore.dispatcher):
         self.sessionId = None
         self.sessionClass = None
         self._map = map
+        self.queueLimit = None
+        self.droppedMessages = 0
+        self.coalescedMessages = 0
 
 
     def setSessionClass(self, sessionClass):
         self.sessionClass = sessionClass
 
+    def setQueueLimit(self, queueLimit):
+        self.queueLimit = queueLimit
+
+    def getQueueStats(self):
+        processor = self.messageProcessor
+        return dict(sessionClass=self.sessionClass,
+                    messages=len(processor.getQueuedMessages()),
+                    bytes=processor.getQueuedBytes(),
+                    dropped=self.droppedMessages,
+                    coalesced=self.coalescedMessages)
+
     def getSessionClass(self):
         return self.sessionClass
 
@@ -280,6 +333,9 @@ class SessionManager(asyncore.dispatcher):
     def isRegistered(self):
         return self.sessionId
 
+    def setPayloadFormat(self, payloadFormat):
+        self.messageProcessor.setPayloadFormat(payloadFormat)
+
     def close(self):
         self.messageBus.closeSession(self)
         # Copied from python2.6's asyncore
@@ -334,6 +390,17 @@ class SessionManager(asyncore.dispatcher):
             Queue a message to be sent to this session (non-blocking)
         """
         self.messageProcessor.sendMessage(m)
+        queueLimit = self.queueLimit
+        if queueLimit is not None and queueLimit.isExceeded(self):
+            if not queueLimit.enforce(self) and self.connected:
+                self.logger.error('Disconnecting %s: %d messages (%d bytes) '
+                        'waiting to be sent' % (self.sessionId,
+                            len(self.messageProcessor.getQueuedMessages()),
+                            self.messageProcessor.getQueuedBytes()))
+                # closing announces the disconnect, which may be queued
+                # for this session too.
+                self.queueLimit = None
+                self.close()
 
     def getQueuedMessages(self):
         return self.messageProcessor.getQueuedMessages()
@@ -362,25 +429,165 @@ class SessionManager(asyncore.dispatcher):
             self.handle_close()
 
 
+class QueueLimit(object):
+    """
+        Bounds the messages waiting to be written to a session, and says
+        what to do once a session falls that far behind:
+
+        drop-oldest - discard the oldest messages until back under the
+                      limits
+        coalesce - discard messages superseded by a newer one of the same
+                   kind from the same sender, then drop the oldest if that
+                   was not enough
+        disconnect - close the session
+
+        Messages that are part of a method call are never discarded; if
+        they alone exceed the limits, the session is disconnected.
+    """
+    DROP_OLDEST = 'drop-oldest'
+    COALESCE = 'coalesce'
+    DISCONNECT = 'disconnect'
+    policies = (DROP_OLDEST, COALESCE, DISCONNECT)
+
+    undroppable = frozenset(['CONNECTED', 'METHOD', 'RESPONSE', 'ERROR'])
+    # Message types that carry a complete snapshot of the sender's state.
+    coalescable = frozenset(['NODE_INFO'])
+    # Once a limit is hit, trim the queue to this fraction of it so that
+    # the work isn't repeated for every following message.
+    lowWater = 0.9
+
+    def __init__(self, policy, maxMessages=0, maxBytes=0):
+        if policy not in self.policies:
+            raise ValueError('Unknown queue policy %r' % (policy,))
+        self.policy = policy
+        self.maxMessages = maxMessages
+        self.maxBytes = maxBytes
+
+    def __repr__(self):
+        return 'QueueLimit(%r, %r, %r)' % (self.policy, self.maxMessages,
+                                           self.maxBytes)
+
+    def isExceeded(self, session):
+        return session.messageProcessor.isQueueOver(self.maxMessages,
+                                                    self.maxBytes)
+
+    def _canDrop(self, headers):
+        return headers.messageType not in self.undroppable
+
+    def _getKey(self, headers):
+        if headers.messageType not in self.coalescable:
+            return None
+        return (headers.messageType, getattr(headers, 'sessionId', None),
+                getattr(headers, 'destination', None),
+                getattr(headers, 'targetId', None))
+
+    def _getLowWater(self, limit):
+        if not limit:
+            return 0
+        return max(int(limit * self.lowWater), 1)
+
+    def enforce(self, session):
+        """
+        Apply the policy to C{session}.  Returns False if the session needs
+        to be disconnected.
+        """
+        if self.policy == self.DISCONNECT:
+            return False
+        processor = session.messageProcessor
+        maxMessages = self._getLowWater(self.maxMessages)
+        maxBytes = self._getLowWater(self.maxBytes)
+        if self.policy == self.COALESCE:
+            session.coalescedMessages += processor.coalesce(self._getKey)
+        if processor.isQueueOver(maxMessages, maxBytes):
+            session.droppedMessages += processor.dropOldest(maxMessages,
+                                                    maxBytes, self._canDrop)
+        return not self.isExceeded(session)
+
+
+def parseQueueLimit(value):
+    """
+    Parse a queue limit given as CLASS=POLICY[,MESSAGES[,BYTES]]
+    """
+    sessionClass, limit = value.split('=', 1)
+    limit = limit.split(',')
+    if len(limit) > 3:
+        raise ValueError('Too many fields in queue limit %r' % value)
+    numbers = [int(x) for x in limit[1:]]
+    return sessionClass, QueueLimit(limit[0], *numbers)
+
+
+# Command line clients watching a job only lose event updates if they fall
+# far behind.  Other session classes are never limited unless configured.
+DEFAULT_QUEUE_LIMITS = {
+        'CLI': QueueLimit(QueueLimit.DROP_OLDEST, 10000, 64 * 1024 * 1024),
+        }
+
+
+class _Subscription(object):
+    __slots__ = ('session', 'channel', 'indexKey', 'indexValue', 'pattern',
+                 'order')
+
+    def __init__(self, session, channel, pattern, order):
+        self.session = session
+        self.channel = channel
+        self.order = order
+        # One attribute of the pattern is matched through the index; only
+        # the rest need to be compared against each message.
+        if pattern:
+            self.indexKey = min(pattern)
+            self.indexValue = pattern[self.indexKey]
+            self.pattern = [x for x in pattern.items()
+                            if x[0] != self.indexKey]
+        else:
+            self.indexKey = self.indexValue = None
+            self.pattern = []
+
+
 class SubscriptionManager(object):
     """
         Sessions "subscribe" to different channels, on which they get
         their messages.  This manages those subscribers.
+
+        Subscriptions are indexed by channel, then by one of the attributes
+        they filter on and its value, so finding the subscribers for a
+        message is a few dictionary lookups no matter how many sessions are
+        subscribed to other values on the same channel.
     """
     def __init__(self):
-        self._subscribers = {}
+        # channel -> indexKey -> indexValue -> {order: subscription}
+        # Subscriptions without a pattern are under indexKey None.
+        self._channels = {}
+        # session -> [subscription]
+        self._sessions = {}
+        self._count = 0
 
     def iterSubscribers(self, m):
-        lst = self._subscribers.get(m.headers.destination, [])
-        for subscriber, pattern in lst:
-            if m.getTargetId() and m.getTargetId() != subscriber.sessionId:
+        index = self._channels.get(m.headers.destination)
+        if not index:
+            return
+        headers = m.headers
+        matches = []
+        for key, byValue in index.iteritems():
+            if key is None:
+                bucket = byValue.get(None)
+            else:
+                bucket = byValue.get(getattr(headers, key, None))
+            if bucket:
+                matches.extend(bucket.itervalues())
+        if len(matches) > 1:
+            # deliver in the order the subscriptions were made
+            matches.sort(key=lambda x: x.order)
+        targetId = m.getTargetId()
+        for subscription in matches:
+            if targetId and targetId != subscription.session.sessionId:
                 continue
             found = True
-            for key, value in pattern.iteritems():
-                if getattr(m.headers, key, None) != value:
+            for key, value in subscription.pattern:
+                if getattr(headers, key, None) != value:
                     found = False
+                    break
             if found:
-                yield subscriber
+                yield subscription.session
 
     def addSubscriber(self, channel, session):
         """
@@ -395,15 +602,29 @@ class SubscriptionManager(object):
             for attr in [attr] + rest:
                 key, value = urllib.splitvalue(attr)
                 pattern[key] = value
-        self._subscribers.setdefault(channel, []).append((session, pattern))
+        self._count += 1
+        subscription = _Subscription(session, channel, pattern, self._count)
+        bucket = self._channels.setdefault(channel, {}).setdefault(
+                subscription.indexKey, {}).setdefault(
+                        subscription.indexValue, {})
+        bucket[subscription.order] = subscription
+        self._sessions.setdefault(session, []).append(subscription)
 
     def deleteSubscriber(self, session):
         """
         Delete all subscriptions by a particular C{session}.
         """
-        for channel, subscribers in self._subscribers.items():
-            self._subscribers[channel] = [x for x in subscribers
-                    if x[0] is not session]
+        for subscription in self._sessions.pop(session, []):
+            index = self._channels[subscription.channel]
+            byValue = index[subscription.indexKey]
+            bucket = byValue[subscription.indexValue]
+            del bucket[subscription.order]
+            if not bucket:
+                del byValue[subscription.indexValue]
+                if not byValue:
+                    del index[subscription.indexKey]
+                    if not index:
+                        del self._channels[subscription.channel]
 
 
 class MessageBusListener(asyncore.dispatcher):
@@ -490,6 +711,36 @@ class MessageBusDispatcher(apirpc.ApiServer):
         return dict((x.getSessionId(), len(x.getQueuedMessages()))
                     for x in self.messageBus.listSessions())
 
+    @api(version=1)
+    @api_parameters(1)
+    @api_return(1, None)
+    def getQueueStats(self, callData):
+        sessions, totals = self.messageBus.getQueueStats()
+        # byte counts can overflow an XMLRPC int
+        for stats in sessions.values() + [totals]:
+            for key, value in stats.items():
+                if isinstance(value, (int, long)):
+                    stats[key] = str(value)
+        return sessions, totals
+
+    @api(version=1)
+    @api_parameters(1, None, None)
+    @api_return(1, None)
+    def setMessageSampleRate(self, callData, messageType, rate):
+        self.messageBus.getLogger().setSampleRate(messageType, rate)
+
+    @api(version=1)
+    @api_parameters(1, None)
+    @api_return(1, None)
+    def setMessageTraceSize(self, callData, size):
+        self.messageBus.getLogger().setTraceSize(size)
+
+    @api(version=1)
+    @api_parameters(1)
+    @api_return(1, None)
+    def getMessageTrace(self, callData):
+        return [list(x) for x in self.messageBus.getLogger().getTrace()]
+
 class MessageBusRPCClient(object):
     def __init__(self, client):
         self.proxy = rpclib.SessionProxy(MessageBusDispatcher, client, '')
@@ -503,6 +754,23 @@ class MessageBusRPCClient(object):
     def listQueueLengths(self):
         return self.proxy.listQueueLengths()
 
+    def getQueueStats(self):
+        sessions, totals = self.proxy.getQueueStats()
+        for stats in sessions.values() + [totals]:
+            for key, value in stats.items():
+                if key != 'sessionClass':
+                    stats[key] = int(value)
+        return sessions, totals
+
+    def setMessageSampleRate(self, messageType, rate):
+        return self.proxy.setMessageSampleRate(messageType, rate)
+
+    def setMessageTraceSize(self, size):
+        return self.proxy.setMessageTraceSize(size)
+
+    def getMessageTrace(self):
+        return self.proxy.getMessageTrace()
+
 
 def main(args):
     parser = optparse.OptionParser()
@@ -512,14 +780,50 @@ def main(args):
     parser.add_option('-P', '--pid-file')
     parser.add_option('-l', '--log-file')
     parser.add_option('-m', '--log-messages')
+    parser.add_option('--log-messages-level', default='info',
+            choices=['info', 'debug'],
+            help="'info' logs one line per message, 'debug' logs full "
+                 "messages and deliveries")
+    parser.add_option('--sample-rate', action='append', default=[],
+            metavar='TYPE=RATE',
+            help="Log only RATE (0 to 1) of the messages of type TYPE")
+    parser.add_option('--trace-size', type='int', default=0,
+            help="Keep a trace of the last N messages in memory")
+    parser.add_option('--queue-limit', action='append', default=[],
+            metavar='CLASS=POLICY[,MESSAGES[,BYTES]]',
+            help="Limit the messages queued for sessions of class CLASS. "
+                 "POLICY is one of %s" % ', '.join(QueueLimit.policies))
+    parser.add_option('--poller', choices=poller_.getPollerNames(),
+            help="Event loop backend: %s (default %s)" % (
+                ', '.join(poller_.getPollerNames()),
+                poller_.getPollerNames()[0]))
     options, args = parser.parse_args(args)
     if args:
         parser.error("No arguments expected")
     if not options.log_file:
         parser.error("You must specify a log file")
+    sampleRates = []
+    for sampleRate in options.sample_rate:
+        messageType, rate = sampleRate.split('=', 1)
+        try:
+            sampleRates.append((messageType, float(rate)))
+        except ValueError:
+            parser.error("Invalid sample rate %r" % sampleRate)
+    queueLimits = dict(DEFAULT_QUEUE_LIMITS)
+    for queueLimit in options.queue_limit:
+        try:
+            sessionClass, queueLimit = parseQueueLimit(queueLimit)
+        except ValueError, err:
+            parser.error("Invalid queue limit %r: %s" % (queueLimit, err))
+        queueLimits[sessionClass] = queueLimit
 
     bus = MessageBus(options.bind, int(options.port),
-            options.log_file, options.log_messages)
+            options.log_file, options.log_messages, poller=options.poller,
+            traceSize=options.trace_size, queueLimits=queueLimits)
+    if options.log_messages and options.log_messages_level == 'debug':
+        bus.getLogger().messageLogger.setLevel(logging.DEBUG)
+    for messageType, rate in sampleRates:
+        bus.getLogger().setSampleRate(messageType, rate)
 
     pidFile = None
     if options.pid_file:
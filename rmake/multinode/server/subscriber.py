@@ -55,6 +55,8 @@ class rMakeServerNodeClient(_ServerNodeClient):
     subscriptions = [
             '/event',
             '/stopJob',
+            '/followBuildLog',
+            '/internal/nodes',
             ]
 
     def messageReceived(self, m):
@@ -63,6 +65,20 @@ class rMakeServerNodeClient(_ServerNodeClient):
             self.server.eventsReceived(*m.getEventList())
         if isinstance(m, messages.StopJobRequest):
             self.server.stopJob(m.getJobId())
+        if isinstance(m, messages.BuildLogRequest):
+            if m.isFollow():
+                self.server.followBuildLog(m.getSessionId(), m.getJobId(),
+                        m.getTroveTuple(), m.getMark())
+            else:
+                self.server.unfollowBuildLog(m.getSessionId(), m.getJobId(),
+                        m.getTroveTuple())
+        if isinstance(m, messages.NodeStatus) and m.isDisconnected():
+            self.server.unfollowBuildLog(m.getStatusId())
+
+    def publishBuildLog(self, sessionId, jobId, troveTuple, offset, data,
+            isFinal):
+        m = messages.BuildLogData(jobId, troveTuple, offset, data, isFinal)
+        self.bus.sendMessage('/buildlog', m, sessionId)
 
 
 class _RmakeBusPublisher(_RmakePublisherProxy):
@@ -62,22 +62,30 @@ class rMakeWorkerNodeServer(worker.Worker):
         try:
             serverLogger.info('Starting rMake Node (pid %s)' % os.getpid())
             worker.Worker.__init__(self, cfg, serverLogger,
-                                   slots=cfg.slots)
+                                   slots=cfg.slots,
+                                   lightSlots=cfg.lightSlots,
+                                   commitSlots=cfg.commitSlots)
             #calculates current state of the rmake chroot directory.
             chroots = self.listChroots()
-            self.client = WorkerNodeClient(cfg, self,
-                                           procutil.MachineInformation(),
+            # Collected once; the heartbeat only refreshes and sends the
+            # parts that change.
+            self.nodeInfo = procutil.MachineInformation(
+                                        chrootPath=cfg.getChrootDir())
+            self.client = WorkerNodeClient(cfg, self, self.nodeInfo,
                                            chroots=chroots,
                                            messageBusInfo=messageBusInfo)
             self.lastStatusSent = 0
             self.statusPeriod = 60
+            # the dispatcher keeps the last chroot summary it got, so it
+            # is only sent again when it changes or after reconnecting
+            self.chrootSummarySent = False
         except Exception, err:
             self.error('Error initializing Node Server:\n  %s\n%s', err,
                                    traceback.format_exc())
             raise
 
     def busConnected(self, sessionId):
-        pass
+        self.chrootSummarySent = False
 
     def receivedResolveCommand(self, info):
         eventHandler = DirectRmakeBusPublisher(info.getJobId(), self.client)
@@ -117,6 +125,10 @@ class rMakeWorkerNodeServer(worker.Worker):
         self.stopCommand(commandId=info.getCommandId(),
                          targetCommandId=info.getTargetCommandId())
 
+    def receivedStopJob(self, info):
+        # the server doesn't know about our commits, so drop them here.
+        self.stopCommits(info.getJobId())
+
     def _signalHandler(self, signal, frame):
         server.Server._signalHandler(self, signal, frame)
         os.kill(os.getpid(), signal)
@@ -131,10 +143,20 @@ class rMakeWorkerNodeServer(worker.Worker):
         if (time.time() - self.lastStatusSent) > self.statusPeriod:
             if self.client:
                 self.lastStatusSent = time.time()
-                info = procutil.MachineInformation()
-                commandIds = [ x.getCommandId() for x in self.commands]
-                commandIds += [ x[2][0] for x in self._queuedCommands ]
-                self.client.updateStatus(info, commandIds)
+                # Updating in place also keeps the node description sent
+                # when re-registering current.
+                self.nodeInfo.update()
+                # commits are queued by this node, not the dispatcher
+                commandIds = [ x.getCommandId() for x in self.commands
+                               if not type(x).usesCommitSlot ]
+                commandIds += [ x[2][0] for x in self._queuedCommands
+                                if not x[0].usesCommitSlot ]
+                chrootSummary = self.getChrootSummary(
+                                changedOnly=self.chrootSummarySent)
+                self.chrootSummarySent = True
+                self.client.updateStatus(self.nodeInfo.getStatus(),
+                                         commandIds, self.getCacheStats(),
+                                         chrootSummary)
         worker.Worker._serveLoopHook(self)
 
     def handleRequestIfReady(self, sleep=0.1):
@@ -183,6 +205,7 @@ class WorkerNodeClient(nodeclient.NodeClient):
     sessionClass = 'WORKER' # type information used by messagebus to classify
                             # connections.
     name = 'rmake-node'     # name used by logging
+    subscriptions = ['/stopJob']
 
     def __init__(self, cfg, server, nodeInfo, chroots, messageBusInfo=None):
         # Create a nodeType describing this client that will be passed
@@ -191,6 +214,7 @@ class WorkerNodeClient(nodeclient.NodeClient):
         node = nodetypes.WorkerNode(name=cfg.name,
                                     host=cfg.hostName,
                                     slots=cfg.slots,
+                                    lightSlots=cfg.lightSlots,
                                     jobTypes=cfg.jobTypes,
                                     buildFlavors=cfg.buildFlavors,
                                     loadThreshold=cfg.loadThreshold,
@@ -221,14 +245,20 @@ class WorkerNodeClient(nodeclient.NodeClient):
         # nodes to keep attempting to reconnect forever.
         self.getBusClient().setConnectionTimeout(-1)
 
-    def updateStatus(self, info, commandIds):
+    def updateStatus(self, status, commandIds, cacheStats=None,
+                     chrootSummary=None):
         """
             Send current status of node to messagebus to be picked up 
             by dispatcher
-            @param info: current status of this node
-            @type info: procutil.MachineInformation
+            @param status: current status of this node
+            @type status: dict from procutil.MachineInformation.getStatus()
+            @param cacheStats: changeset cache statistics, if any
+            @type cacheStats: repocache.CacheStats
+            @param chrootSummary: troves in cached and old chroots, or
+            None if they haven't changed since the last update
+            @type chrootSummary: dict from ChrootManager.getChrootSummary()
         """
-        m = messages.NodeInfo(info, commandIds)
+        m = messages.NodeInfo(status, commandIds, cacheStats, chrootSummary)
         self.bus.sendMessage('/nodestatus', m)
 
     def messageReceived(self, m):
@@ -249,6 +279,10 @@ class WorkerNodeClient(nodeclient.NodeClient):
         elif isinstance(m, messages.StopCommand):
             self.server.info('Received stop command')
             self.server.receivedStopCommand(m)
+        elif isinstance(m, messages.StopJobRequest):
+            self.server.info('Received stop request for job %s'
+                             % m.getJobId())
+            self.server.receivedStopJob(m)
         elif isinstance(m, messages.ResolveCommand):
             self.server.info('Received resolve command')
             self.server.receivedResolveCommand(m)
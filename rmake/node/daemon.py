@@ -87,6 +87,8 @@ class CleanCacheCommand(daemon.DaemonCommand):
             elif cfg.verbose:
                 print 'Removing cached chroot:', fingerprint.encode('hex')
             cache.remove(fingerprint)
+        if not argSet.get('test'):
+            cache.collectGarbage()
 
 
 class HelpCommand(command.HelpCommand):
@@ -170,6 +170,31 @@ class rMakeClient(object):
                                                               troveTuple, mark)
         return isBuilding, wrappedData.data, mark
 
+    def searchTroveBuildLogs(self, jobId, pattern, troveTupleList=None,
+                             context=0, maxMatches=0):
+        """
+            Search build logs on the server for lines matching a regular
+            expression.
+
+            @param jobId: jobId or UUID for job.
+            @param pattern: regular expression to search for.
+            @param troveTupleList: (name, version, flavor, context) tuples
+            for the troves whose logs to search, or None for all troves in
+            the job.
+            @param context: number of lines to return around each match.
+            @param maxMatches: maximum matches per log, or 0 for all.
+            @return: list of (troveTuple, regions) for each log with matches.
+            Each region is a (lineNumber, offset, text, matchingLineNumbers)
+            tuple.
+            @rtype: list
+        """
+        results = self.proxy.searchTroveBuildLogs(jobId, troveTupleList or [],
+                                                  pattern, context, maxMatches)
+        return [ (thaw('troveContextTuple', troveTuple),
+                  [ (lineNumber, int(offset), wrappedText.data, matches)
+                    for (lineNumber, offset, wrappedText, matches) in regions ])
+                 for (troveTuple, regions) in results ]
+
     def getJob(self, jobId, withTroves=True, withConfigs=False):
         """
             Return job instance.
@@ -343,16 +368,37 @@ class EventReceiver(nodeclient.NodeClient):
         self.bus.logger.setQuietMode()
         self.bus.connect()
         self.bus.subscribe('/event?jobId=%s' % jobId)
+        streamLogs = (getattr(listener, 'showBuildLogs', False)
+                      and hasattr(listener, 'setLogStream'))
+        if streamLogs:
+            self.bus.subscribe('/buildlog')
         self.listener = listener
         listener._primeOutput(jobId)
         while not self.bus.isRegistered():
             self.serve_once()
             self.bus.flush()
+        if streamLogs:
+            listener.setLogStream(self)
+
+    def followBuildLog(self, jobId, troveTuple, mark):
+        """
+        Ask the server to push a trove's build log from byte C{mark}; it
+        arrives through the listener's _buildLogReceived method.
+        """
+        self.bus.sendMessage('/followBuildLog',
+                messages.BuildLogRequest(jobId, troveTuple, mark))
+
+    def unfollowBuildLog(self, jobId, troveTuple):
+        self.bus.sendMessage('/followBuildLog',
+                messages.BuildLogRequest(jobId, troveTuple, follow=False))
 
     def messageReceived(self, m):
         nodeclient.NodeClient.messageReceived(self, m)
         if isinstance(m, messages.EventList):
             self.listener._receiveEvents(*m.getEventList())
+        elif isinstance(m, messages.BuildLogData):
+            self.listener._buildLogReceived(m.getJobId(), m.getTroveTuple(),
+                    m.getOffset(), m.getData(), m.isFinal())
 
     def _serveLoopHook(self):
         self.listener._serveLoopHook()
@@ -23,6 +23,7 @@ import os
 import shutil
 import signal
 import sys
+import time
 import traceback
 
 from conary.lib import options, util
@@ -30,6 +31,7 @@ from conary import command
 
 from rmake import compat
 from rmake import constants
+from rmake import errors
 from rmake import plugins
 from rmake.build import builder
 from rmake.build import buildjob
@@ -100,6 +102,8 @@ class StatusCommand(AdminCommand):
             status dispatcher - displays current state of dispatcher
             status node <nodeId> - displays current state of node
             status messagebus - displays current status of messagebus
+            status trace - displays the messages most recently seen by
+                           the messagebus
 
         These commands are used mostly for debugging
     """
@@ -111,10 +115,22 @@ class StatusCommand(AdminCommand):
         command, subCommand, extra = self.requireParameters(args, 'server',
                                                             allowExtra=True)
         if subCommand == 'messagebus':
-            print "Connected clients: Messages Queued"
-            queueLens = adminClient.listMessageBusQueueLengths()
-            for sessionId in sorted(adminClient.listMessageBusClients()):
-                print '%s: %s' % (sessionId, queueLens[sessionId])
+            print "Connected clients: Messages Queued (bytes, dropped)"
+            queueStats, totals = adminClient.getMessageBusQueueStats()
+            for sessionId in sorted(queueStats):
+                stats = queueStats[sessionId]
+                print '%s: %s (%s bytes, %s dropped, %s coalesced)' % (
+                        sessionId, stats['messages'], stats['bytes'],
+                        stats['dropped'], stats['coalesced'])
+            print 'Total: %s messages (%s bytes), max RSS %s bytes' % (
+                    totals['messages'], totals['bytes'], totals['maxRss'])
+        if subCommand == 'trace':
+            for (timeStamp, messageType, messageId, sessionId, destination,
+                    payloadSize) in adminClient.getMessageBusTrace():
+                print '%s %s %s from %s to %s (%s bytes)' % (
+                        time.strftime('%X', time.localtime(timeStamp)),
+                        messageType, messageId, sessionId, destination or '-',
+                        payloadSize)
         if subCommand == 'dispatcher':
             print "Nodes:"
             print '\n'.join(adminClient.listNodes())
@@ -123,6 +139,15 @@ class StatusCommand(AdminCommand):
             print "Assigned commands:"
             for command, nodeId in adminClient.listAssignedCommands():
                 print "%s: %s" % (command, nodeId)
+            stats = adminClient.getDispatcherLocalityStats()
+            if stats['troves']:
+                print ("Chroot locality: %d of %d build requirements "
+                       "already on the chosen node (%.1f%%, %.1f%% by load "
+                       "alone) over %d builds" % (stats['warmTroves'],
+                        stats['troves'],
+                        100.0 * stats['warmTroves'] / stats['troves'],
+                        100.0 * stats['baselineWarmTroves'] / stats['troves'],
+                        stats['commands']))
         if subCommand == 'node':
             subCommand, nodeId = self.requireParameters(args[1:], 'nodeId')
             print "Node %s" % nodeId
@@ -233,6 +258,12 @@ class rMakeDaemon(daemon.Daemon):
 
 class RmakeServerProc(server_mod.Server):
 
+    # Seconds that job and trove updates may be held back so that several of
+    # them can be written in one transaction.
+    dbFlushInterval = 0.5
+    # Number of recent messages the message bus keeps for 'status trace'.
+    messageBusTraceSize = 1000
+
     def __init__(self, cfg, pluginMgr, logger):
         self.cfg = cfg
         self.buildPids = {}
@@ -241,6 +272,7 @@ class RmakeServerProc(server_mod.Server):
         self.db = None
         self.plugins = pluginMgr
         self.nodeClient = None
+        self.logServer = None
         self.eventHandler = EventHandler(self)
         self._subscribers = []
         self._jobsPending = False
@@ -289,6 +321,9 @@ class RmakeServerProc(server_mod.Server):
         server_mod.Server._close(self)
 
     def _fork(self, name, close=False, criticalLogPath=None):
+        if self.db:
+            # Don't let the child inherit (and repeat) pending writes
+            self.db.flushWriteBehind(force=True)
         pid = server_mod.Server._fork(self, name)
         if pid:
             if criticalLogPath:
@@ -324,6 +359,8 @@ and check the log file at %s for detailed diagnostics.
                 # A job just finished so check if there is another in the queue
                 # waiting for free slots.
                 self.startJob()
+        if self.logServer:
+            self.logServer.pidDied(pid, status)
         self.plugins.callServerHook('server_pidDied', self, pid, status)
         self._pids.pop(pid, None)
 
@@ -336,7 +373,7 @@ and check the log file at %s for detailed diagnostics.
         messages = self.cfg.logDir + '/messages/messagebus.log'
         util.mkdirChain(os.path.dirname(messages))
         bus = messagebus.MessageBus('', self.cfg.messageBusPort, logPath,
-                messages)
+                messages, traceSize=self.messageBusTraceSize)
         pid = self._fork('messagebus', close=True, criticalLogPath=logPath)
         if pid:
             bus._close()
@@ -392,7 +429,8 @@ and check the log file at %s for detailed diagnostics.
         self.db = database.Database(self.cfg.getDbPath(),
                 self.cfg.getDbContentsPath(),
                 memCache=self.cfg.memCache)
-        self._subscribers.append(build_subscriber._JobDbLogger(self.db))
+        self._subscribers.append(build_subscriber._JobDbLogger(self.db,
+            flushInterval=self.dbFlushInterval))
 
     def _connectBus(self):
         self.nodeClient = mn_subscriber.rMakeServerNodeClient(self.cfg, self)
@@ -443,12 +481,40 @@ and check the log file at %s for detailed diagnostics.
             os._exit(70)
 
     def _startLogServer(self):
-        log_server.LogServer(self.cfg, self.db,
+        self.logServer = log_server.LogServer(self.cfg, self.db,
                 map=self.nodeClient.getMap(),
                 fork=lambda name: self._fork(name, close=True),
                 logger=self._logger,
+                compressors=self.cfg.logCompressors,
+                publish=self._publishBuildLog,
                 )
 
+    def followBuildLog(self, sessionId, jobId, troveTuple, mark):
+        """Push a trove's build log to a message bus session"""
+        if not self.logServer:
+            return
+        try:
+            trove = self.db.getTrove(jobId, *troveTuple)
+        except errors.TroveNotFound:
+            return
+        if not trove.logPath:
+            return
+        self.logServer.follow(sessionId, (jobId, troveTuple), trove.logPath,
+                mark, trove.isFinished())
+
+    def unfollowBuildLog(self, sessionId, jobId=None, troveTuple=None):
+        if not self.logServer:
+            return
+        key = None
+        if jobId is not None:
+            key = (jobId, troveTuple)
+        self.logServer.unfollow(sessionId, key)
+
+    def _publishBuildLog(self, sessionId, (jobId, troveTuple), offset, data,
+            isFinal):
+        self.nodeClient.publishBuildLog(sessionId, jobId, troveTuple, offset,
+                data, isFinal)
+
     def _postStartupTasks(self):
         """Normalize the state of things on startup"""
         self.db.deactivateAllNodes()
@@ -488,6 +554,9 @@ and check the log file at %s for detailed diagnostics.
             # Otherwise when a new job is queued an event will arrive from the
             # nodeclient, so sleeping longer is okay.
             timeout = 10.0
+        flushTimeout = self.db.flushWriteBehind()
+        if flushTimeout is not None:
+            timeout = min(timeout, flushTimeout)
         self.nodeClient.poll(timeout=timeout, maxIterations=1)
 
     # Job processing
@@ -14,8 +14,21 @@
 # limitations under the License.
 #
 
+"""
+Receives build logs from workers.
+
+Every log connection is handled by the same event loop: data is written to
+the plaintext log as soon as it arrives, so the log can be tailed while the
+build runs.  Once a log is closed it is compressed by a bounded number of
+child processes, after which the plaintext log is removed.
+
+Clients can also follow a log, in which case everything written to it is
+pushed to them as it arrives.
+"""
+
 import asyncore
-import logging
+import collections
+import errno
 import os
 import socket
 from rmake.lib import logger as logger_
@@ -23,7 +36,12 @@ from rmake.lib import logger as logger_
 
 class LogServer(asyncore.dispatcher):
 
-    def __init__(self, cfg, db, map=None, fork=None, logger=None):
+    readSize = 65536
+    # Largest piece of an existing log pushed to a new follower at once
+    streamChunkSize = 65536
+
+    def __init__(self, cfg, db, map=None, fork=None, logger=None,
+            compressors=2, publish=None):
         self.logStore = db.logStore
         if not fork:
             fork = lambda name: os.fork()
@@ -31,6 +49,22 @@ class LogServer(asyncore.dispatcher):
         if logger is None:
             logger = logger_.Logger()
         self._logger = logger
+        # Number of logs that may be compressed at once.  With none, logs
+        # are compressed in this process as soon as they are closed.
+        self.compressors = compressors
+        # logHash -> number of open connections writing to it
+        self._writers = {}
+        self._compressQueue = collections.deque()
+        # pid -> (logHash, size of the plaintext log when compression began)
+        self._compressing = {}
+        # All connections share one read buffer, since each read is written
+        # out before the next one happens.
+        self._readBuffer = bytearray(self.readSize)
+        # Called as publish(followerId, key, offset, data, isFinal) to push
+        # part of a log to a follower.
+        self.publish = publish
+        # logHash -> set of (followerId, key) following that log
+        self._followers = {}
         asyncore.dispatcher.__init__(self, map=map)
         self.create_socket(socket.AF_INET6, socket.SOCK_STREAM)
         self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
@@ -43,6 +77,138 @@ class LogServer(asyncore.dispatcher):
         sock, addr = self.accept()
         LogClient(sock, self._map, self)
 
+    def logOpened(self, logHash):
+        self._writers[logHash] = self._writers.get(logHash, 0) + 1
+
+    def logWritten(self, logHash, offset, data):
+        followers = self._followers.get(logHash)
+        if not followers:
+            return
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        for followerId, key in followers:
+            self.publish(followerId, key, offset, data, False)
+
+    def logClosed(self, logHash, size):
+        count = self._writers.pop(logHash) - 1
+        if count:
+            self._writers[logHash] = count
+            return
+        for followerId, key in self._followers.pop(logHash, ()):
+            self.publish(followerId, key, size, '', True)
+        if logHash not in self._compressQueue:
+            self._compressQueue.append(logHash)
+        self._startCompressors()
+
+    def follow(self, followerId, key, logHash, mark=0, isFinished=False):
+        """
+        Push log C{logHash} to C{followerId} from byte C{mark} (or that many
+        bytes from the end if negative), and then everything written to it
+        until it is closed.  C{key} is passed on to the publisher to say
+        which log the data belongs to.  If the log is not being written and
+        C{isFinished} is set, only what has been written already is sent.
+        """
+        try:
+            f = self.logStore.openTroveLog(logHash)
+        except KeyError:
+            f = None
+        offset = max(mark, 0)
+        if f is not None:
+            if mark < 0:
+                f.seek(0, 2)
+                f.seek(max(f.tell() + mark, 0))
+            else:
+                f.seek(mark)
+            offset = f.tell()
+        isFinal = isFinished and logHash not in self._writers
+        # Always send something, even if it is empty, so the follower knows
+        # that its request was received.
+        while True:
+            data = ''
+            if f is not None:
+                data = f.read(self.streamChunkSize)
+            done = len(data) < self.streamChunkSize
+            self.publish(followerId, key, offset, data, isFinal and done)
+            offset += len(data)
+            if done:
+                break
+        if f is not None:
+            f.close()
+        if not isFinal:
+            self._followers.setdefault(logHash, set()).add((followerId, key))
+
+    def unfollow(self, followerId, key=None):
+        """
+        Stop pushing the log for C{key} to C{followerId}, or all logs if no
+        C{key} is given.
+        """
+        for logHash, followers in self._followers.items():
+            for follower in list(followers):
+                if follower[0] == followerId and key in (None, follower[1]):
+                    followers.discard(follower)
+            if not followers:
+                del self._followers[logHash]
+
+    def _startCompressors(self):
+        if not self.compressors:
+            while self._compressQueue:
+                logHash = self._compressQueue.popleft()
+                try:
+                    self.logStore.compressLog(logHash)
+                    self.logStore.removePlainLog(logHash)
+                except Exception:
+                    self._logger.exception("Failed to compress log %s:",
+                            logHash[:12])
+            return
+        active = set(x[0] for x in self._compressing.values())
+        waiting = []
+        while (self._compressQueue
+                and len(self._compressing) < self.compressors):
+            logHash = self._compressQueue.popleft()
+            if logHash in self._writers:
+                # Reopened; it will be queued again when it is closed.
+                continue
+            if logHash in active:
+                waiting.append(logHash)
+                continue
+            self._startCompressor(logHash)
+            active.add(logHash)
+        self._compressQueue.extendleft(reversed(waiting))
+
+    def _startCompressor(self, logHash):
+        size = self.logStore.getLogSize(logHash)
+        if size is None:
+            return
+        pid = self.fork("Log compressor %s" % logHash[:12])
+        if pid:
+            self._compressing[pid] = (logHash, size)
+            return
+        try:
+            try:
+                self.logStore.compressLog(logHash)
+                os._exit(0)
+            except:
+                self._logger.exception("Failed to compress log %s:",
+                        logHash[:12])
+        finally:
+            os._exit(70)
+
+    def pidDied(self, pid, status):
+        """
+        Must be called when any child process exits.  Returns True if it was
+        a log compressor.
+        """
+        if pid not in self._compressing:
+            return False
+        logHash, size = self._compressing.pop(pid)
+        # Only drop the plaintext log if nothing was appended to it after
+        # the compressor started.
+        if (not status and logHash not in self._writers
+                and self.logStore.getLogSize(logHash) == size):
+            self.logStore.removePlainLog(logHash)
+        self._startCompressors()
+        return True
+
 
 class LogClient(asyncore.dispatcher):
 
@@ -51,11 +217,16 @@ class LogClient(asyncore.dispatcher):
         self.server = server
         self._logger = server._logger
         self.buf = ''
+        self.logHash = None
+        self.writer = None
 
     def writable(self):
         return False
 
     def handle_read(self):
+        if self.writer is not None:
+            self._copy()
+            return
         data = self.recv(1024)
         self.buf += data
         if len(self.buf) > 1024:
@@ -64,7 +235,8 @@ class LogClient(asyncore.dispatcher):
             return
         if '\n' not in self.buf:
             return
-        line = self.buf.split('\n')[0]
+        line, rest = self.buf.split('\n', 1)
+        self.buf = ''
         if line.count(' ') < 2:
             self._logger.warning("Bogus logger auth from %s", self.addr)
             self.close()
@@ -78,39 +250,40 @@ class LogClient(asyncore.dispatcher):
         name = name[:64]
         self._logger.debug("Accepted logger connection from %s for %s: %s",
                 self.addr, logHash[:12], name)
-        f_out = self.server.logStore.openForWriting(logHash)
-        f_out.beforeFork()
-        pid = self.server.fork("Build logger %s" % name)
-        if pid:
-            f_out.afterFork()
-            self.close()
-            return
+        self.writer = self.server.logStore.openForWriting(logHash)
+        self.logHash = logHash
+        self.server.logOpened(logHash)
+        if rest:
+            offset = self.writer.write(rest)
+            self.server.logWritten(logHash, offset, rest)
+        self.socket.sendall('OK\n')
+
+    def _copy(self):
+        buf = self.server._readBuffer
         try:
-            try:
-                self._closeFds(f_out.filenos() + [self.socket.fileno()])
-                # No more need for asyncore, just do a blocking copy
-                self.socket.setblocking(1)
-                self.socket.sendall('OK\n')
-                while True:
-                    try:
-                        d = self.socket.recv(16384)
-                    except socket.error:
-                        break
-                    if not d:
-                        break
-                    f_out.write(d)
-                f_out.close()
-                try:
-                    self.socket.close()
-                except (socket.error, OSError):
-                    pass
-                os._exit(0)
-            except:
-                import traceback
-                traceback.print_exc()
-                self._logger.exception("Unhandled error in log recorder:")
-        finally:
-            os._exit(70)
+            count = self.socket.recv_into(buf)
+        except socket.error as err:
+            if err.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            if err.args[0] in (errno.ECONNRESET, errno.ENOTCONN,
+                    errno.ESHUTDOWN, errno.ECONNABORTED, errno.EPIPE):
+                self.handle_close()
+                return
+            raise
+        if not count:
+            self.handle_close()
+            return
+        data = memoryview(buf)[:count]
+        offset = self.writer.write(data)
+        self.server.logWritten(self.logHash, offset, data)
+
+    def close(self):
+        asyncore.dispatcher.close(self)
+        if self.writer is not None:
+            size = self.writer.size
+            self.writer.close()
+            self.writer = None
+            self.server.logClosed(self.logHash, size)
 
     def handle_close(self):
         self.close()
@@ -118,15 +291,3 @@ class LogClient(asyncore.dispatcher):
     def handle_error(self):
         self._logger.exception("Unhandled error in log recorder:")
         self.close()
-
-    def _closeFds(self, keep=()):
-        keep = set(keep)
-        for handler in logging.root.handlers:
-            if hasattr(handler, 'stream'):
-                keep.add(handler.stream.fileno())
-        for n in range(3, 256):
-            if n not in keep:
-                try:
-                    os.close(n)
-                except OSError as err:
-                    pass
@@ -20,6 +20,7 @@
 rMake Backend server
 """
 import itertools
+import re
 import xmlrpclib
 
 from rmake import errors
@@ -151,6 +152,41 @@ class rMakeServer(apirpc.XMLApiServer):
             f.seek(mark)
         return not trove.isFinished(), xmlrpclib.Binary(f.read()), f.tell()
 
+    @api(version=1)
+    @api_parameters(1, None, 'troveContextTupleList', 'str', 'int', 'int')
+    @api_return(1, None)
+    def searchTroveBuildLogs(self, callData, jobId, troveTupleList, pattern,
+                             context, maxMatches):
+        """
+        Search the build logs of some or, if troveTupleList is empty, all of
+        the troves in a job for lines matching a regular expression.  Only
+        the matching lines and context lines around them are returned.
+        """
+        jobId = self.db.convertToJobId(jobId)
+        try:
+            regex = re.compile(pattern, re.MULTILINE)
+        except re.error, err:
+            raise errors.RmakeError('Invalid pattern %r: %s' % (pattern, err))
+        if troveTupleList:
+            troves = [ self.db.getTrove(jobId, *x) for x in troveTupleList ]
+        else:
+            troves = self.db.getJob(jobId, withConfigs=False).iterTroves()
+        results = []
+        for trove in troves:
+            regions = self.db.searchTroveBuildLog(trove, regex, context,
+                                                  maxMatches)
+            if not regions:
+                continue
+            # offsets can overflow an XMLRPC int, and log text may not be
+            # valid in XML.
+            regions = [ (lineNumber, str(offset), xmlrpclib.Binary(text),
+                         matches)
+                        for (lineNumber, offset, text, matches) in regions ]
+            results.append((freeze('troveContextTuple',
+                                   trove.getNameVersionFlavor(True)),
+                            regions))
+        return results
+
     @api(version=1)
     @api_parameters(1, None)
     @api_return(1, None)
@@ -82,7 +82,26 @@ class rMakeBuilderConfiguration(daemon.DaemonConfig):
     buildDir          = (CfgPath, '/var/rmake')
     helperDir         = (CfgPath, "/usr/libexec/rmake")
     slots             = (CfgInt, 1)
+    lightSlots        = (CfgInt, 2,
+            "Number of resolve and load commands that can run at once in "
+            "addition to slots, so that they do not wait behind builds.")
+    commitSlots       = (CfgInt, 2,
+            "Number of built changesets that can be committed to the "
+            "repository at once.")
+    commitRetries     = (CfgInt, 3,
+            "Number of times to retry committing a built changeset after "
+            "an error connecting to the repository.")
     useCache          = (CfgBool, False)
+    cacheFetchThreads = (CfgInt, 4,
+            "Number of changesets to download at once when filling the "
+            "changeset cache.")
+    cacheSizeLimit    = (CfgString, None,
+            "Maximum size of the changeset cache before the least recently "
+            "used entries are removed.  An integer number of mebibytes, or "
+            "an integer suffixed by K, M, G, or T.")
+    cacheEntryLimit   = (CfgInt, 0,
+            "Maximum number of entries in the changeset cache before the "
+            "least recently used ones are removed.")
     useTmpfs          = (CfgBool, False)
     pluginDirs        = (CfgPathList, ['/usr/share/rmake/plugins'])
     usePlugins        = (CfgBool, True)
@@ -108,12 +127,23 @@ class rMakeBuilderConfiguration(daemon.DaemonConfig):
     def getCacheDir(self):
         return self.buildDir + '/cscache'
 
+    def getCacheSizeLimit(self):
+        try:
+            return chrootcache.parseSize(self.cacheSizeLimit or '0')
+        except ValueError:
+            raise errors.RmakeError("Invalid cacheSizeLimit %r. Must be an "
+                    "integer number of mebibytes, or an integer suffixed by "
+                    "K, M, G, or T." % (self.cacheSizeLimit,))
+
     def getChrootDir(self):
         return self.buildDir + '/chroots'
 
     def getChrootArchiveDir(self):
         return self.buildDir + '/archive'
 
+    def getCommitDir(self):
+        return self.buildDir + '/commits'
+
     def getBuildLogDir(self, jobId=None):
         if jobId:
             return self.logDir + '/buildlogs/%d/' % jobId
@@ -206,6 +236,8 @@ class rMakeConfiguration(rMakeBuilderConfiguration):
     messageBusHost  = (CfgString, None)
     messageBusPort  = (CfgInt, 50900)
     logServerPort   = (CfgInt, 50901)
+    # number of finished build logs to compress at once
+    logCompressors  = (CfgInt, 2)
     memCache        = CfgString
     # DEPRECATED
     caCertPath        = None
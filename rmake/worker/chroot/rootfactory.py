@@ -47,6 +47,7 @@ from rmake import compat
 from rmake import constants
 from rmake.lib import flavorutil
 from rmake.lib import rootfactory
+from rmake.lib.trovekey import getTroveKey
 from rmake.worker.chroot.rootmanifest import ChrootManifest
 
 
@@ -235,8 +236,13 @@ class ConaryBasedChroot(rootfactory.BasicChroot):
             for filename in files:
                 _addModeBits(os.sep.join((root, filename)), 04)
 
-        if manifest:
-            manifest.write(self.cfg.root)
+        if not manifest:
+            # Without a chroot cache there are no fingerprints, but the
+            # node still advertises what its old chroots hold.
+            manifest = ChrootManifest([], [], [], [], troves=[getTroveKey(x)
+                for x in self.jobList + self.crossJobList
+                         + self.bootstrapJobList])
+        manifest.write(self.cfg.root)
         if self.chrootFingerprint:
             strFingerprint = sha1helper.sha1ToString(self.chrootFingerprint)
             self.logger.info('caching chroot with fingerprint %s',
@@ -344,6 +350,7 @@ class ConaryBasedChroot(rootfactory.BasicChroot):
                 crossFingerprints=fingerprints[a:b],
                 bootstrapFingerprints=fingerprints[b:],
                 rpmRequirements=self.cfg.rpmRequirements,
+                troves=[getTroveKey(x) for x in job],
                 )
 
     def _restoreFromCache(self):
@@ -33,6 +33,8 @@ from rmake import constants
 from rmake import errors
 from rmake.worker.chroot import rootserver
 from rmake.worker.chroot import rootfactory
+from rmake.worker.chroot.rootmanifest import ChrootManifest
+from rmake.lib import bloomfilter
 from rmake.lib import flavorutil
 from rmake.lib import logger as logger_
 from rmake.lib import repocache
@@ -178,7 +180,11 @@ class ChrootManager(object):
         cacheDir = serverCfg.getCacheDir()
         util.mkdirChain(cacheDir)
         if self.serverCfg.useCache:
-            self.csCache = repocache.RepositoryCache(cacheDir)
+            self.csCache = repocache.RepositoryCache(cacheDir,
+                    fetchThreads=serverCfg.cacheFetchThreads,
+                    sizeLimit=serverCfg.getCacheSizeLimit(),
+                    entryLimit=serverCfg.cacheEntryLimit,
+                    useIndex=True)
         else:
             self.csCache = None
         self.chrootCache = serverCfg.getChrootCache()
@@ -188,6 +194,12 @@ class ChrootManager(object):
             self.chrootCache.setLogger(logger)
         self.logger = logger
         self.queue = ChrootQueue(self.baseDir, self.serverCfg.chrootLimit)
+        # troves in each cached chroot, and (manifest mtime, troves) for
+        # each old chroot, as last read for getChrootSummary
+        self._cachedTroves = {}
+        self._chrootTroves = {}
+        # what the last summary was made from
+        self._summaryState = None
 
     def listChroots(self):
         chroots = self.queue.listChroots()
@@ -199,6 +211,60 @@ class ChrootManager(object):
     def chrootFinished(self, chrootPath):
         self.queue.chrootFinished(chrootPath)
 
+    def getCacheStats(self):
+        if not self.csCache:
+            return None
+        return self.csCache.getStats()
+
+    def getChrootSummary(self, changedOnly=False):
+        """
+            Summarize the troves in this node's cached chroots, and in old
+            chroots that a build reusing roots could start from, so that
+            builds can be sent where the least needs installing.
+
+            Returns a dict with Bloom filters of trove keys for 'cache' and
+            'chroots', each present only if it has something in it.  If
+            C{changedOnly} is set and the cached and old chroots are the
+            same as for the last summary, returns None instead.
+        """
+        cached = {}
+        # the cache directory is created when the first chroot is stored
+        if self.chrootCache and os.path.isdir(self.chrootCache.cacheDir):
+            for item in self.chrootCache.listCached():
+                troves = self._cachedTroves.get(item.fingerprint)
+                if troves is None:
+                    # cached chroots never change, so read each one once
+                    manifest = self.chrootCache.readManifest(item.fingerprint)
+                    troves = manifest and manifest.troves or frozenset()
+                cached[item.fingerprint] = troves
+        self._cachedTroves = cached
+
+        chroots = {}
+        for path in self.queue.listOldChroots():
+            st = util.lstat(ChrootManifest.getPath(path))
+            if not st:
+                continue
+            mtime, troves = self._chrootTroves.get(path, (None, None))
+            if mtime != st.st_mtime:
+                manifest = ChrootManifest.read(path)
+                troves = manifest and manifest.troves or frozenset()
+            chroots[path] = st.st_mtime, troves
+        self._chrootTroves = chroots
+
+        state = (frozenset(cached),
+                 frozenset((x[0], x[1][0]) for x in chroots.iteritems()))
+        if changedOnly and state == self._summaryState:
+            return None
+        self._summaryState = state
+        summary = {}
+        keys = set().union(*cached.values())
+        if keys:
+            summary['cache'] = bloomfilter.BloomFilter.fromKeys(keys)
+        keys = set().union(*[ x[1] for x in chroots.values() ])
+        if keys:
+            summary['chroots'] = bloomfilter.BloomFilter.fromKeys(keys)
+        return summary
+
     def getRootFactory(self, cfg, buildReqList, crossReqList, bootstrapReqs,
             buildTrove):
         cfg = copy.deepcopy(cfg)
@@ -24,20 +24,28 @@ class ChrootManifest(object):
 
     FILENAME = 'rmake.manifest'
     AR_SUFFIX = '.manifest'
+    # keys from trovekey.getTroveKey for everything installed.  Manifests
+    # written before this was recorded don't have them.
+    troves = frozenset()
 
     def __init__(self, jobFingerprints, bootstrapFingerprints,
-            crossFingerprints, rpmRequirements):
+            crossFingerprints, rpmRequirements, troves=()):
         self.jobFingerprints = set(jobFingerprints)
         self.bootstrapFingerprints = set(bootstrapFingerprints)
         self.crossFingerprints = set(crossFingerprints)
         self.rpmRequirements = set(rpmRequirements)
+        self.troves = frozenset(troves)
 
     @classmethod
-    def read(cls, root_or_path):
+    def getPath(cls, root_or_path):
         if os.path.isdir(root_or_path):
-            path = os.path.join(root_or_path, cls.FILENAME)
+            return os.path.join(root_or_path, cls.FILENAME)
         else:
-            path = root_or_path + cls.AR_SUFFIX
+            return root_or_path + cls.AR_SUFFIX
+
+    @classmethod
+    def read(cls, root_or_path):
+        path = cls.getPath(root_or_path)
         try:
             return cPickle.load(open(path))
         except:
@@ -18,13 +18,16 @@
 import errno
 import os
 import shutil
+import socket
 import sys
+import tempfile
 import time
 import traceback
 
 from conary import conaryclient
 from conary.lib import util
 from conary.repository import changeset
+from conary.repository import errors as reposerrors
 from conary.repository.errors import CommitError
 
 from rmake import errors
@@ -54,6 +57,13 @@ class Command(server.Server):
             will parse data sent over that pipe.
     """
     name = 'command' # command name is used for logging purposes.
+    # Queued commands are started lowest queuePriority first, then oldest
+    # job first.  Lightweight commands may also run in the worker's
+    # lightSlots, so they do not wait for chroot builds to finish.
+    queuePriority = 10
+    lightweight = False
+    # Commits run in the worker's commitSlots instead.
+    usesCommitSlot = False
 
     def __init__(self, cfg, commandId, jobId):
         server.Server.__init__(self)
@@ -128,6 +138,13 @@ class Command(server.Server):
     def getChrootFactory(self):
         return None
 
+    def getCommitPath(self):
+        """
+            Returns the path of a changeset this command left for the
+            worker to commit, if any.
+        """
+        return None
+
     def getLogPath(self):
         """
             All commands log their activities to a file based on their command
@@ -310,6 +327,7 @@ class BuildCommand(AttachedCommand):
         self.logData = logData
         self.logPath = logPath
         self.uri = None
+        self.commitPath = None
 
     def isReady(self):
         return self.chrootFactory.reserveRoot()
@@ -317,6 +335,15 @@ class BuildCommand(AttachedCommand):
     def getChrootFactory(self):
         return self.chrootFactory
 
+    def getCommitPath(self):
+        return self.commitPath
+
+    def _handleData(self, data):
+        if data[0] == 'commit':
+            self.commitPath = data[1]
+        else:
+            AttachedCommand._handleData(self, data)
+
     def runAttachedCommand(self):
         try:
             trove = self.trove
@@ -379,28 +406,18 @@ class BuildCommand(AttachedCommand):
     def getResults(self):
         try:
             trove = self.trove
-            repos = conaryclient.ConaryClient(self.buildCfg).getRepos()
             buildResult = self.chroot.checkResults(self.trove.getName(),
                                                    self.trove.getVersion(),
                                                    self.trove.getFlavorList())
             if buildResult.isBuildSuccess():
-                csFile = buildResult.getChangeSetFile()
-                cs = changeset.ChangeSetFromFile(csFile)
-                troveList = [x.getNewNameVersionFlavor() for
-                             x in cs.iterNewTroveList() ]
-                try:
-                    repos.commitChangeSet(cs)
-                except CommitError, err:
-                    # someone else committed this package between 
-                    # our building and committing
-                    if 'already exists' in str(err):
-                        trove.troveDuplicate(troveList)
-                    else:
-                        raise
-                else:
-                    # sends off message that this trove built successfully
-                    trove.troveBuilt(troveList)
-                del cs # this makes sure the changeset closes the fd.
+                # Committing a large changeset can take minutes, so move
+                # it out of the chroot and let the worker commit it while
+                # the chroot is cleaned up and reused.  The trove is
+                # marked built once the commit is done.
+                self.commitPath = self._stageChangeSet(
+                                            buildResult.getChangeSetFile())
+                self.writePipe.send(('commit', self.commitPath))
+                self.writePipe.flush()
             else:
                 reason = buildResult.getFailureReason()
                 trove.troveFailed(reason)
@@ -411,6 +428,16 @@ class BuildCommand(AttachedCommand):
             trove.troveFailed(reason)
         self.chroot.stop()
 
+    def _stageChangeSet(self, csFile):
+        commitDir = self.cfg.getCommitDir()
+        util.mkdirChain(commitDir)
+        fd, commitPath = tempfile.mkstemp(dir=commitDir,
+                                          prefix='%s-' % self.trove.getName(),
+                                          suffix='.ccs')
+        os.close(fd)
+        shutil.move(csFile, commitPath)
+        return commitPath
+
     def _shutDown(self):
         try:
             self.chroot.stop()
@@ -422,12 +449,83 @@ class BuildCommand(AttachedCommand):
         except errors.OpenError, err:
             pass
         self._killAllPids()
-        if self.buildCfg.cleanAfterCook and self.trove.isBuilt():
+        if self.buildCfg.cleanAfterCook and (self.trove.isBuilt()
+                                             or self.commitPath):
             self.chrootFactory.clean()
         else:
             self.chrootFactory.unmount()
         Command._shutDown(self)
 
+class CommitCommand(AttachedCommand):
+    """
+    Commit a changeset left by a BuildCommand to the repository and mark
+    the trove built.  Errors connecting to the repository are retried.
+    """
+    name = 'commit-command'
+    # ahead of builds, since troves waiting on this one can only be
+    # built once it is committed
+    queuePriority = 5
+    usesCommitSlot = True
+    retryDelay = 5
+
+    def __init__(self, cfg, commandId, jobId, eventHandler, buildCfg, trove,
+                 changeSetPath):
+        super(CommitCommand, self).__init__(cfg, commandId, jobId,
+            eventHandler, trove=trove)
+        self.buildCfg = buildCfg
+        self.changeSetPath = changeSetPath
+
+    def runAttachedCommand(self):
+        try:
+            self._commit()
+        finally:
+            util.removeIfExists(self.changeSetPath)
+
+    def _commit(self):
+        trove = self.trove
+        repos = conaryclient.ConaryClient(self.buildCfg).getRepos()
+        cs = changeset.ChangeSetFromFile(self.changeSetPath)
+        troveList = [x.getNewNameVersionFlavor() for
+                     x in cs.iterNewTroveList() ]
+        attempt = 0
+        while True:
+            try:
+                repos.commitChangeSet(cs)
+            except CommitError, err:
+                if 'already exists' in str(err):
+                    if attempt:
+                        # an earlier attempt got through and only the
+                        # reply was lost, so the commit is ours.
+                        trove.troveBuilt(troveList)
+                    else:
+                        # someone else committed this package between
+                        # our building and committing
+                        trove.troveDuplicate(troveList)
+                    break
+                raise
+            except (reposerrors.OpenError, socket.error, IOError), err:
+                attempt += 1
+                if attempt > self.cfg.commitRetries:
+                    raise
+                delay = self.retryDelay * 2 ** (attempt - 1)
+                self.logger.warning('Committing %s failed, retrying in %s '
+                                    'seconds: %s' % (trove.getName(), delay,
+                                                     err))
+                time.sleep(delay)
+            else:
+                # sends off message that this trove built successfully
+                trove.troveBuilt(troveList)
+                break
+        del cs # this makes sure the changeset closes the fd.
+
+    def commandDied(self, status):
+        AttachedCommand.commandDied(self, status)
+        if self.isErrored() and not self.trove.isFailed():
+            # The server only knows about the build command, which has
+            # already completed, so it will not fail the trove for us.
+            # A stopped commit has failed its trove already.
+            self.trove.troveFailed(self.getFailureReason())
+
 class StopCommand(Command):
 
     name = 'stop-command'
@@ -499,6 +597,8 @@ class SessionCommand(Command):
 class ResolveCommand(AttachedCommand):
 
     name = 'resolve-command'
+    queuePriority = 0
+    lightweight = True
 
     def __init__(self, cfg, commandId, jobId,  eventHandler, logData,
                  resolveJob):
@@ -527,6 +627,8 @@ class LoadCommand(AttachedCommand):
     Load all troves for a job.
     """
     name = 'load-command'
+    queuePriority = 0
+    lightweight = True
 
     def __init__(self, cfg, commandId, jobId, eventHandler, job, troveList,
       reposName):
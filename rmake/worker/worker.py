@@ -19,10 +19,13 @@
 The worker is in charge of taking build requests and monitoring them
 until they complete.
 """
+import bisect
 import os
 import select
 import traceback
 
+from conary.lib import util
+
 from rmake.lib import pipereader
 from rmake.lib import server
 
@@ -44,14 +47,20 @@ class Worker(server.Server):
                        'resolve'  : command.ResolveCommand,
                        'stop'     : command.StopCommand,
                        'session'  : command.SessionCommand,
+                       'commit'   : command.CommitCommand,
                        'image'    : imagecommand.ImageCommand }
 
-    def __init__(self, serverCfg, logger, slots=1):
+    def __init__(self, serverCfg, logger, slots=1, lightSlots=0,
+                 commitSlots=1):
         """
             param serverCfg: server.servercfg.rMakeConfiguration instance
             param logger: lib.logger.Logger instance
             param slots: number of commands that can be run at once
             on this node.
+            param lightSlots: number of additional lightweight commands
+            (resolve and load) that can be run at once on this node.
+            param commitSlots: number of built changesets that can be
+            committed at once on this node.
         """
         self.cfg = serverCfg
         self.logger = logger
@@ -61,9 +70,15 @@ class Worker(server.Server):
         self.chrootManager = rootmanager.ChrootManager(self.cfg, self.logger)
         self._foundResult = False
         self._queuedCommands = [] # list of command classes + parameters
-                                  # for commands waiting to be run
+                                  # for commands waiting to be run, in the
+                                  # order they should be started
+        self._queueKeys = [] # (priority, jobId, sequence) for each queued
+                             # command, kept sorted.
+        self._queueSequence = 0
         self.commands = [] # list of command objects currently running
         self.slots = slots
+        self.lightSlots = lightSlots
+        self.commitSlots = commitSlots
 
     def hasActiveTroves(self):
         return self.commands or self._queuedCommands
@@ -123,6 +138,9 @@ class Worker(server.Server):
                           hook=self._serveLoopHook)
         self.runCommand(self.commandClasses['stop'], self.cfg, commandId,
                         targetCommand, killFn)
+        if isinstance(targetCommand, self.commandClasses['commit']):
+            # a killed commit doesn't get to clean up after itself
+            util.removeIfExists(targetCommand.changeSetPath)
         if targetCommand.trove:
             targetCommand.trove.troveFailed('Stop requested')
         elif targetCommand.job:
@@ -163,11 +181,28 @@ class Worker(server.Server):
         return self.chrootManager.archiveChroot(chrootPath, newPath)
 
     def queueCommand(self, commandClass, cfg, *args):
-        self._queuedCommands.append((commandClass, cfg, args))
+        # args usually start with commandId, jobId
+        self._queueSequence += 1
+        jobId = None
+        if len(args) > 1:
+            jobId = args[1]
+        key = (commandClass.queuePriority, jobId, self._queueSequence)
+        self._insertQueued(key, (commandClass, cfg, args))
+
+    def _insertQueued(self, key, commandTuple):
+        idx = bisect.bisect(self._queueKeys, key)
+        self._queueKeys.insert(idx, key)
+        self._queuedCommands.insert(idx, commandTuple)
 
     def listChroots(self):
         return self.chrootManager.listChroots()
 
+    def getCacheStats(self):
+        return self.chrootManager.getCacheStats()
+
+    def getChrootSummary(self, changedOnly=False):
+        return self.chrootManager.getChrootSummary(changedOnly)
+
     def listChrootsWithHost(self):
         return [('_local_', x) for x in self.chrootManager.listChroots()]
 
@@ -184,11 +219,7 @@ class Worker(server.Server):
             and handles them.
         """
         # called once every .1 seconds when serving.
-        if self._queuedCommands and (len(self.commands) < self.slots):
-            commandTuple = self._queuedCommands.pop(0)
-            commandClass, cfg, args = commandTuple
-            if not self.runCommand(commandClass, cfg, *args):
-                self.queueCommand(commandClass, cfg, *args)
+        self._startQueuedCommands()
 
         self._collectChildren()
         if self._foundResult:
@@ -196,6 +227,43 @@ class Worker(server.Server):
             return True
         return False
 
+    def _hasFreeSlot(self, commandClass):
+        """
+            Lightweight commands use the lightSlots first and then any
+            free regular slot; commits only use the commitSlots; other
+            commands only use regular slots.
+        """
+        # slot use is a property of the command class
+        commits = len([ x for x in self.commands if type(x).usesCommitSlot ])
+        if commandClass.usesCommitSlot:
+            return commits < self.commitSlots
+        light = len([ x for x in self.commands if type(x).lightweight ])
+        heavy = len(self.commands) - light - commits
+        if commandClass.lightweight:
+            return light + heavy < self.slots + self.lightSlots
+        return heavy + max(0, light - self.lightSlots) < self.slots
+
+    def _startQueuedCommands(self):
+        """
+            Start as many queued commands as there are free slots for,
+            in queue order.  Commands that are not ready to run keep
+            their place in the queue.
+        """
+        idx = 0
+        while idx < len(self._queuedCommands):
+            if len(self.commands) >= (self.slots + self.lightSlots
+                                      + self.commitSlots):
+                break
+            commandClass, cfg, args = self._queuedCommands[idx]
+            if not self._hasFreeSlot(commandClass):
+                idx += 1
+                continue
+            key = self._queueKeys.pop(idx)
+            commandTuple = self._queuedCommands.pop(idx)
+            if not self.runCommand(commandClass, cfg, *args):
+                self._insertQueued(key, commandTuple)
+                idx += 1
+
     def stopTroveLogger(self, trove):
         if not hasattr(trove, 'logPid'):
             return
@@ -291,6 +359,14 @@ class Worker(server.Server):
                 command.commandErrored(str(err), tb)
         return command
 
+    def _queueCommit(self, buildCommand):
+        trove = buildCommand.getTrove()
+        commandId = self.idgen.getCommitCommandId(trove)
+        self.queueCommand(self.commandClasses['commit'], self.cfg, commandId,
+                          buildCommand.jobId, buildCommand.eventHandler,
+                          buildCommand.buildCfg, trove,
+                          buildCommand.getCommitPath())
+
     def _pidDied(self, pid, status, name=None):
         """
             Called automatically from collectChildren, after a pid has 
@@ -315,6 +391,8 @@ class Worker(server.Server):
                 else:
                     self.info('%s (Pid %s) completed' % (name, pid))
                     self.commandCompleted(command.getCommandId())
+                    if command.getCommitPath():
+                        self._queueCommit(command)
                 if command.getChrootFactory():
                     self.chrootManager.chrootFinished(
                                          command.getChrootFactory().getRoot())
@@ -328,9 +406,41 @@ class Worker(server.Server):
     def commandCompleted(self, command):
         pass
 
+    def stopCommits(self, jobId=None):
+        """
+            Drops the queued commits of job jobId, or of every job if
+            jobId is None, and stops the running ones.  Their staged
+            changesets are deleted.
+
+            The server only knows about the build commands, which have
+            completed by the time their changesets are committed, so
+            stopping a job has to stop its commits here.
+        """
+        commitClass = self.commandClasses['commit']
+        for idx in reversed(range(len(self._queuedCommands))):
+            commandClass, cfg, args = self._queuedCommands[idx]
+            if not issubclass(commandClass, commitClass):
+                continue
+            if jobId is not None and self._queueKeys[idx][1] != jobId:
+                continue
+            del self._queueKeys[idx]
+            del self._queuedCommands[idx]
+            commandId, _, _, _, trove, changeSetPath = args
+            self.info('Dropping queued commit %s' % commandId)
+            util.removeIfExists(changeSetPath)
+            trove.troveFailed('Stop requested')
+        for commitCommand in list(self.commands):
+            if not isinstance(commitCommand, commitClass):
+                continue
+            if jobId is None or commitCommand.jobId == jobId:
+                self.stopCommand(commitCommand.getCommandId())
+
     def stopAllCommands(self):
-        for command in self.commands:
-            self.stopCommand(command.commandId)
+        self.stopCommits()
+        commitClass = self.commandClasses['commit']
+        for command in list(self.commands):
+            if not isinstance(command, commitClass):
+                self.stopCommand(command.commandId)
 
 
 class CommandIdGen(object):
@@ -353,6 +463,10 @@ class CommandIdGen(object):
         str = 'RESOLVE-%s-%s' % (buildTrove.jobId, buildTrove.getName())
         return self._getCommandId(str)
 
+    def getCommitCommandId(self, buildTrove):
+        str = 'COMMIT-%s-%s' % (buildTrove.jobId, buildTrove.getName())
+        return self._getCommandId(str)
+
     def getStopCommandId(self, targetCommandId):
         str = 'STOP-%s' % (targetCommandId)
         return self._getCommandId(str)
@@ -0,0 +1,197 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+"""
+Message bus load test.
+
+Starts a message bus in a child process and connects a number of sessions
+to it that all subscribe to the same channel.  One more session publishes
+messages to that channel in bursts; every delivery is timed from the moment
+the message was sent until a subscriber received it.
+
+    python -m rmake_test.busload --sessions 150 --messages 2000
+"""
+
+import asyncore
+import optparse
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import time
+
+from rmake.messagebus import busclient
+from rmake.messagebus import messages
+from rmake.multinode.server import messagebus
+
+
+class LoadTestMessage(messages.Message):
+    messageType = 'LOADTEST'
+
+    def set(self, sequence):
+        self.headers.sequence = sequence
+        self.headers.sent = repr(time.time())
+        self.payload.sequence = sequence
+
+
+class _Receiver(object):
+    def __init__(self):
+        self.latencies = []
+
+    def messageReceived(self, m):
+        if isinstance(m, LoadTestMessage):
+            self.latencies.append(time.time() - float(m.headers.sent))
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    idx = int(round(pct / 100.0 * (len(values) - 1)))
+    return values[idx]
+
+
+def _pollUntil(socketMap, getCount, target, timeout):
+    """
+    Poll the clients until C{getCount()} reaches C{target}, giving up if
+    it stops increasing for C{timeout} seconds.
+    """
+    lastCount = getCount()
+    lastProgress = time.time()
+    while lastCount < target:
+        asyncore.poll2(timeout=0.1, map=socketMap)
+        count = getCount()
+        if count != lastCount:
+            lastCount = count
+            lastProgress = time.time()
+        elif time.time() - lastProgress > timeout:
+            raise RuntimeError('Message bus load test made no progress '
+                               'for %s seconds' % timeout)
+
+
+def runLoad(numSessions, numMessages, poller=None, burstSize=50,
+            workDir=None, timeout=30):
+    """
+    Run one load test and return a dictionary of results.
+    """
+    ownWorkDir = workDir is None
+    if ownWorkDir:
+        workDir = tempfile.mkdtemp(prefix='rmake-busload-')
+    try:
+        return _runLoad(numSessions, numMessages, poller, burstSize,
+                        workDir, timeout)
+    finally:
+        if ownWorkDir:
+            shutil.rmtree(workDir, ignore_errors=True)
+
+
+def _runLoad(numSessions, numMessages, poller, burstSize, workDir, timeout):
+    bus = messagebus.MessageBus('', 0, workDir + '/messagebus.log',
+                                poller=poller)
+    bus.getLogger().disableConsole()
+    port = bus.getPort()
+    pid = os.fork()
+    if not pid:
+        try:
+            bus.serve_forever()
+        finally:
+            os._exit(0)
+    bus._close()
+
+    clients = []
+    try:
+        socketMap = {}
+        receivers = []
+        for idx in range(numSessions + 1):
+            if idx:
+                receiver = _Receiver()
+                receivers.append(receiver)
+                subscriptions = ['/loadtest']
+            else:
+                receiver, subscriptions = None, None
+            client = busclient.MessageBusClient('localhost', port, receiver,
+                                        logPath=workDir + '/client.log',
+                                        subscriptions=subscriptions)
+            client.logger.disableConsole()
+            client.connect()
+            clients.append(client)
+            socketMap.update(client.getSession().getMap())
+        publisher = clients[0]
+
+        def _registered():
+            return len([x for x in clients if x.isRegistered()])
+        _pollUntil(socketMap, _registered, len(clients), timeout)
+
+        def _delivered():
+            return sum(len(x.latencies) for x in receivers)
+        start = time.time()
+        sent = 0
+        while sent < numMessages:
+            burst = min(burstSize, numMessages - sent)
+            for idx in range(burst):
+                m = LoadTestMessage()
+                m.set(sent + idx)
+                publisher.sendMessage('/loadtest', m)
+            sent += burst
+            _pollUntil(socketMap, _delivered, sent * numSessions, timeout)
+        elapsed = time.time() - start
+    finally:
+        for client in clients:
+            client.disconnect()
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+
+    latencies = []
+    for receiver in receivers:
+        latencies.extend(receiver.latencies)
+    return dict(sessions=numSessions,
+                messages=numMessages,
+                deliveries=len(latencies),
+                elapsed=elapsed,
+                throughput=len(latencies) / max(elapsed, 1e-6),
+                p50=percentile(latencies, 50),
+                p99=percentile(latencies, 99),
+                max=max(latencies or [0.0]))
+
+
+def main(args):
+    parser = optparse.OptionParser()
+    parser.add_option('-n', '--sessions', type='int', default=150,
+            help="Number of subscribing sessions")
+    parser.add_option('-m', '--messages', type='int', default=1000,
+            help="Number of messages to publish")
+    parser.add_option('-b', '--burst', type='int', default=50,
+            help="Messages published between waits for delivery")
+    parser.add_option('--poller', help="Message bus poller backend")
+    options, args = parser.parse_args(args)
+    if args:
+        parser.error("No arguments expected")
+
+    results = runLoad(options.sessions, options.messages,
+                      poller=options.poller, burstSize=options.burst)
+    print ('%(sessions)d sessions, %(messages)d messages: '
+           '%(deliveries)d deliveries in %(elapsed).2fs '
+           '(%(throughput).0f/s)' % results)
+    print ('fan-out latency: p50 %.1fms p99 %.1fms max %.1fms'
+           % (results['p50'] * 1000, results['p99'] * 1000,
+              results['max'] * 1000))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,77 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+"""
+Message bus codec benchmark.
+
+Times encoding and decoding a typical event list payload with every
+payload encoding the bus knows about.
+
+    python -m rmake_test.codecbench --events 50 --loops 200
+"""
+
+import optparse
+import sys
+import time
+
+from rmake.messagebus import codec
+
+
+def makePayload(numEvents):
+    events = [(('TROVE_STATE_UPDATED', 'job-%d' % x),
+               [(x, ['foo:source', '/localhost@rpl:linux//1.0-1', ''],
+                 4, 'Trove building on node %d' % x)])
+              for x in range(numEvents)]
+    return {'eventList': events}
+
+
+def timeCodec(codecClass, payload, numLoops):
+    start = time.time()
+    for _ in range(numLoops):
+        codecClass.loads(codecClass.dumps(payload))
+    return time.time() - start
+
+
+def main(args):
+    parser = optparse.OptionParser()
+    parser.add_option('-e', '--events', type='int', default=50,
+            help="Number of events in the payload")
+    parser.add_option('-l', '--loops', type='int', default=200,
+            help="Number of encode/decode round trips per codec")
+    options, args = parser.parse_args(args)
+    if args:
+        parser.error("No arguments expected")
+
+    payload = makePayload(options.events)
+    results = {}
+    for name in codec.PREFERENCE:
+        codecClass = codec.getCodec(name)
+        results[name] = timeCodec(codecClass, payload, options.loops)
+        size = len(codecClass.dumps(payload))
+        print ('%s: %d round trips in %.3fs (%.1fus each), %d bytes'
+               % (name, options.loops, results[name],
+                  results[name] / options.loops * 1e6, size))
+    baseline = results[codec.DEFAULT]
+    for name in codec.PREFERENCE:
+        if name != codec.DEFAULT:
+            print '%s speedup over %s: %.1fx' % (
+                    name, codec.DEFAULT, baseline / max(results[name], 1e-9))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
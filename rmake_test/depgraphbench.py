@@ -0,0 +1,85 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+"""
+Dependency graph benchmark.
+
+Consumes a synthetic dependency graph leaf by leaf, the way a build job
+does, once asking the incrementally maintained graph for its leaf cycles
+and once recomputing the strongly connected components every time.
+
+    python -m rmake_test.depgraphbench --nodes 5000 --steps 200
+"""
+
+import optparse
+import random
+import sys
+import time
+
+from rmake.build import dephandler
+
+
+def makeGraph(numNodes, numEdges, seed=0):
+    rand = random.Random(seed)
+    depGraph = dephandler.DependencyGraph()
+    for node in range(numNodes):
+        depGraph.addNode(node)
+    for _ in range(numEdges):
+        fromNode = rand.randrange(numNodes)
+        # mostly point "down" so that we get a realistic mix of long
+        # chains and a few large cycles.
+        if rand.random() < 0.98:
+            toNode = rand.randrange(max(fromNode, 1))
+        else:
+            toNode = rand.randrange(numNodes)
+        if fromNode != toNode:
+            depGraph.addEdge(fromNode, toNode, (False, None))
+    return depGraph
+
+
+def consume(depGraph, getLeaves, numSteps):
+    start = time.time()
+    for _ in range(numSteps):
+        component = min(getLeaves(depGraph), key=min)
+        depGraph.delete(min(component))
+    return time.time() - start
+
+
+def main(args):
+    parser = optparse.OptionParser()
+    parser.add_option('-n', '--nodes', type='int', default=5000,
+            help="Number of nodes in the graph")
+    parser.add_option('-s', '--steps', type='int', default=200,
+            help="Number of leaves to consume")
+    options, args = parser.parse_args(args)
+    if args:
+        parser.error("No arguments expected")
+
+    numEdges = options.nodes * 3
+    incremental = consume(makeGraph(options.nodes, numEdges),
+                          lambda x: x.getLeafComponents(), options.steps)
+    full = consume(makeGraph(options.nodes, numEdges),
+                   lambda x: x.getStronglyConnectedGraph().getLeaves(),
+                   options.steps)
+    print ('%d nodes, %d steps: incremental %.3fs, full %.3fs (%.1fx)'
+           % (options.nodes, options.steps, incremental, full,
+              full / max(incremental, 1e-9)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -21,6 +21,7 @@ from conary.deps import deps
 
 from rmake.build import buildjob
 from rmake.build import buildtrove
+from rmake.build import subscriber
 from rmake import failure
 from rmake.lib import apiutils
 
@@ -105,3 +106,39 @@ class BuildJobTest(rmakehelp.RmakeHelper):
                             ('foo:run', None, deps.parseFlavor('!readline')))
         assert(len(results) == 1)
         assert(results[0][2] == deps.parseFlavor('ssl,!readline'))
+
+    def testDbLoggerWriteBehind(self):
+        db = self.openRmakeDatabase()
+        trv = self.addComponent('foo:source', '1.0', '')
+        job = buildjob.NewBuildJob(db, [trv.getNameVersionFlavor()])
+        bt = buildtrove.BuildTrove(job.jobId, *trv.getNameVersionFlavor())
+        dbLogger = subscriber._JobDbLogger(db, flushInterval=3600)
+        dbLogger.attach(job)
+        job.setBuildTroves([bt])
+        bt.log('first message')
+        bt.troveBuilding()
+        bt.log('second message')
+
+        # Nothing is written until the flush is due, and the trove row is
+        # only updated once.
+        newTrv = db.getTrove(job.jobId, *trv.getNameVersionFlavor())
+        assert(not newTrv.isBuilding())
+        updates = [x for x in dbLogger._pending
+                   if x[0] == db.jobStore.updateTrove]
+        self.assertEqual(len(updates), 1)
+        assert(0 < db.flushWriteBehind() <= 3600)
+
+        self.assertEqual(db.flushWriteBehind(force=True), None)
+        newTrv = db.getTrove(job.jobId, *trv.getNameVersionFlavor())
+        assert(newTrv.isBuilding())
+        messages = [x[1] for x in
+                    db.getTroveLogs(job.jobId, trv.getNameVersionFlavor())]
+        assert('first message' in messages)
+        assert('second message' in messages)
+
+        # Finishing the job writes everything straight away
+        bt.troveFailed(failure.BuildFailed('failureReason', 'foo'))
+        job.jobFailed('foo')
+        assert(not dbLogger._pending)
+        assert(db.getTrove(job.jobId, *trv.getNameVersionFlavor()).isFailed())
+        assert(db.getJob(job.jobId).isFailed())
@@ -141,3 +141,31 @@ class JobStoreTest(rmakehelp.RmakeHelper):
         assert(jobs[0].iterTroveList(withContexts=True).next() == (fooSource.getNameVersionFlavor() + ('context1',)))
         jobs = db.getJobs([job1.jobId, job2.jobId], withTroves=False)
         assert(jobs[0].iterTroveList(withContexts=True).next() == (fooSource.getNameVersionFlavor() + ('context1',)))
+
+    def testGetTrovesBatched(self):
+        fooSource = self.addComponent('foo:source')
+        barSource = self.addComponent('bar:source')
+        bazSource = self.addComponent('baz:source')
+        job1 = self.newJob((fooSource, 'context1'), (fooSource, 'context2'),
+                           (barSource, ''))
+        job2 = self.newJob((bazSource, ''), (fooSource, 'context1'))
+        db = self.openRmakeDatabase()
+        fooNVF = fooSource.getNameVersionFlavor()
+        wanted = [
+                (job2.jobId,) + fooNVF + ('context1',),
+                (job1.jobId,) + bazSource.getNameVersionFlavor() + ('',),
+                ]
+        # baz is only part of the second job
+        self.assertRaises(errors.TroveNotFound, db.getTroves, wanted)
+        wanted = [
+                (job2.jobId,) + fooNVF + ('context1',),
+                (job1.jobId,) + barSource.getNameVersionFlavor() + ('',),
+                (job1.jobId,) + fooNVF + ('context2',),
+                (job2.jobId,) + bazSource.getNameVersionFlavor() + ('',),
+                (job1.jobId,) + fooNVF + ('context1',),
+                ]
+        for batchSize in (500, 1):
+            self.mock(db.jobStore, 'batchSize', batchSize)
+            troves = db.getTroves(wanted)
+            self.assertEqual([(x.jobId,) + x.getNameVersionFlavor(True)
+                for x in troves], wanted)
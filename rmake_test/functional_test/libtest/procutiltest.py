@@ -36,3 +36,27 @@ class ProcUtilTest(rephelp.RepositoryHelper):
         assert(xx == m)
         xx.update()
         assert(xx != m)
+
+    def testThawDoesNotProbe(self):
+        m = procutil.MachineInformation(chrootPath=self.workDir)
+        assert(m.chrootMount in m.mounts)
+        d = m.__freeze__()
+        def probe(*args):
+            raise AssertionError('looked at the local machine')
+        oldFunctions = procutil.getCpuInfo, procutil.getMountInfo
+        procutil.getCpuInfo = procutil.getMountInfo = probe
+        try:
+            xx = procutil.MachineInformation.__thaw__(d)
+        finally:
+            procutil.getCpuInfo, procutil.getMountInfo = oldFunctions
+        assert(xx == m)
+
+        # status updates carry only what changes
+        status = dict(meminfo=[[1, 2], [3, 4]], loadavg=[5.0, 6.0, 7.0],
+                      uptime=8.0, chrootAvail='9')
+        xx.setStatus(status)
+        self.assertEquals(xx.meminfo, ((1, 2), (3, 4)))
+        self.assertEquals(xx.getLoadAverage(5), 6.0)
+        self.assertEquals(xx.mounts[m.chrootMount].avail, '9')
+        self.assertEquals(xx.cpus, m.cpus)
+        self.assertEquals(sorted(m.getStatus()), sorted(status))
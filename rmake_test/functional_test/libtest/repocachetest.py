@@ -162,3 +162,64 @@ class RepositoryCacheTest(rmakehelp.RmakeHelper):
         yy = store.resolveDependenciesByGroups(repos, [foo, bar, bam],
                                                [dep, dep2])
         assert(xx == yy)
+
+    def testParallelFetch(self):
+        troves = []
+        for idx in range(6):
+            name = 'foo%d:runtime' % idx
+            troves.append(self.addComponent(name, '1', '',
+                                        [('/foo%d' % idx, 'contents%d\n' % idx)]))
+        troveTups = [ x.getNameVersionFlavor() for x in troves ]
+        cacheDir = self.workDir + '/cache'
+        util.mkdirChain(cacheDir)
+        repos = self.openRepository()
+        store = repocache.RepositoryCache(cacheDir, fetchThreads=3)
+        csList = store.getChangeSetsForTroves(repos, troveTups)
+        # results come back in request order regardless of which fetch
+        # finished first.
+        for cs, troveTup in zip(csList, troveTups):
+            assert([ x.getNewNameVersionFlavor()
+                     for x in cs.iterNewTroveList() ] == [troveTup])
+
+        # everything was stored, so a second lookup doesn't need the
+        # repository at all.
+        store = repocache.RepositoryCache(cacheDir, fetchThreads=3)
+        csList = store.getChangeSetsForTroves(None, troveTups)
+        assert(len(csList) == len(troveTups))
+        assert(None not in csList)
+
+    def testLimits(self):
+        troves = []
+        for idx in range(4):
+            name = 'foo%d:runtime' % idx
+            troves.append(self.addComponent(name, '1', '',
+                                    [('/foo%d' % idx, 'contents%d\n' % idx)]))
+        troveTups = [ x.getNameVersionFlavor() for x in troves ]
+        cacheDir = self.workDir + '/cache'
+        util.mkdirChain(cacheDir)
+        repos = self.openRepository()
+
+        store = repocache.RepositoryCache(cacheDir, useIndex=True)
+        store.getChangeSetsForTroves(repos, troveTups[:2])
+        store.getChangeSetsForTroves(repos, troveTups[:1])
+        stats = store.getStats()
+        self.assertEquals((stats.entries, stats.hits, stats.misses,
+                           stats.evictions), (2, 1, 2, 0))
+        assert(stats.bytes > 0)
+
+        # a cache without the option still maintains an existing index
+        store = repocache.RepositoryCache(cacheDir)
+        store.getChangeSetsForTroves(repos, troveTups[2:3])
+        self.assertEquals(store.getStats().entries, 3)
+
+        self.mock(repocache.CacheIndex, 'gracePeriod', -1)
+        store = repocache.RepositoryCache(cacheDir, entryLimit=3)
+        store.getChangeSetsForTroves(repos, troveTups[3:])
+        stats = store.getStats()
+        # pruned down below the limit
+        self.assertEquals((stats.entries, stats.evictions), (2, 2))
+        present = [ x for x in troveTups
+                    if store.store.hasFile(store.hashTrove(withFiles=True,
+                                                           withFileContents=True,
+                                                           *x)) ]
+        self.assertEquals(len(present), 2)
@@ -330,3 +330,44 @@ class EnvelopeTest(rmakehelp.RmakeHelper):
         assert(outStream1.read() == data)
         outStream2.seek(0)
         assert(outStream2.read() == data)
+
+    def testProcessorCoalescedWrites(self):
+        from rmake.messagebus import messageprocessor
+        from rmake.messagebus import messages
+        class Socket(object):
+            maxSend = None
+            def __init__(self):
+                self.sent = []
+            def send(self, data):
+                if isinstance(data, memoryview):
+                    data = data.tobytes()
+                data = data[:self.maxSend]
+                self.sent.append(data)
+                return len(data)
+
+        processor = messageprocessor.MessageProcessor()
+        for idx in range(10):
+            processor.sendMessage(messages.MethodCall('foo', 'bar', (idx,)))
+        sock = Socket()
+        processor.sendData(sock)
+        # all queued envelopes go out in one write
+        self.failUnlessEqual(len(sock.sent), 1)
+        self.failIf(processor.hasData())
+        data = sock.sent[0]
+
+        # partial writes pick up where they left off
+        for idx in range(10):
+            processor.sendMessage(messages.MethodCall('foo', 'bar', (idx,)))
+        sock = Socket()
+        sock.maxSend = 7
+        while processor.hasData():
+            processor.sendData(sock)
+        self.failUnlessEqual(''.join(sock.sent), data)
+        self.failUnlessEqual(len(sock.sent), (len(data) + 6) // 7)
+
+        stream = StringIO.StringIO(data)
+        for idx in range(10):
+            e = envelope.Envelope()
+            assert(e.thawFromStream(stream.read, blocking=True))
+            m = processor.extractMessage(e)
+            self.failUnlessEqual(m.getParams(), [idx])
@@ -153,3 +153,157 @@ class MessageBusTest(rmakehelp.RmakeHelper):
         assert(isinstance(m, messages.NodeStatus))
         assert(m.getStatus() == 'RECONNECTED')
         assert(m.getStatusId() == client.getSessionId())
+
+    def testPollers(self):
+        from rmake.messagebus import poller
+        from rmake_test import busload
+        for name in poller.getPollerNames():
+            results = busload.runLoad(3, 20, poller=name, burstSize=5,
+                                      workDir=self.workDir)
+            self.assertEquals(results['deliveries'], 60)
+        self.assertRaises(ValueError, messagebus.MessageBus, '', 0,
+                          self.workDir + '/messagebus.log', poller='bogus')
+
+    def testSubscriptionManager(self):
+        class Session(object):
+            def __init__(self, sessionId):
+                self.sessionId = sessionId
+        class MyMessage(messages.Message):
+            messageType = 'MINE'
+
+            def set(self, **params):
+                self.updateHeaders(params)
+        def route(destination, targetId=None, **headers):
+            m = MyMessage(**headers)
+            m.direct(destination, targetId)
+            return [x.sessionId for x in mgr.iterSubscribers(m)]
+
+        mgr = messagebus.SubscriptionManager()
+        one, two, three = Session('one'), Session('two'), Session('three')
+        mgr.addSubscriber('/event?jobId=1', one)
+        mgr.addSubscriber('/event', two)
+        mgr.addSubscriber('/event?jobId=2', three)
+        mgr.addSubscriber('/event?jobId=1;node=a', three)
+        mgr.addSubscriber('/other', one)
+
+        self.assertEquals(route('/event', jobId='1'), ['one', 'two'])
+        self.assertEquals(route('/event', jobId='1', node='a'),
+                          ['one', 'two', 'three'])
+        self.assertEquals(route('/event', jobId='2', node='a'),
+                          ['two', 'three'])
+        self.assertEquals(route('/event'), ['two'])
+        self.assertEquals(route('/event', 'one', jobId='1'), ['one'])
+        self.assertEquals(route('/other'), ['one'])
+        self.assertEquals(route('/nothing'), [])
+
+        mgr.deleteSubscriber(three)
+        self.assertEquals(route('/event', jobId='1', node='a'),
+                          ['one', 'two'])
+        self.assertEquals(route('/event', jobId='2'), ['two'])
+        mgr.deleteSubscriber(one)
+        mgr.deleteSubscriber(two)
+        self.assertEquals(mgr._channels, {})
+        self.assertEquals(mgr._sessions, {})
+
+    def testQueueLimits(self):
+        from rmake.messagebus import messageprocessor
+        class Session(object):
+            def __init__(self, queueLimit):
+                self.messageProcessor = messageprocessor.MessageProcessor()
+                self.queueLimit = queueLimit
+                self.droppedMessages = self.coalescedMessages = 0
+        class StateMessage(messages.Message):
+            messageType = 'NODE_INFO'
+        class EventMessage(messages.Message):
+            messageType = 'EVENT'
+        def queue(session, m, sender):
+            m.stamp('%s:%s' % (sender, queue.count), sender, queue.count)
+            queue.count += 1
+            session.messageProcessor.sendMessage(m)
+            if session.queueLimit.isExceeded(session):
+                return session.queueLimit.enforce(session)
+            return True
+        queue.count = 0
+        def queued(session):
+            return [x[2].messageId
+                    for x in session.messageProcessor.getQueuedMessages()]
+
+        # drop-oldest never drops method calls.
+        QueueLimit = messagebus.QueueLimit
+        session = Session(QueueLimit(QueueLimit.DROP_OLDEST, 10))
+        assert(queue(session, messages.MethodCall('target', 'ping', []), 'rpc'))
+        for idx in range(10):
+            assert(queue(session, EventMessage(), 'ev'))
+        self.assertEquals(queued(session)[:3], ['rpc:0', 'ev:3', 'ev:4'])
+        self.assertEquals(len(queued(session)), 9)
+        self.assertEquals(session.droppedMessages, 2)
+        processor = session.messageProcessor
+        self.assertEquals(processor.getQueuedBytes(),
+                          sum(x[1] for x in processor.getQueuedMessages()))
+
+        # coalesce keeps only the latest state from each sender.
+        session = Session(QueueLimit(QueueLimit.COALESCE, 4))
+        for idx in range(3):
+            assert(queue(session, StateMessage(), 'a'))
+            assert(queue(session, StateMessage(), 'b'))
+        self.assertEquals(queued(session), ['b:14', 'a:15', 'b:16'])
+        self.assertEquals(session.coalescedMessages, 3)
+        self.assertEquals(session.droppedMessages, 0)
+
+        # disconnect, and too many undroppable messages for drop-oldest.
+        session = Session(QueueLimit(QueueLimit.DISCONNECT, 0, 1))
+        assert(not queue(session, EventMessage(), 'ev'))
+        session = Session(QueueLimit(QueueLimit.DROP_OLDEST, 1))
+        assert(queue(session, messages.MethodCall('target', 'ping', []), 'rpc'))
+        assert(queue(session, EventMessage(), 'ev'))
+        self.assertEquals(queued(session), ['rpc:18'])
+        assert(not queue(session, messages.MethodCall('target', 'ping', []), 'rpc'))
+
+        sessionClass, limit = messagebus.parseQueueLimit(
+                                                'WORKER=coalesce,5,1024')
+        self.assertEquals(sessionClass, 'WORKER')
+        self.assertEquals((limit.policy, limit.maxMessages, limit.maxBytes),
+                          ('coalesce', 5, 1024))
+        self.assertRaises(ValueError, messagebus.parseQueueLimit, 'CLI=bad')
+
+    def testMessageLogging(self):
+        import logging
+        from rmake.messagebus import logger
+        class MyMessage(messages.Message):
+            messageType = 'MINE'
+
+            def set(self, **params):
+                self.updateHeaders(params)
+        messagePath = self.workDir + '/messages.log'
+        log = logger.MessageBusLogger('messagebus-logtest',
+                                      self.workDir + '/messagebus.log')
+        log.disableConsole()
+        log.setTraceSize(3)
+        log.setSampleRate('MINE', 0.5)
+
+        # nothing but the trace is kept until a transcript is requested.
+        log.logMessage(MyMessage())
+        log.logMessagesToFile(messagePath)
+        for idx in range(4):
+            m = MyMessage(a=str(idx))
+            m.stamp('sender:%d' % idx, 'sender', idx)
+            m.direct('/foo')
+            log.logMessage(m)
+        lines = open(messagePath).read().splitlines()
+        self.assertEquals(len(lines), 2)
+        assert(lines[0].endswith('Received MINE sender:1 from sender '
+                                 'to /foo (%d bytes)'
+                                 % m.getPayloadStreamSize()))
+        self.assertEquals([x[2] for x in log.getTrace()],
+                          ['sender:1', 'sender:2', 'sender:3'])
+
+        # debug logs the whole message
+        log.messageLogger.setLevel(logging.DEBUG)
+        log.setSampleRate('MINE', 1)
+        log.logMessage(m)
+        txt = open(messagePath).read()
+        assert('Received Message:\n' in txt)
+        assert('    a: 3\n' in txt)
+        log.setTraceSize(0)
+        self.assertEquals(log.getTrace(), [])
+        log.close()
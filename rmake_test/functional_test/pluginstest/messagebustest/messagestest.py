@@ -37,3 +37,137 @@ class MessagesTest(rmakehelp.RmakeHelper):
         m2.loadPayloadFromString(payloadStream.read(payloadSize))
         assert(m2.payload.a == 3)
         assert(m2.payload.b == 4)
+
+    def testBinaryPayload(self):
+        from rmake.messagebus import codec
+        m = messages.MethodCall('WORKER-foo:1', 'commandErrored',
+                                (['cmd-1', u'error'], {'a': (1, 2.5)}, None))
+        headers, payloadStream, payloadSize = m.freeze(codec.BinaryCodec.name)
+        frz = payloadStream.read(payloadSize)
+        assert(frz.startswith(codec.BinaryCodec.magic))
+        m2 = messages.thawMessage(headers, payloadStream, payloadSize,
+                                  codec.BinaryCodec.name)
+        # decodes the same way the xml encoding would have.
+        self.assertEquals(m2.getParams(),
+                          [['cmd-1', 'error'], {'a': [1, 2.5]}, None])
+
+        # forwarding to a session that did not negotiate the binary
+        # format re-encodes the payload, once.
+        headers, xmlStream, xmlSize = m2.freeze(codec.XmlCodec.name)
+        self.assertEquals(codec.detect(xmlStream.read(xmlSize)), 'xml')
+        assert(m2.freeze(codec.XmlCodec.name)[1] is xmlStream)
+        m3 = messages.thawMessage(headers, xmlStream, xmlSize)
+        self.assertEquals(m3.getParams(), m2.getParams())
+
+        # payloads the binary codec can't carry fall back to xml
+        import xmlrpclib
+        m = messages.MethodCall('WORKER-foo:1', 'method',
+                                (xmlrpclib.Binary('\0'),))
+        headers, payloadStream, payloadSize = m.freeze(codec.BinaryCodec.name)
+        self.assertEquals(codec.detect(payloadStream.read(payloadSize)), 'xml')
+
+        # and so do integers XML-RPC can't represent, so the bus never has
+        # to re-encode them for sessions using xml
+        for value in (2 ** 31, -2 ** 31 - 1, 1L << 40):
+            self.assertRaises(TypeError, codec.BinaryCodec.dumps, [value])
+            m = messages.MethodCall('WORKER-foo:1', 'method', (value,))
+            self.assertRaises(OverflowError, m.freeze,
+                              codec.BinaryCodec.name)
+        self.assertEquals(codec.BinaryCodec.loads(
+                codec.BinaryCodec.dumps([2 ** 31 - 1, -2 ** 31, 5L])),
+                [2 ** 31 - 1, -2 ** 31, 5L])
+
+    def testBinaryPayloadRejected(self):
+        import marshal
+        from rmake.messagebus import codec
+        m = messages.MethodCall('WORKER-foo:1', 'method', ([1, 'a'],))
+        headers, payloadStream, payloadSize = m.freeze(codec.BinaryCodec.name)
+        # only sessions that negotiated the binary format may send it
+        m2 = messages.thawMessage(headers, payloadStream, payloadSize)
+        self.assertRaises(ValueError, m2.getParams)
+
+        code = compile('1', '<payload>', 'eval')
+        for data in (code, (1, 2), {1: 'a'}, [set([1])], {'a': [1j]},
+                     [2 ** 31], {'a': -2 ** 40}):
+            frz = codec.BinaryCodec.magic + marshal.dumps(data)
+            self.assertRaises(ValueError, codec.loads, frz,
+                              codec.BinaryCodec.name)
+            self.assertRaises(ValueError, codec.loads, frz)
+        self.assertRaises(ValueError, codec.loads,
+                          codec.BinaryCodec.magic + 'junk', 'bin1')
+
+    def testBuildLogData(self):
+        from rmake.messagebus import codec
+        from rmake.multinode import messages as mnmessages
+        troveTuple = self.makeTroveTuple('simple:source') + ('x86',)
+        data = 'building\x1b[0m\x00\xff\n'
+        for payloadFormat in (codec.XmlCodec.name, codec.BinaryCodec.name):
+            m = mnmessages.BuildLogData(3, troveTuple, 1 << 40, data, True)
+            headers, payloadStream, payloadSize = m.freeze(payloadFormat)
+            m2 = messages.thawMessage(headers, payloadStream, payloadSize,
+                                      payloadFormat)
+            self.assertEquals(m2.getData(), data)
+            self.assertEquals(m2.getTroveTuple(), troveTuple)
+            self.assertEquals(m2.getOffset(), 1 << 40)
+            self.assertEquals(m2.getJobId(), 3)
+            assert(m2.isFinal())
+            # the bus re-encodes for sessions using the other format
+            other = [x for x in codec.PREFERENCE if x != payloadFormat][0]
+            headers, payloadStream, payloadSize = m2.freeze(other)
+            m3 = messages.thawMessage(headers, payloadStream, payloadSize,
+                                      other)
+            self.assertEquals(m3.getData(), data)
+
+        m = mnmessages.BuildLogRequest(3, troveTuple, -100, follow=False)
+        m2 = messages.thawMessage(*m.freeze())
+        self.assertEquals((m2.getJobId(), m2.getTroveTuple(), m2.getMark(),
+                           m2.isFollow()), (3, troveTuple, -100, False))
+
+    def testNodeInfo(self):
+        from rmake.messagebus import codec
+        from rmake.multinode import messages as mnmessages
+        status = dict(meminfo=((1, 2), (3, 4)), loadavg=(0.5, 0.5, 0.5),
+                      uptime=10.0, chrootAvail='1024')
+        for payloadFormat in (codec.XmlCodec.name, codec.BinaryCodec.name):
+            m = mnmessages.NodeInfo(status, ['CMD-1'])
+            headers, payloadStream, payloadSize = m.freeze(payloadFormat)
+            m2 = messages.thawMessage(headers, payloadStream, payloadSize,
+                                      payloadFormat)
+            self.assertEquals(m2.getStatus()['chrootAvail'], '1024')
+            self.assertEquals(m2.getCommands(), ['CMD-1'])
+            self.assertEquals(m2.getNodeInfo(), None)
+
+    def testNegotiatePayloadFormat(self):
+        from rmake.messagebus import codec
+        self.assertEquals(codec.negotiate(''), 'xml')
+        self.assertEquals(codec.negotiate('xml'), 'xml')
+        self.assertEquals(codec.negotiate('bin9 xml'), 'xml')
+        self.assertEquals(codec.negotiate('xml bin1'), 'bin1')
+
+        m = messages.ConnectionRequest()
+        m.set('user', 'pass', 'WORKER', payloadFormats=codec.PREFERENCE)
+        self.assertEquals(m.getPayloadFormats(), 'bin1 xml')
+        m = messages.ConnectionRequest()
+        m.set('user', 'pass', 'WORKER')
+        self.assertEquals(m.getPayloadFormats(), '')
+
+        m = messages.ConnectedResponse()
+        m.set('WORKER-foo:1')
+        self.assertEquals(m.getPayloadFormat(), 'xml')
+        m.set('WORKER-foo:1', 'bin1')
+        self.assertEquals(m.getPayloadFormat(), 'bin1')
+
+    def testCodecRoundTrip(self):
+        # both codecs decode a typical event list identically; timings
+        # are in rmake_test/codecbench.py.
+        from rmake.messagebus import codec
+        events = [(('TROVE_STATE_UPDATED', 'job-%d' % x),
+                   [(x, ['foo:source', '/localhost@rpl:linux//1.0-1', ''],
+                     4, 'Trove building on node %d' % x)])
+                  for x in range(50)]
+        payload = {'eventList': events}
+        self.assertEquals(codec.BinaryCodec.loads(
+                              codec.BinaryCodec.dumps(payload)),
+                          codec.XmlCodec.loads(codec.XmlCodec.dumps(payload)))
+        self.assertEquals(codec.loads(codec.dumps(payload, 'bin1'), 'bin1'),
+                          codec.loads(codec.dumps(payload)))
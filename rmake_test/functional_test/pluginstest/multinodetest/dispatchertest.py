@@ -88,7 +88,7 @@ class DispatcherTest(rmakehelp.RmakeHelper):
 
     def makeRegisterNodeMessage(self, slots=1, jobTypes=None,
                                 buildFlavors=None, loadThreshold=10,
-                                loadavg=0.5, chrootLimit=4):
+                                loadavg=0.5, chrootLimit=4, lightSlots=0):
         if jobTypes is None:
             jobTypes = self.getNodeCfg().jobTypes
         if buildFlavors is None:
@@ -100,7 +100,7 @@ class DispatcherTest(rmakehelp.RmakeHelper):
         nodeInfo.loadavg = (loadavg, loadavg, loadavg)
         node = nodetypes.WorkerNode('name', 'localhost', slots, jobTypes, 
                                     buildFlavors, loadThreshold, nodeInfo, [],
-                                    chrootLimit)
+                                    chrootLimit, lightSlots=lightSlots)
         return mnmessages.RegisterNodeMessage(node)
 
     def _check(self, sessionClient, messageType, **headerValues):
@@ -359,3 +359,102 @@ class DispatcherTest(rmakehelp.RmakeHelper):
         server.commandCompleted(cmd3.getCommandId())
         self.assertEquals(sorted(server.listAssignedCommands()),
                           [ ('CMD-2', 'session1'), ('CMD-4', 'session1')])
+
+    def testNodeIndex(self):
+        db = mock.MockObject()
+        self.rmakeCfg.messageBusPort = None
+        server = dispatcher.DispatcherServer(self.rmakeCfg, db)
+        mock.mock(server, 'client')
+        nodes = server._nodes
+        x86 = [parseFlavor('is:x86')]
+        x86_64 = [parseFlavor('is:x86_64')]
+        node1 = self.makeRegisterNodeMessage(buildFlavors=['is:x86'],
+                                             slots=2).getNode()
+        server.nodeRegistered('session1', node1)
+        assert(nodes.getNodeForFlavors(x86) is node1)
+        assert(not nodes.getNodeForFlavors(x86_64))
+
+        # remembered capabilities include nodes that register later
+        node2 = self.makeRegisterNodeMessage(buildFlavors=['is:x86 x86_64'],
+                                             loadavg=2).getNode()
+        server.nodeRegistered('session2', node2)
+        assert(nodes.getNodeForFlavors(x86_64) is node2)
+        # both are idle, so the less loaded node is picked...
+        assert(nodes.getNodeForFlavors(x86) is node1)
+        # ...until it has a command to work on
+        cmd1 = self.makeCommandMessage(1, 1, self.getNVF('foo:source'))
+        server.requestCommandAssignment(cmd1)
+        self.assertEquals(server.listAssignedCommands(),
+                          [ ('CMD-1', 'session1') ])
+        assert(nodes.getNodeForFlavors(x86) is node2)
+        # or a heartbeat says the other one is overloaded
+        server.nodeUpdated('session2', self.makeMachineInfo(loadavg=20), [])
+        assert(nodes.getNodeForFlavors(x86) is node1)
+        server.nodeUpdated('session2', self.makeMachineInfo(loadavg=0), [])
+        assert(nodes.getNodeForFlavors(x86) is node2)
+
+        server.nodeDisconnected('session2')
+        assert(not nodes.getNodeForFlavors(x86_64))
+        assert(nodes.getNodeForFlavors(x86) is node1)
+
+    def testLightSlots(self):
+        db = mock.MockObject()
+        self.rmakeCfg.messageBusPort = None
+        server = dispatcher.DispatcherServer(self.rmakeCfg, db)
+        mock.mock(server, 'client')
+        node = self.makeRegisterNodeMessage(slots=1, lightSlots=1).getNode()
+        server.nodeRegistered('session1', node)
+        cmd1 = self.makeCommandMessage(1, 1, self.getNVF('foo:source'))
+        cmd2 = self.makeResolveMessage(2, 1, self.getNVF('bar:source'))
+        cmd3 = self.makeResolveMessage(3, 2, self.getNVF('baz:source'))
+        cmd4 = self.makeCommandMessage(4, 2, self.getNVF('bam:source'))
+        server.requestCommandAssignment(cmd1, cmd2, cmd3, cmd4)
+        # the build uses the only slot, one resolve gets the light slot
+        self.assertEquals(sorted(server.listAssignedCommands()),
+                          [ ('CMD-1', 'session1'), ('CMD-2', 'session1') ])
+        # a free light slot goes to the waiting resolve...
+        server.commandCompleted(cmd2.getCommandId())
+        self.assertEquals(sorted(server.listAssignedCommands()),
+                          [ ('CMD-1', 'session1'), ('CMD-3', 'session1') ])
+        # ...and a free slot to the waiting build
+        server.commandCompleted(cmd1.getCommandId())
+        self.assertEquals(sorted(server.listAssignedCommands()),
+                          [ ('CMD-3', 'session1'), ('CMD-4', 'session1') ])
+        server.commandCompleted(cmd3.getCommandId())
+        server.commandCompleted(cmd4.getCommandId())
+        self.assertEquals(server._nodes._usedSlots, {'session1' : 0})
+        self.assertEquals(server._nodes._usedLightSlots, {'session1' : 0})
+
+    def testChrootLocality(self):
+        from rmake.lib import bloomfilter
+        from rmake.lib.trovekey import getTroveKey
+        db = mock.MockObject()
+        self.rmakeCfg.messageBusPort = None
+        server = dispatcher.DispatcherServer(self.rmakeCfg, db)
+        mock.mock(server, 'client')
+        node1 = self.makeRegisterNodeMessage(slots=2).getNode()
+        node2 = self.makeRegisterNodeMessage(slots=2, loadavg=2).getNode()
+        server.nodeRegistered('session1', node1)
+        server.nodeRegistered('session2', node2)
+        buildReqs = []
+        for name in ('foo:runtime', 'bar:runtime', 'baz:runtime'):
+            n, v, f = self.getNVF(name, flavor='is:x86')
+            buildReqs.append((n, (None, None), (v, f), True))
+        keys = [ getTroveKey(x) for x in buildReqs ]
+        # the more loaded node has most of the build requirements cached
+        summary = dict(cache=bloomfilter.BloomFilter.fromKeys(keys[:2]))
+        server.nodeUpdated('session2', None, [], chrootSummary=summary)
+
+        cmd1 = self.makeCommandMessage(1, 1, self.getNVF('foo:source'),
+                                       buildReqs=buildReqs)
+        server.requestCommandAssignment(cmd1)
+        self.assertEquals(server.listAssignedCommands(),
+                          [ ('CMD-1', 'session2') ])
+        self.assertEquals(server.getLocalityStats(),
+                          dict(commands=1, troves=3, warmTroves=2,
+                               baselineWarmTroves=0))
+        # without anything to go by, the least loaded node is used
+        cmd2 = self.makeCommandMessage(2, 1, self.getNVF('bar:source'))
+        server.requestCommandAssignment(cmd2)
+        self.assertEquals(sorted(server.listAssignedCommands()),
+                          [ ('CMD-1', 'session2'), ('CMD-2', 'session1') ])
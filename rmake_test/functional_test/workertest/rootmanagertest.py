@@ -191,3 +191,42 @@ class SimpleGroup(GroupRecipe):
         factory.clean()
         assert(factory.root != '/tmp/rmake')
         assert(not os.path.exists('/tmp/rmake/builds/group-foo'))
+
+    def testChrootSummary(self):
+        from rmake.worker.chroot.rootmanifest import ChrootManifest
+        self.rmakeCfg.chrootCache = ('local', self.workDir + '/chrootcache')
+        mgr = rootmanager.ChrootManager(self.rmakeCfg)
+        self.assertEquals(mgr.getChrootSummary(), {})
+
+        cache = mgr.chrootCache
+        util.mkdirChain(cache.cacheDir)
+        path = cache._fingerPrintToPath('a' * 20)
+        open(path, 'w').close()
+        ChrootManifest([], [], [], [], troves=['foo=1', 'bar=1']).write(
+                                                            self.workDir)
+        ChrootManifest.store(self.workDir, path)
+        oldRoot = mgr.baseDir + '/old'
+        util.mkdirChain(oldRoot)
+        ChrootManifest([], [], [], [], troves=['baz=1']).write(oldRoot)
+
+        summary = mgr.getChrootSummary()
+        self.assertEquals(sorted(summary), ['cache', 'chroots'])
+        assert('foo=1' in summary['cache'])
+        assert('bar=1' in summary['cache'])
+        assert('baz=1' in summary['chroots'])
+        assert('baz=1' not in summary['cache'])
+
+        # chroots in use are not summarized
+        mgr.queue.chrootStatus[oldRoot] = mgr.queue.CHROOT_ACTIVE
+        self.assertEquals(sorted(mgr.getChrootSummary()), ['cache'])
+
+        # heartbeats only carry the summary when it changes
+        self.assertEquals(mgr.getChrootSummary(changedOnly=True), None)
+        del mgr.queue.chrootStatus[oldRoot]
+        self.assertEquals(sorted(mgr.getChrootSummary(changedOnly=True)),
+                          ['cache', 'chroots'])
+        self.assertEquals(mgr.getChrootSummary(changedOnly=True), None)
+        ChrootManifest([], [], [], [], troves=['baz=2']).write(oldRoot)
+        os.utime(ChrootManifest.getPath(oldRoot), (0, 0))
+        summary = mgr.getChrootSummary(changedOnly=True)
+        assert('baz=2' in summary['chroots'])
@@ -28,6 +28,7 @@ from conary.repository import netclient
 from rmake.build import builder
 from rmake.build import buildtrove
 from rmake.lib import logger
+from rmake.worker import command
 from rmake.worker import worker
 
 from rmake_test import rmakehelp
@@ -42,6 +43,68 @@ class WorkerTest(rmakehelp.RmakeHelper):
         rc, txt = self.captureOutput(w.stopCommand, 'foo')
         assert(txt.endswith('warning: Asked to stop unknown command foo\n'))
 
+    def testCommandQueue(self):
+        w = worker.Worker(self.rmakeCfg, logger.Logger(), slots=2,
+                          lightSlots=1)
+        notReady = set(['BUILD-2'])
+        def runCommand(commandClass, cfg, commandId, jobId):
+            if commandId in notReady:
+                return False
+            # only the class and id of a running command matter here
+            cmd = commandClass.__new__(commandClass)
+            cmd.commandId = commandId
+            w.commands.append(cmd)
+            return cmd
+        w.runCommand = runCommand
+        def _queue(commandClass, commandId, jobId):
+            w.queueCommand(commandClass, self.rmakeCfg, commandId, jobId)
+        def _listQueued():
+            return [ x[2][0] for x in w.listQueuedCommands() ]
+        def _listRunning():
+            return [ x.getCommandId() for x in w.listCommands() ]
+        def _finish(commandId):
+            w.commands.remove(w.getCommandById(commandId))
+
+        _queue(command.BuildCommand, 'BUILD-1', 2)
+        _queue(command.BuildCommand, 'BUILD-2', 1)
+        _queue(command.BuildCommand, 'BUILD-3', 1)
+        _queue(command.ResolveCommand, 'RESOLVE-1', 3)
+        _queue(command.LoadCommand, 'LOAD-1', 2)
+        # resolve and load first, then by job
+        self.assertEquals(_listQueued(), ['LOAD-1', 'RESOLVE-1', 'BUILD-2',
+                                          'BUILD-3', 'BUILD-1'])
+        # all free slots are filled at once; the second resolve overflows
+        # into a regular slot, and a command that is not ready keeps its
+        # place in line
+        w._startQueuedCommands()
+        self.assertEquals(_listRunning(), ['LOAD-1', 'RESOLVE-1', 'BUILD-3'])
+        self.assertEquals(_listQueued(), ['BUILD-2', 'BUILD-1'])
+        notReady.clear()
+        _finish('RESOLVE-1')
+        w._startQueuedCommands()
+        self.assertEquals(_listRunning(), ['LOAD-1', 'BUILD-3', 'BUILD-2'])
+        self.assertEquals(_listQueued(), ['BUILD-1'])
+        # a new resolve goes ahead of the waiting build
+        _queue(command.ResolveCommand, 'RESOLVE-2', 3)
+        _finish('BUILD-3')
+        w._startQueuedCommands()
+        self.assertEquals(_listRunning(), ['LOAD-1', 'BUILD-2', 'RESOLVE-2'])
+        self.assertEquals(_listQueued(), ['BUILD-1'])
+        _finish('LOAD-1')
+        w._startQueuedCommands()
+        self.assertEquals(_listRunning(), ['BUILD-2', 'RESOLVE-2',
+                                           'BUILD-1'])
+        self.assertEquals(_listQueued(), [])
+        # commits have slots of their own
+        _queue(command.CommitCommand, 'COMMIT-1', 1)
+        _queue(command.CommitCommand, 'COMMIT-2', 1)
+        _queue(command.BuildCommand, 'BUILD-4', 1)
+        self.assertEquals(_listQueued(), ['COMMIT-1', 'COMMIT-2', 'BUILD-4'])
+        w._startQueuedCommands()
+        self.assertEquals(_listRunning(), ['BUILD-2', 'RESOLVE-2',
+                                           'BUILD-1', 'COMMIT-1'])
+        self.assertEquals(_listQueued(), ['COMMIT-2', 'BUILD-4'])
+
     def testBuildEmptyRecipe(self):
         trv = self.addComponent('empty:source=1',
                                 [('empty.recipe', emptyRecipe)])
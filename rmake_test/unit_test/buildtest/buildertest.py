@@ -15,6 +15,8 @@
 #
 
 
+import time
+
 from rmake_test import rmakehelp
 from testutils import mock
 
@@ -102,3 +104,44 @@ class BuilderTest(rmakehelp.RmakeHelper):
         worker.actOnTrove._mock.assertCalled(trv.getCommand(), trv.cfg, trv.jobId, trv, 
                                              builderObj.eventHandler, 
                                              builderObj.startTroveLogger(trv))
+
+    def testBuildWaitsForEvents(self):
+        builderObj = mock.MockInstance(builder.Builder)
+        dh = mock.MockObject()
+        worker = mock.MockObject()
+
+        dh.hasBuildableTroves._mock.setReturn(False)
+        dh.hasSpecialTroves._mock.setReturn(False)
+        dh.moreToDo._mock.setReturns([True, True, False])
+        dh.jobPassed._mock.setReturn(True)
+        worker._checkForResults._mock.setReturn(False)
+
+        builderObj._mock.set(dh=dh, worker=worker, idleTimeout=1.0, db=None)
+        builderObj._mock.enableMethod('build')
+        builderObj._mock.enableMethod('_flushDb')
+        builderObj.resolveIfReady._mock.setReturn(False)
+        builderObj.build()
+        # non-blocking check at the top of the loop, then a blocking
+        # wait since there was nothing to do.
+        worker.handleRequestIfReady._mock.assertCalled(0)
+        worker.handleRequestIfReady._mock.assertCalled(1.0)
+
+    def testDispatchLatency(self):
+        builderObj = mock.MockInstance(builder.Builder)
+        builderObj._mock.enableMethod('_recordDispatchLatency')
+        builderObj._mock.enableMethod('getDispatchLatency')
+        builderObj._mock.set(dispatchLatencies=[])
+        self.assertEquals(builderObj.getDispatchLatency(), (0, 0.0, 0.0))
+
+        trv = mock.MockObject()
+        builderObj.dh.getBuildableTime._mock.setReturn(None, trv)
+        builderObj._recordDispatchLatency(trv)
+        self.assertEquals(builderObj.dispatchLatencies, [])
+
+        mock.mock(time, 'time')
+        time.time._mock.setReturn(12.0)
+        builderObj.dh.getBuildableTime._mock.setReturn(10.0, trv)
+        builderObj._recordDispatchLatency(trv)
+        builderObj.dh.getBuildableTime._mock.setReturn(8.0, trv)
+        builderObj._recordDispatchLatency(trv)
+        self.assertEquals(builderObj.getDispatchLatency(), (2, 3.0, 4.0))
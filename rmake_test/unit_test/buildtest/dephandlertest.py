@@ -15,6 +15,8 @@
 #
 
 
+import random
+
 from testutils import mock
 
 from rmake_test import rmakehelp
@@ -44,3 +46,101 @@ class DephandlerTest(rmakehelp.RmakeHelper):
         assert(dh.hasSpecialTroves())
         assert(dh.popSpecialTrove() == it)
         assert(dh.specialTroves)
+
+    def _makeSyntheticGraph(self, numNodes, numEdges, seed=0):
+        rand = random.Random(seed)
+        depGraph = dephandler.DependencyGraph()
+        for node in range(numNodes):
+            depGraph.addNode(node)
+        for _ in range(numEdges):
+            fromNode = rand.randrange(numNodes)
+            # mostly point "down" so that we get a realistic mix of
+            # long chains and a few large cycles.
+            if rand.random() < 0.98:
+                toNode = rand.randrange(max(fromNode, 1))
+            else:
+                toNode = rand.randrange(numNodes)
+            if fromNode != toNode:
+                depGraph.addEdge(fromNode, toNode, (False, None))
+        return depGraph
+
+    def _getFullLeaves(self, depGraph):
+        return set(frozenset(x) for x in
+                   depGraph.getStronglyConnectedGraph().getLeaves())
+
+    def testLeafComponentsMatchFullTraversal(self):
+        depGraph = self._makeSyntheticGraph(200, 400)
+        rand = random.Random(1)
+        assert(set(depGraph.getLeafComponents())
+               == self._getFullLeaves(depGraph))
+        while not depGraph.isEmpty():
+            leaves = sorted(sorted(x) for x in depGraph.getLeafComponents())
+            component = leaves[0]
+            if len(component) > 1 and rand.random() < 0.5:
+                # break the cycle the way a cycle resolution does
+                depGraph.deleteEdges(component[0])
+            else:
+                depGraph.delete(component[0])
+            depGraph.addNode(-1)
+            depGraph.delete(-1)
+            assert(set(depGraph.getLeafComponents())
+                   == self._getFullLeaves(depGraph))
+
+    def testLeafComponentsCycleMerge(self):
+        class _Trove(object):
+            def __init__(self, name):
+                self.name = name
+            def getPrebuiltTime(self):
+                return 0
+            def __repr__(self):
+                return self.name
+
+        def _getHandler(depGraph, troves):
+            dh = mock.MockInstance(dephandler.DependencyHandler)
+            dh._mock.enableMethod('_getPrioritizedLeafCycles')
+            dh._mock.enableMethod('getPriority')
+            depState = mock.MockObject()
+            depState._mock.set(depGraph=depGraph)
+            dh._mock.set(depState=depState, priorities=troves,
+                         _prioritizedLeaves=(None, None))
+            return dh
+
+        troves = [ _Trove(x) for x in 'abcdefg' ]
+        a, b, c, d, e, f, g = troves
+        edges = [(a, b), (b, c), (d, e), (f, a), (g, f)]
+        depGraph = dephandler.DependencyGraph()
+        for fromNode, toNode in edges:
+            depGraph.addEdge(fromNode, toNode, (False, None))
+        dh = _getHandler(depGraph, troves)
+        self.assertEqual(dh._getPrioritizedLeafCycles(), [[c], [e]])
+
+        # c -> a merges a, b and c; e -> d merges two leaves; a -> f
+        # then pulls f into the first cycle.
+        for fromNode, toNode in [(c, a), (e, d), (a, f)]:
+            version = depGraph.leafVersion
+            depGraph.addEdge(fromNode, toNode, (False, None))
+            edges.append((fromNode, toNode))
+            # merged in place rather than recomputed
+            assert(not depGraph._componentsDirty)
+            self.assertNotEqual(depGraph.leafVersion, version)
+
+            fullGraph = dephandler.DependencyGraph()
+            for edge in edges:
+                fullGraph.addEdge(edge[0], edge[1], (False, None))
+            self.assertEqual(set(depGraph.getLeafComponents()),
+                             self._getFullLeaves(fullGraph))
+            self.assertEqual(dh._getPrioritizedLeafCycles(),
+                    _getHandler(fullGraph, troves)._getPrioritizedLeafCycles())
+        self.assertEqual(dh._getPrioritizedLeafCycles(),
+                         [[a, b, c, f], [d, e]])
+
+        # random edges closing cycles between existing components
+        depGraph = self._makeSyntheticGraph(200, 400)
+        rand = random.Random(2)
+        depGraph.getLeafComponents()
+        for _ in range(50):
+            fromNode = rand.randrange(200)
+            toNode = rand.randrange(fromNode, 200)
+            depGraph.addEdge(fromNode, toNode, (False, None))
+            assert(set(depGraph.getLeafComponents())
+                   == self._getFullLeaves(depGraph))
@@ -0,0 +1,127 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+import StringIO
+import time
+
+from rmake_test import rmakehelp
+from testutils import mock
+
+from rmake.cmdline import monitor
+
+
+class JobLogDisplayTest(rmakehelp.RmakeHelper):
+
+    def _getDisplay(self):
+        client = mock.MockObject()
+        logStream = mock.MockObject()
+        out = StringIO.StringIO()
+        display = monitor.JobLogDisplay(client, out=out)
+        display.setLogStream(logStream)
+        troveTup = self.makeTroveTuple('foo:source')
+        display._tailBuildLog(1, troveTup)
+        self.now = 1000.0
+        self.mock(time, 'time', lambda: self.now)
+        return display, client, logStream, out, troveTup
+
+    def _startStreaming(self, display, client, logStream, troveTup):
+        # Poll once to catch up; the display then asks for the rest to be
+        # pushed.
+        client.getTroveBuildLog._mock.setReturn((True, 'abc', 3),
+                                                1, troveTup, 0)
+        display._serveLoopHook()
+        client.getTroveBuildLog._mock.assertCalled(1, troveTup, 0)
+        logStream.followBuildLog._mock.assertCalled(1, troveTup, 3)
+
+    def testStreamedChunks(self):
+        display, client, logStream, out, troveTup = self._getDisplay()
+        self._startStreaming(display, client, logStream, troveTup)
+        key = 1, troveTup
+        display._buildLogReceived(1, troveTup, 3, 'def', False)
+        assert(display.streamingTroves[key] is True)
+        # Overlapping and duplicate chunks only add the bytes not yet seen.
+        display._buildLogReceived(1, troveTup, 4, 'efgh', False)
+        display._buildLogReceived(1, troveTup, 4, 'efgh', False)
+        self.assertEquals(display.buildingTroves[key][0], 8)
+        # A streamed trove is not polled.
+        self.now += 5
+        display._serveLoopHook()
+        client.getTroveBuildLog._mock.assertNotCalled()
+        display._buildLogReceived(1, troveTup, 8, 'ij', True)
+        assert(key not in display.buildingTroves)
+        assert(key not in display.streamingTroves)
+        assert(out.getvalue().endswith('abcdefghij'))
+
+    def testGapFill(self):
+        display, client, logStream, out, troveTup = self._getDisplay()
+        self._startStreaming(display, client, logStream, troveTup)
+        key = 1, troveTup
+        # Bytes 3-5 were lost; fetch them and whatever follows directly.
+        client.getTroveBuildLog._mock.setReturn((True, 'defgh', 8),
+                                                1, troveTup, 3)
+        display._buildLogReceived(1, troveTup, 6, 'gh', False)
+        client.getTroveBuildLog._mock.assertCalled(1, troveTup, 3)
+        self.assertEquals(display.buildingTroves[key][0], 8)
+        # The fetch reaching the end of the log finishes the trove even when
+        # the message that hit the gap wasn't the final one.
+        client.getTroveBuildLog._mock.setReturn((False, 'ij', 10),
+                                                1, troveTup, 8)
+        display._buildLogReceived(1, troveTup, 9, 'j', False)
+        assert(key not in display.buildingTroves)
+        assert(key not in display.streamingTroves)
+        assert(out.getvalue().endswith('abcdefghij'))
+
+    def testGapFillFailed(self):
+        display, client, logStream, out, troveTup = self._getDisplay()
+        self._startStreaming(display, client, logStream, troveTup)
+        key = 1, troveTup
+        client.getTroveBuildLog._mock.raiseErrorOnAccess(
+                                            RuntimeError('connection lost'))
+        # The last message hits a gap, and filling it fails.
+        display._buildLogReceived(1, troveTup, 6, 'ghij', True)
+        logStream.unfollowBuildLog._mock.assertCalled(1, troveTup)
+        assert(key not in display.streamingTroves)
+        self.assertEquals(display.buildingTroves[key][0], 3)
+        # The next poll picks up from the last byte written.
+        client.getTroveBuildLog._mock.setReturn((False, 'defghij', 10),
+                                                1, troveTup, 3)
+        self.now += 5
+        display._serveLoopHook()
+        client.getTroveBuildLog._mock.assertCalled(1, troveTup, 3)
+        assert(key not in display.buildingTroves)
+        assert(out.getvalue().endswith('abcdefghij'))
+
+    def testStreamTimeout(self):
+        display, client, logStream, out, troveTup = self._getDisplay()
+        self._startStreaming(display, client, logStream, troveTup)
+        key = 1, troveTup
+        # Nothing is pushed, so the display keeps waiting until
+        # logStreamTimeout has passed...
+        self.now += display.logStreamTimeout - 1
+        display._serveLoopHook()
+        client.getTroveBuildLog._mock.assertNotCalled()
+        # ...and then polls for the rest of the log.
+        self.now += 2
+        client.getTroveBuildLog._mock.setReturn((True, 'def', 6),
+                                                1, troveTup, 3)
+        display._serveLoopHook()
+        client.getTroveBuildLog._mock.assertCalled(1, troveTup, 3)
+        assert(display.streamingTroves[key] is False)
+        # Polling doesn't ask for the log to be pushed again.
+        logStream.followBuildLog._mock.assertNotCalled()
+        self.assertEquals(display.buildingTroves[key][0], 6)
+        assert(out.getvalue().endswith('abcdef'))
@@ -50,3 +50,33 @@ class JobStoreTest(rmakehelp.RmakeHelper):
         job.setBuildTroves(job.troves.values())
         newTrv = db.getTrove(job.jobId, *trv.getNameVersionFlavor())
         assert(newTrv.getImageBuildId() == 32)
+
+    def testTroveSettingsOnlyWrittenWhenChanged(self):
+        db = self.openRmakeDatabase()
+        job = buildjob.BuildJob()
+        trv = imagetrove.ImageTrove(None, *self.makeTroveTuple('group-foo'))
+        trv.setProductName('product')
+        job.addBuildTrove(trv)
+        job.setMainConfig(self.buildCfg)
+        db.addJob(job)
+
+        written = []
+        getRows = db.jobStore._getTroveSettingsRows
+        def _getTroveSettingsRows(jobId, troveId, settings):
+            written.append(settings)
+            return getRows(jobId, troveId, settings)
+        self.mock(db.jobStore, '_getTroveSettingsRows', _getTroveSettingsRows)
+
+        trv.status = 'new status'
+        db.updateTrove(trv)
+        assert(not written)
+        assert(db.getTrove(job.jobId, *trv.getNameVersionFlavor()).status
+                == 'new status')
+
+        trv.setImageBuildId(31)
+        db.updateTrove(trv)
+        db.updateTrove(trv)
+        assert(len(written) == 1)
+        newTrv = db.getTrove(job.jobId, *trv.getNameVersionFlavor())
+        assert(newTrv.getImageBuildId() == 31)
+        assert(newTrv.getProductName() == 'product')
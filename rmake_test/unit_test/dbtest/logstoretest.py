@@ -0,0 +1,98 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+import gzip
+import re
+
+from rmake_test import rmakehelp
+
+from rmake.db import logstore
+
+
+class LogStoreTest(rmakehelp.RmakeHelper):
+    def _writeLog(self, logStore, logHash, data, blockSize):
+        f = logStore.openForWriting(logHash)
+        f.write(data)
+        f.close()
+        logStore.compressLog(logHash, blockSize=blockSize)
+        logStore.removePlainLog(logHash)
+        return logStore._hashToPath(logHash)
+
+    def testIndexedLog(self):
+        logStore = logstore.LogStore(self.workDir + '/logs')
+        logHash = '1' * 40
+        data = ''.join('line %d\n' % x for x in range(1000))
+        path = self._writeLog(logStore, logHash, data, blockSize=100)
+
+        # still a valid gzip file
+        self.assertEquals(gzip.GzipFile(path + '.gz').read(), data)
+
+        f = logStore.openTroveLog(logHash)
+        assert(isinstance(f, logstore.IndexedLogReader))
+        self.assertEquals(f.read(), data)
+        f.seek(0, 2)
+        self.assertEquals(f.tell(), len(data))
+        f.seek(-250, 2)
+        self.assertEquals(f.read(), data[-250:])
+        self.assertEquals(f.read(), '')
+        for start, size in [(0, 10), (95, 10), (100, 100), (1234, 567)]:
+            f.seek(start)
+            self.assertEquals(f.read(size), data[start:start + size])
+            self.assertEquals(f.tell(), start + len(data[start:start + size]))
+        f.seek(len(data) + 10)
+        self.assertEquals(f.read(), '')
+        f.close()
+
+        # empty logs are indexed too
+        self._writeLog(logStore, '2' * 40, '', blockSize=100)
+        f = logStore.openTroveLog('2' * 40)
+        f.seek(0, 2)
+        self.assertEquals((f.tell(), f.read()), (0, ''))
+
+        # an index that does not match the log is ignored
+        open(path + '.gz.idx', 'ab').write('\0' * 16)
+        f = logStore.openTroveLog(logHash)
+        assert(isinstance(f, gzip.GzipFile))
+        self.assertEquals(f.read(), data)
+
+        logStore.deleteLogs([logHash])
+        self.assertRaises(KeyError, logStore.openTroveLog, logHash)
+
+    def testSearchLog(self):
+        logStore = logstore.LogStore(self.workDir + '/logs')
+        logHash = '1' * 40
+        data = ''.join('line %d\n' % x for x in range(1000))
+        self._writeLog(logStore, logHash, data, blockSize=100)
+
+        regex = re.compile('^line 5.5$', re.MULTILINE)
+        results = logStore.searchTroveLog(logHash, regex)
+        self.assertEquals(len(results), 10)
+        self.assertEquals(results[0], (506, data.index('line 505\n'),
+                                       'line 505\n', [506]))
+
+        # overlapping context is merged into one region
+        regex = re.compile('line 1[02]$', re.MULTILINE)
+        results = logStore.searchTroveLog(logHash, regex, context=1)
+        self.assertEquals(results, [(10, data.index('line 9\n'),
+                                     'line 9\nline 10\nline 11\nline 12\n'
+                                     'line 13\n', [11, 13])])
+
+        results = logStore.searchTroveLog(logHash, re.compile('line 99'),
+                                          maxMatches=3)
+        self.assertEquals([x[3] for x in results], [[100], [991, 992]])
+        self.assertEquals(logStore.searchTroveLog(logHash,
+                                                  re.compile('nomatch')), [])
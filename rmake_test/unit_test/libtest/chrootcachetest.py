@@ -21,6 +21,7 @@ from rmake.lib import chrootcache
 from rmake.lib import locking
 from rmake.worker.chroot.rootmanifest import ChrootManifest
 from conary.lib import util
+import cPickle
 import subprocess
 import os
 import tempfile
@@ -89,14 +90,143 @@ class LocalChrootCacheTest(rmakehelp.RmakeHelper):
         mock.replaceFunctionOnce(os.path, 'isfile', isfile)
         self.failUnless(not self.chrootCache.hasChroot('hash' * 5))
 
+    def testFindPartialMatch(self):
+        def store(fingerprint, jobs, bootstrap=()):
+            path = self.chrootCache._fingerPrintToPath(fingerprint)
+            open(path, 'w').close()
+            with open(path + ChrootManifest.AR_SUFFIX, 'w') as fobj:
+                cPickle.dump(ChrootManifest(jobs, bootstrap, [], []), fobj)
+            return path
+
+        util.mkdirChain(self.cacheDir)
+        # Stored before the index existed
+        store('a' * 20, ['job1'])
+        store('b' * 20, ['job1', 'job2'])
+        store('c' * 20, ['job1', 'job4'])
+        store('d' * 20, ['job1', 'job2'], bootstrap=['boot1'])
+        manifest = ChrootManifest(['job1', 'job2', 'job3'], [], [], [])
+        self.assertEqual(self.chrootCache.findPartialMatch(manifest),
+                'b' * 20)
+        self.failUnless(os.path.exists(self.cacheDir + '/manifests.db'))
+        self.assertEqual(
+                self.chrootCache._getManifestIndex().findMatches(manifest),
+                [(2, 'b' * 20), (1, 'a' * 20)])
+
+        # New entries are indexed by store()
+        path = store('e' * 20, ['job1', 'job2', 'job3'])
+        self.chrootCache._indexManifest('e' * 20)
+        self.assertEqual(self.chrootCache.findPartialMatch(manifest),
+                'e' * 20)
+
+        # and dropped by remove()
+        self.chrootCache.remove('e' * 20)
+        self.failIf(os.path.exists(path))
+        self.assertEqual(self.chrootCache.findPartialMatch(manifest),
+                'b' * 20)
+
+        # Entries deleted out from under the index are skipped
+        os.unlink(self.chrootCache._fingerPrintToPath('b' * 20))
+        self.assertEqual(self.chrootCache.findPartialMatch(manifest),
+                'a' * 20)
+        self.assertEqual(
+                self.chrootCache._getManifestIndex().findMatches(manifest),
+                [(1, 'a' * 20)])
+
+        manifest = ChrootManifest(['job1', 'job2'], ['boot1'], [], [])
+        self.assertEqual(self.chrootCache.findPartialMatch(manifest),
+                'd' * 20)
+        manifest = ChrootManifest(['job5'], [], [], [])
+        self.assertEqual(self.chrootCache.findPartialMatch(manifest), None)
+
     def test_fingerPrintToPath(self):
         path = self.chrootCache._fingerPrintToPath('hash' * 5)
         self.failUnlessEqual(path, self.cacheDir + '/6861736868617368686173686861736868617368.tar.gz')
 
 
+class ParallelChrootCacheTest(rmakehelp.RmakeHelper):
+    def testCommands(self):
+        for cacheType, suffix, compress, decompress in [
+                ('pigz', '.tar.gz', 'pigz -1 -c', 'pigz -dc'),
+                ('zstd', '.tar.zst', 'pzstd -1 -q -c', 'pzstd -dcq'),
+                ]:
+            cacheDir = self.workDir + '/chrootcache'
+            chrootCache = chrootcache.CACHE_TYPES[cacheType](cacheDir)
+            path = '%s/6861736868617368686173686861736868617368%s' % (
+                    cacheDir, suffix)
+            self.failUnlessEqual(chrootCache._fingerPrintToPath('hash' * 5),
+                    path)
+
+            def call(*args, **kw):
+                self.failUnlessEqual(args, ('tar -cC /some/dir . | %s > '
+                    '%s/6861736868617368686173686861736868617368.ABC123%s'
+                    % (compress, cacheDir, suffix),))
+            def mkstemp(*args, **kw):
+                return (os.open('/dev/null', os.O_WRONLY),
+                        '%s/6861736868617368686173686861736868617368.ABC123%s'
+                        % (cacheDir, suffix))
+            mock.replaceFunctionOnce(subprocess, 'call', call)
+            mock.replaceFunctionOnce(util, 'mkdirChain', lambda *a: None)
+            mock.replaceFunctionOnce(tempfile, 'mkstemp', mkstemp)
+            mock.replaceFunctionOnce(os, 'rename', lambda *a: None)
+            mock.mock(ChrootManifest, 'store')
+            mock.mock(locking, 'LockFile')
+            chrootCache.store('hash' * 5, '/some/dir')
+            mock.unmockAll()
+
+            # Restore streams straight into tar
+            def call(*args, **kw):
+                self.failUnlessEqual(args,
+                        ('%s %s | tar -xmC /some/dir' % (decompress, path),))
+                self.failUnless(kw == dict(shell=True))
+            mock.replaceFunctionOnce(subprocess, 'call', call)
+            chrootCache.restore('hash' * 5, '/some/dir')
+
+
 class ChrootCacheInterfaceTest(rmakehelp.RmakeHelper):
     def testChrootCacheInterface(self):
         intf = chrootcache.ChrootCacheInterface()
         self.failUnlessRaises(NotImplementedError, intf.store, 'foo', 'dir')
         self.failUnlessRaises(NotImplementedError, intf.restore, 'foo', 'dir')
         self.failUnlessRaises(NotImplementedError, intf.hasChroot, 'foo')
+
+
+class DedupChrootCacheTest(rmakehelp.RmakeHelper):
+    def _countObjects(self, cacheDir):
+        return sum(len(x[2]) for x in os.walk(cacheDir + '/objects'))
+
+    def testStoreRestore(self):
+        cacheDir = self.workDir + '/chrootcache'
+        chrootCache = chrootcache.DedupChrootCache(cacheDir)
+        for name in ('one', 'two'):
+            root = self.workDir + '/' + name
+            util.mkdirChain(root + '/usr/bin')
+            util.mkdirChain(root + '/etc')
+            self.writeFile(root + '/usr/bin/gcc', 'gcc\n')
+            # the mtime is part of the object key
+            os.utime(root + '/usr/bin/gcc', (1234567890, 1234567890))
+            self.writeFile(root + '/etc/hostname', name + '\n')
+            os.symlink('gcc', root + '/usr/bin/cc')
+            os.chmod(root + '/usr/bin', 0555)
+            ChrootManifest([name], [], [], []).write(root)
+            chrootCache.store(name * 4 + 'abcdefgh', root)
+        # gcc is only stored once
+        self.assertEqual(self._countObjects(cacheDir), 5)
+        self.failUnless(chrootCache.hasChroot('one' * 4 + 'abcdefgh'))
+
+        root = self.workDir + '/restored'
+        chrootCache.restore('one' * 4 + 'abcdefgh', root)
+        self.assertEqual(open(root + '/etc/hostname').read(), 'one\n')
+        self.assertEqual(os.readlink(root + '/usr/bin/cc'), 'gcc')
+        self.assertEqual(os.stat(root + '/usr/bin').st_mode & 0777, 0555)
+        self.assertEqual(os.stat(root + '/usr/bin/gcc').st_ino,
+                os.stat(self.workDir + '/one/usr/bin/gcc').st_ino)
+
+        chrootCache.remove('one' * 4 + 'abcdefgh')
+        self.failIf(chrootCache.hasChroot('one' * 4 + 'abcdefgh'))
+        chrootCache.collectGarbage()
+        self.assertEqual(self._countObjects(cacheDir), 3)
+        chrootCache.remove('two' * 4 + 'abcdefgh')
+        chrootCache.collectGarbage()
+        self.assertEqual(self._countObjects(cacheDir), 0)
+        for name in ('one', 'two', 'restored'):
+            os.chmod(self.workDir + '/' + name + '/usr/bin', 0755)
@@ -0,0 +1,188 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+import asyncore
+import gzip
+import os
+import socket
+
+from rmake_test import rmakehelp
+
+from rmake.db import logstore
+from rmake.server import log_server
+
+
+class LogServerTest(rmakehelp.RmakeHelper):
+    def _openLogServer(self, compressors, publish=None):
+        class Cfg(object):
+            logServerPort = 0
+        class Database(object):
+            logStore = logstore.LogStore(self.workDir + '/logs')
+        cfg = Cfg()
+        self.socketMap = {}
+        server = log_server.LogServer(cfg, Database(), map=self.socketMap,
+                                      compressors=compressors,
+                                      publish=publish)
+        return server, cfg.logServerPort
+
+    def _poll(self, check):
+        for idx in range(500):
+            asyncore.loop(timeout=0.01, map=self.socketMap, count=1)
+            if check():
+                return
+        self.fail('timed out waiting for the log server')
+
+    def _connect(self, server, port, logHash):
+        writers = server._writers.get(logHash, 0)
+        sock = socket.create_connection(('localhost', port))
+        auth = server.logStore.getLogAuth(logHash)
+        sock.sendall('%s %s test log\n' % (logHash, auth))
+        self._poll(lambda: server._writers.get(logHash, 0) > writers)
+        self.assertEquals(sock.recv(3), 'OK\n')
+        return sock
+
+    def _read(self, logStore, logHash):
+        f = logStore.openTroveLog(logHash)
+        data = f.read()
+        f.close()
+        return data
+
+    def testLogStreaming(self):
+        server, port = self._openLogServer(compressors=0)
+        logStore = server.logStore
+        hash1, hash2 = '1' * 40, '2' * 40
+        sock1 = self._connect(server, port, hash1)
+        sock2 = self._connect(server, port, hash2)
+        sock1.sendall('one\n')
+        sock2.sendall('two\n')
+        sock1.sendall('three\n')
+        self._poll(lambda: (self._read(logStore, hash1) == 'one\nthree\n'
+                            and self._read(logStore, hash2) == 'two\n'))
+        # both logs are written in this process and can be tailed
+        self.assertEquals(self._read(logStore, hash1), 'one\nthree\n')
+        self.assertEquals(self._read(logStore, hash2), 'two\n')
+        assert(not os.path.exists(logStore._hashToPath(hash1) + '.gz'))
+
+        sock1.close()
+        path = logStore._hashToPath(hash1)
+        self._poll(lambda: not os.path.exists(path))
+        assert(not os.path.exists(path))
+        self.assertEquals(gzip.GzipFile(path + '.gz').read(), 'one\nthree\n')
+        self.assertEquals(self._read(logStore, hash1), 'one\nthree\n')
+
+        # reopening a compressed log appends to it
+        sock1 = self._connect(server, port, hash1)
+        sock1.sendall('four\n')
+        sock1.close()
+        sock2.close()
+        self._poll(lambda: not server._writers)
+        self.assertEquals(self._read(logStore, hash1), 'one\nthree\nfour\n')
+        self.assertEquals(self._read(logStore, hash2), 'two\n')
+        assert(not os.path.exists(path))
+        server.close()
+
+    def testCompressorPool(self):
+        server, port = self._openLogServer(compressors=1)
+        logStore = server.logStore
+        hashes = ['1' * 40, '2' * 40]
+        for logHash in hashes:
+            sock = self._connect(server, port, logHash)
+            sock.sendall(logHash)
+            sock.close()
+            self._poll(lambda: logHash not in server._writers)
+        # only one log is compressed at a time
+        self.assertEquals(len(server._compressing), 1)
+        self.assertEquals(list(server._compressQueue), hashes[1:])
+        for logHash in hashes:
+            pid, = server._compressing
+            self.assertEquals(server._compressing[pid][0], logHash)
+            pid, status = os.waitpid(pid, 0)
+            assert(server.pidDied(pid, status))
+            path = logStore._hashToPath(logHash)
+            assert(not os.path.exists(path))
+            self.assertEquals(self._read(logStore, logHash), logHash)
+        self.assertEquals(server._compressing, {})
+        assert(not server.pidDied(-1, 0))
+        server.close()
+
+    def testFollowLog(self):
+        published = []
+        def publish(*args):
+            published.append(args)
+        server, port = self._openLogServer(compressors=0, publish=publish)
+        server.streamChunkSize = 4
+        logHash = '1' * 40
+        sock = self._connect(server, port, logHash)
+        sock.sendall('0123456789')
+        self._poll(lambda: server.logStore.getLogSize(logHash) == 10)
+
+        # catch up in chunks, then follow
+        server.follow('cli1', 'key', logHash, mark=3)
+        self.assertEquals(published, [('cli1', 'key', 3, '3456', False),
+                                      ('cli1', 'key', 7, '789', False)])
+        del published[:]
+        server.follow('cli2', 'key', logHash, mark=-2)
+        self.assertEquals(published, [('cli2', 'key', 8, '89', False)])
+        del published[:]
+        sock.sendall('abc')
+        self._poll(lambda: len(published) == 2)
+        self.assertEquals(sorted(published),
+                          [('cli1', 'key', 10, 'abc', False),
+                           ('cli2', 'key', 10, 'abc', False)])
+        del published[:]
+        server.unfollow('cli2')
+        sock.close()
+        self._poll(lambda: published)
+        self.assertEquals(published, [('cli1', 'key', 13, '', True)])
+        self.assertEquals(server._followers, {})
+
+        # a finished log is sent once, and not followed
+        del published[:]
+        server.follow('cli1', 'key', logHash, mark=11, isFinished=True)
+        self.assertEquals(published, [('cli1', 'key', 11, 'bc', True)])
+        self.assertEquals(server._followers, {})
+        server.close()
+
+    def testFollowSharedLog(self):
+        # offsets come from the log itself when several clients write to it
+        published = []
+        def publish(*args):
+            published.append(args)
+        server, port = self._openLogServer(compressors=0, publish=publish)
+        logHash = '1' * 40
+        sock1 = self._connect(server, port, logHash)
+        sock1.sendall('one\n')
+        self._poll(lambda: server.logStore.getLogSize(logHash) == 4)
+        sock2 = self._connect(server, port, logHash)
+        server.follow('cli1', 'key', logHash, mark=0)
+        for sock, data in [(sock2, 'two\n'), (sock1, 'three\n'),
+                           (sock2, 'four\n')]:
+            sock.sendall(data)
+            size = len(published)
+            self._poll(lambda: len(published) > size)
+        sock1.close()
+        sock2.close()
+        self._poll(lambda: published[-1][-1])
+        self.assertEquals(published,
+                          [('cli1', 'key', 0, 'one\n', False),
+                           ('cli1', 'key', 4, 'two\n', False),
+                           ('cli1', 'key', 8, 'three\n', False),
+                           ('cli1', 'key', 14, 'four\n', False),
+                           ('cli1', 'key', 19, '', True)])
+        self.assertEquals(self._read(server.logStore, logHash),
+                          'one\ntwo\nthree\nfour\n')
+        server.close()
@@ -15,6 +15,9 @@
 #
 
 
+import os
+import socket
+
 from rmake_test import rmakehelp
 from testutils import mock
 
@@ -75,3 +78,132 @@ class WorkerTest(rmakehelp.RmakeHelper):
         del w.runCommand._mock.calls[:]
         wlog.warning._mock.assertCalled('Command %s has no job or trove '
                 'assigned -- cannot fail job.', 'PANTS-4')
+
+    def testQueueCommit(self):
+        w = worker.Worker(self.rmakeCfg, log)
+        mock.mockMethod(w.queueCommand)
+        trv = self.newBuildTrove(1, *self.makeTroveTuple('foo:source'))
+        eventHandler = mock.MockObject()
+        buildCommand = mock.MockObject(jobId=1, eventHandler=eventHandler,
+                                       buildCfg=self.buildCfg,
+                                       getTrove=lambda: trv,
+                                       getCommitPath=lambda: '/tmp/foo.ccs')
+        w._queueCommit(buildCommand)
+        w.queueCommand._mock.assertCalled(w.commandClasses['commit'],
+                self.rmakeCfg, 'COMMIT-1-foo:source-1', 1, eventHandler,
+                self.buildCfg, trv, '/tmp/foo.ccs')
+
+    def testStopCommits(self):
+        w = worker.Worker(self.rmakeCfg, mock.MockObject())
+        mock.mockMethod(w.runCommand)
+        commitClass = w.commandClasses['commit']
+        troves = {}
+        for jobId in (1, 2):
+            trv = self.newBuildTrove(jobId,
+                                     *self.makeTroveTuple('foo:source'))
+            mock.mockMethod(trv.troveFailed)
+            troves[jobId] = trv
+            csPath = '%s/%s.ccs' % (self.workDir, jobId)
+            open(csPath, 'w').close()
+            w.queueCommand(commitClass, self.rmakeCfg, 'COMMIT-%s' % jobId,
+                           jobId, mock.MockObject(), self.buildCfg, trv,
+                           csPath)
+        # a running commit for job 1
+        running = commitClass.__new__(commitClass)
+        running.commandId = 'COMMIT-1-2'
+        running.jobId = 1
+        running.changeSetPath = self.workDir + '/running.ccs'
+        running.trove = troves[1]
+        running.job = None
+        open(running.changeSetPath, 'w').close()
+        w.commands.append(running)
+
+        w.stopCommits(1)
+        self.assertEquals([ x[2][0] for x in w.listQueuedCommands() ],
+                          ['COMMIT-2'])
+        assert(not os.path.exists(self.workDir + '/1.ccs'))
+        assert(not os.path.exists(running.changeSetPath))
+        assert(os.path.exists(self.workDir + '/2.ccs'))
+        self.assertEquals(w.runCommand._mock.calls[0][0][:4],
+                (command.StopCommand, w.cfg, 'STOP-COMMIT-1-2-1', running))
+        self.assertEquals(len(troves[1].troveFailed._mock.calls), 2)
+        troves[2].troveFailed._mock.assertNotCalled()
+
+        # stopping everything drops the rest
+        w.commands.remove(running)
+        w.stopAllCommands()
+        self.assertEquals(w.listQueuedCommands(), [])
+        assert(not os.path.exists(self.workDir + '/2.ccs'))
+        troves[2].troveFailed._mock.assertCalled('Stop requested')
+
+    def testCommitCommand(self):
+        from conary import conaryclient
+        from conary.repository import changeset
+        from conary.repository import errors as reposerrors
+        trv = self.newBuildTrove(1, *self.makeTroveTuple('foo:source'))
+        mock.mockMethod(trv.troveBuilt)
+        troveTup = self.makeTroveTuple('foo:runtime')
+        cs = mock.MockObject()
+        cs.iterNewTroveList._mock.setDefaultReturn(
+            [ mock.MockObject(getNewNameVersionFlavor=lambda: troveTup) ])
+        self.mock(changeset, 'ChangeSetFromFile', lambda path: cs)
+        errorList = []
+        committed = []
+        class Repos(object):
+            def commitChangeSet(self, cs):
+                if errorList:
+                    raise errorList.pop(0)
+                committed.append(cs)
+        class Client(object):
+            def __init__(self, cfg):
+                pass
+            def getRepos(self):
+                return Repos()
+        self.mock(conaryclient, 'ConaryClient', Client)
+
+        csPath = self.workDir + '/foo.ccs'
+        def _makeCommand():
+            open(csPath, 'w').close()
+            cmd = command.CommitCommand(self.rmakeCfg, 'COMMIT-1', 1,
+                                        mock.MockObject(), self.buildCfg,
+                                        trv, csPath)
+            cmd.logger = mock.MockObject()
+            cmd.retryDelay = 0
+            return cmd
+
+        # connection errors are retried
+        errorList[:] = [ reposerrors.OpenError('down'),
+                         socket.error(111, 'Connection refused') ]
+        cmd = _makeCommand()
+        cmd.runAttachedCommand()
+        self.assertEquals(committed, [cs])
+        self.assertEquals(errorList, [])
+        trv.troveBuilt._mock.assertCalled([troveTup])
+        assert(not os.path.exists(csPath))
+
+        # up to commitRetries times
+        del committed[:]
+        errorList[:] = [ reposerrors.OpenError('down') ] * 4
+        cmd = _makeCommand()
+        self.assertRaises(reposerrors.OpenError, cmd.runAttachedCommand)
+        self.assertEquals(committed, [])
+        self.assertEquals(len(errorList), 0)
+        trv.troveBuilt._mock.assertNotCalled()
+        assert(not os.path.exists(csPath))
+
+        # someone else committed the same trove first
+        mock.mockMethod(trv.troveDuplicate)
+        errorList[:] = [ command.CommitError('foo already exists') ]
+        cmd = _makeCommand()
+        cmd.runAttachedCommand()
+        trv.troveDuplicate._mock.assertCalled([troveTup])
+        trv.troveBuilt._mock.assertNotCalled()
+
+        # our first attempt got through but its reply was lost
+        errorList[:] = [ socket.error(104, 'Connection reset by peer'),
+                         command.CommitError('foo already exists') ]
+        cmd = _makeCommand()
+        cmd.runAttachedCommand()
+        trv.troveBuilt._mock.assertCalled([troveTup])
+        trv.troveDuplicate._mock.assertNotCalled()
+        assert(not os.path.exists(csPath))